@@ -16,6 +16,9 @@ class DataFileAdmin(admin.ModelAdmin):
             process_files.delay(obj.id, obj.file_type)
         elif 'stored_file' in form.changed_data:
             super(DataFileAdmin, self).save_model(request, obj, form, change)
+            ## New file: drop what was loaded (and checkpointed)
+            ## from the old one before loading it again.
+            obj.reset_processing()
             process_files.delay(obj.id, obj.file_type)
         else:
             super(DataFileAdmin, self).save_model(request, obj, form, change)
@@ -0,0 +1,87 @@
+"""Precompressed GeoJSON downloads.
+
+Once a DataFile has been processed, its whole FeatureCollection is
+written to storage once, gzipped and (if the brotli package is
+installed) brotli-compressed. Full downloads are served straight from
+those files instead of being rebuilt from the database. Artifacts are
+named for DataFile.version, so a reprocessed file gets new ones and the
+old ones are removed."""
+import gzip
+import os
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+from .export import feature_collection
+from .models import Feature
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ARTIFACT_DIR = "uploads/mapfiles/geojson"
+
+## Content-Encoding -> file suffix
+ENCODINGS = (("br", ".geojson.br"),
+             ("gzip", ".geojson.gz"))
+
+
+def artifact_path(datafile, encoding):
+    suffix = dict(ENCODINGS)[encoding]
+    return "{0}/{1}/{2}{3}".format(ARTIFACT_DIR, datafile.id, datafile.version, suffix)
+
+def available_encodings():
+    return [encoding for encoding, _ in ENCODINGS
+            if encoding != "br" or brotli is not None]
+
+def find_artifact(datafile, accept_encoding):
+    """(encoding, path) of the best stored artifact the client accepts,
+    or (None, None)."""
+    accepted = [value.split(';')[0].strip() for value in accept_encoding.split(',')]
+    for encoding in available_encodings():
+        if encoding in accepted:
+            path = artifact_path(datafile, encoding)
+            if default_storage.exists(path):
+                return encoding, path
+    return None, None
+
+def build_artifacts(datafile):
+    """Write the datafile's compressed FeatureCollections in one pass
+    over its features, and delete those of earlier versions. Returns
+    the paths written."""
+    features = Feature.objects.filter(datafile=datafile)
+    encodings = available_encodings()
+    temp_files = dict((encoding, tempfile.TemporaryFile()) for encoding in encodings)
+    try:
+        gzip_file = gzip.GzipFile(fileobj=temp_files["gzip"], mode='wb')
+        compressor = brotli.Compressor() if "br" in temp_files else None
+        for text in feature_collection(features):
+            data = text.encode('utf-8')
+            gzip_file.write(data)
+            if compressor is not None:
+                temp_files["br"].write(compressor.process(data))
+        gzip_file.close()
+        if compressor is not None:
+            temp_files["br"].write(compressor.finish())
+
+        remove_artifacts(datafile)
+        paths = []
+        for encoding, temp_file in temp_files.items():
+            temp_file.seek(0)
+            paths.append(default_storage.save(artifact_path(datafile, encoding),
+                                              File(temp_file)))
+        return paths
+    finally:
+        for temp_file in temp_files.values():
+            temp_file.close()
+
+def remove_artifacts(datafile):
+    """Delete every artifact stored for the datafile, any version."""
+    directory = "{0}/{1}".format(ARTIFACT_DIR, datafile.id)
+    if not default_storage.exists(directory):
+        return
+    _, filenames = default_storage.listdir(directory)
+    for filename in filenames:
+        default_storage.delete(os.path.join(directory, filename))
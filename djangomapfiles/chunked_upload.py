@@ -0,0 +1,152 @@
+"""Resumable, chunked file uploads.
+
+A client starts an upload (declaring the file's name, type and size),
+then sends the file as a series of raw chunks, each with its offset and
+an md5 checksum. Chunks are streamed straight to a part file, so the web
+worker never holds more than one read block in memory. When every byte
+has arrived the part file is moved into place as a new DataFile's
+stored_file and handed to process_files."""
+import hashlib
+import os
+import uuid
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+
+from .models import DataFile, ChunkedUpload
+
+## How much of a chunk is read from the request at a time
+READ_BLOCK = 64 * 1024
+
+
+class ChunkedUploadError(Exception):
+    pass
+
+
+class AssembledFile(File):
+    """The finished part file. Having a temporary_file_path lets
+    FileSystemStorage move it into place instead of copying it."""
+
+    def __init__(self, path):
+        super(AssembledFile, self).__init__(open(path, 'rb'))
+        self.path = path
+
+    def temporary_file_path(self):
+        return self.path
+
+
+def max_upload_size():
+    return int(getattr(settings, "MAPFILES_MAX_CHUNKED_UPLOAD_MB", 2048)) * 1024 * 1024
+
+def max_chunk_size():
+    return int(getattr(settings, "MAPFILES_UPLOAD_CHUNK_MB", 5)) * 1024 * 1024
+
+
+def start_upload(upload):
+    """Give a new (unsaved) ChunkedUpload its id and an empty part file."""
+    if upload.total_size > max_upload_size():
+        raise ChunkedUploadError("This file is too large: max file size is {}MB".format(
+            max_upload_size() // (1024 * 1024)))
+    upload.upload_id = uuid.uuid4().hex
+    part_dir = os.path.dirname(upload.part_path)
+    if not os.path.isdir(part_dir):
+        os.makedirs(part_dir)
+    open(upload.part_path, 'wb').close()
+    upload.save()
+    return upload
+
+
+def write_chunk(upload, stream, offset, length, checksum):
+    """Append `length` bytes read from `stream` at `offset`.
+
+    Chunks must arrive in order: a client that loses track can ask for
+    `upload.received` and carry on from there. If the chunk comes up
+    short or its md5 doesn't match `checksum`, it's thrown away.
+
+    The upload's row is locked while the chunk is written, so a retried
+    chunk racing the original waits for it and is then turned away
+    instead of both appending to the part file."""
+    with transaction.atomic():
+        locked = ChunkedUpload.objects.select_for_update().get(id=upload.id)
+        _write_chunk(locked, stream, offset, length, checksum)
+    upload.received = locked.received
+    upload.datafile_id = locked.datafile_id
+    return upload
+
+def _write_chunk(upload, stream, offset, length, checksum):
+    if upload.datafile_id:
+        raise ChunkedUploadError("This upload is already complete.")
+    if offset != upload.received:
+        raise ChunkedUploadError("Expected a chunk at offset {}.".format(upload.received))
+    if length > max_chunk_size():
+        raise ChunkedUploadError("Chunks may be at most {} bytes.".format(max_chunk_size()))
+    if offset + length > upload.total_size:
+        raise ChunkedUploadError("Chunk runs past the declared file size.")
+
+    path = upload.part_path
+    ## Drop anything left over from an earlier, failed attempt at this chunk.
+    if os.path.getsize(path) != offset:
+        os.truncate(path, offset)
+
+    digest = hashlib.md5()
+    remaining = length
+    with open(path, 'ab') as part:
+        while remaining:
+            block = stream.read(min(READ_BLOCK, remaining))
+            if not block:
+                break
+            digest.update(block)
+            part.write(block)
+            remaining -= len(block)
+
+    if remaining or digest.hexdigest() != checksum.lower():
+        os.truncate(path, offset)
+        raise ChunkedUploadError("Chunk was incomplete or its checksum did not match.")
+
+    upload.received = offset + length
+    upload.save(update_fields=['received'])
+
+
+def finish_upload(upload):
+    """Check the assembled file and turn it into a DataFile. Returns
+    (datafile, created): created is False if an earlier request already
+    finished the upload. Like write_chunk, this holds the upload's row
+    locked, so only one request ever creates the DataFile."""
+    with transaction.atomic():
+        locked = ChunkedUpload.objects.select_for_update().get(id=upload.id)
+        datafile, created = _finish_upload(locked)
+    upload.received = locked.received
+    upload.datafile = datafile
+    return datafile, created
+
+def _finish_upload(upload):
+    if upload.datafile_id:
+        return upload.datafile, False
+    if upload.received != upload.total_size:
+        raise ChunkedUploadError("Only {0} of {1} bytes have been uploaded.".format(
+            upload.received, upload.total_size))
+
+    if upload.checksum:
+        digest = hashlib.sha256()
+        with open(upload.part_path, 'rb') as part:
+            for block in iter(lambda: part.read(READ_BLOCK), b''):
+                digest.update(block)
+        if digest.hexdigest() != upload.checksum.lower():
+            raise ChunkedUploadError("File checksum did not match.")
+
+    datafile = DataFile(name=upload.name,
+                        file_type=upload.file_type,
+                        encoding=upload.encoding)
+    assembled = AssembledFile(upload.part_path)
+    try:
+        datafile.stored_file.save(upload.filename, assembled, save=True)
+    finally:
+        assembled.close()
+    ## Storage backends that copy rather than move leave this behind.
+    if os.path.exists(upload.part_path):
+        os.remove(upload.part_path)
+
+    upload.datafile = datafile
+    upload.save(update_fields=['datafile'])
+    return datafile, True
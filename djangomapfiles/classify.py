@@ -0,0 +1,116 @@
+"""Choropleth classes for a numeric field of a DataFile.
+
+A field's values are loaded as one NumPy array, split into classes by
+quantile, equal-interval or Jenks natural breaks, and each feature gets
+the index of its class. The result is small (the breaks plus two
+parallel arrays of feature ids and class indexes), so the viewer never
+needs the values themselves. Results are cached per DataFile.version,
+so reprocessing a file makes them stale on its own."""
+import numpy as np
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Feature
+
+METHODS = ("quantile", "equal_interval", "jenks")
+
+## Fisher-Jenks takes classes * n^2 steps, so bigger columns
+## are classified from this many evenly spaced order statistics.
+JENKS_SAMPLE_SIZE = 1000
+
+
+class ClassificationError(Exception):
+    pass
+
+
+def quantile_breaks(values, classes):
+    return np.percentile(values, np.linspace(0, 100, classes + 1))
+
+def equal_interval_breaks(values, classes):
+    return np.linspace(values.min(), values.max(), classes + 1)
+
+def jenks_breaks(values, classes, sample_size=JENKS_SAMPLE_SIZE):
+    """Natural breaks: the split into `classes` runs of the sorted
+    values with the least total squared deviation from the run means
+    (Fisher's exact dynamic programming method)."""
+    x = np.sort(values)
+    if len(x) > sample_size:
+        x = x[np.linspace(0, len(x) - 1, sample_size).astype(int)]
+    n = len(x)
+    classes = min(classes, n)
+    s1 = np.concatenate(([0.0], np.cumsum(x)))
+    s2 = np.concatenate(([0.0], np.cumsum(x * x)))
+
+    def ssd(first, last):
+        """Squared deviation of x[first:last + 1] (first may be an array)."""
+        total = s1[last + 1] - s1[first]
+        return s2[last + 1] - s2[first] - total * total / (last - first + 1)
+
+    ## cost[j]: least deviation of x[:j + 1] split into c + 1 classes;
+    ## starts[c][j]: where the last of those classes starts.
+    cost = np.array([ssd(0, j) for j in range(n)])
+    starts = np.zeros((classes, n), dtype=int)
+    for c in range(1, classes):
+        new_cost = np.full(n, np.inf)
+        for j in range(c, n):
+            first = np.arange(c, j + 1)
+            candidates = cost[first - 1] + ssd(first, j)
+            best = candidates.argmin()
+            new_cost[j] = candidates[best]
+            starts[c][j] = first[best]
+        cost = new_cost
+
+    ## Walk back from the last value to find where each class starts
+    lower_bounds = []
+    last = n - 1
+    for c in range(classes - 1, 0, -1):
+        first = starts[c][last]
+        lower_bounds.append(x[first])
+        last = first - 1
+    return np.array([x[0]] + lower_bounds[::-1] + [x[-1]])
+
+BREAKS = {"quantile": quantile_breaks,
+          "equal_interval": equal_interval_breaks,
+          "jenks": jenks_breaks}
+
+
+def classify_values(values, method, classes):
+    """Return (breaks, class index per value). A value equal to an
+    inner break falls in the class above it."""
+    breaks = BREAKS[method](values, classes)
+    indexes = np.searchsorted(breaks[1:-1], values, side='right')
+    return breaks, indexes
+
+def classify(datafile, field_name, method="quantile", classes=5):
+    """Classify a DataFile's numeric field; see the module docstring
+    for what comes back. Raises ClassificationError for a field
+    that isn't numeric or a method we don't have."""
+    if method not in METHODS:
+        raise ClassificationError("method must be one of: {}".format(", ".join(METHODS)))
+    field = datafile.datafield_set.filter(field_name=field_name).first()
+    if field is None or field.attr_type not in ("int", "float"):
+        raise ClassificationError("{} is not a numeric field.".format(field_name))
+
+    key = "mapfiles:classes:{0}:{1}:{2}:{3}:{4}".format(
+        datafile.id, datafile.version, field_name, method, classes)
+    result = cache.get(key)
+    if result is not None:
+        return result
+
+    rows = Feature.objects.filter(datafile=datafile).property_values(field_name)
+    ids = np.array([feat_id for feat_id, _ in rows], dtype=np.int64)
+    values = np.array([value for _, value in rows], dtype=np.float64)
+    if len(values):
+        breaks, indexes = classify_values(values, method, classes)
+    else:
+        breaks, indexes = np.array([]), np.array([], dtype=int)
+    result = {"field": field_name,
+              "method": method,
+              "version": datafile.version,
+              "breaks": breaks.tolist(),
+              "ids": ids.tolist(),
+              "classes": indexes.tolist()}
+    cache.set(key, result,
+              getattr(settings, "MAPFILES_CLASSIFY_CACHE_TIMEOUT", 60 * 60 * 24 * 7))
+    return result
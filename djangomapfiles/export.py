@@ -0,0 +1,148 @@
+"""Write a DataFile's features out as a GeoJSON FeatureCollection.
+
+The collection is produced as a stream of text chunks: features are
+read from the database a chunk at a time by id (keyset pagination, not
+OFFSET), so memory stays the same however many features there are.
+
+On PostgreSQL each feature's GeoJSON is built by PostGIS (ST_AsGeoJSON)
+and comes back as text, properties included, so no GEOS objects are made
+at all; elsewhere the geometries go through GEOS."""
+import json
+from collections import OrderedDict
+
+from django.contrib.gis.geos import Polygon
+from django.db import connections
+from django.db.models import Q
+
+from .models import Boundary, SimplifiedBoundary
+from .file_processors.simplify import band_for_tolerance
+
+GEOMETRY_FIELDS = ("geom_point", "geom_multipoint", "geom_multilinestring",
+                   "geom_multipolygon", "geom_geometrycollection")
+
+CHUNK_SIZE = 500
+
+## ST_AsGeoJSON's own default
+DEFAULT_PRECISION = 9
+
+
+def bbox_polygon(bbox):
+    """'minlon,minlat,maxlon,maxlat' -> Polygon, or ValueError."""
+    values = [float(value) for value in bbox.split(',')]
+    if len(values) != 4:
+        raise ValueError("bbox needs four numbers")
+    return Polygon.from_bbox(values)
+
+def filter_bbox(features, polygon):
+    """Features whose bounding box overlaps the polygon's. Each geometry
+    column is tested on its own so every test can use that column's
+    spatial index. Boundaries are matched in a subquery, so the
+    boundary table's index can be used without joining it in."""
+    polygon.srid = 4326
+    overlaps = Q(boundary_id__in=Boundary.objects.filter(
+        geometry__bboverlaps=polygon).values('id'))
+    for field in GEOMETRY_FIELDS:
+        overlaps |= Q(**{field + "__bboverlaps": polygon})
+    return features.filter(overlaps)
+
+def feature_text(feat_id, geometry_json, properties_json):
+    return '{{"type": "Feature", "id": {0}, "geometry": {1}, "properties": {2}}}'.format(
+        feat_id, geometry_json or "null", properties_json)
+
+def project(properties, fields):
+    return dict((name, properties.get(name)) for name in fields)
+
+def render_geos(features, size, fields=None, precision=None, simplify=None):
+    """[(id, feature text)] for the first `size` features, built in
+    Python from GEOS geometries. `precision` isn't supported here:
+    coordinates are written in full."""
+    rendered = []
+    for feat in features.select_related('boundary')[:size]:
+        geometry = feat.geometry
+        if geometry is not None and simplify:
+            geometry = geometry.simplify(simplify, preserve_topology=True)
+        properties = feat.properties if fields is None else project(feat.properties, fields)
+        rendered.append((feat.id, feature_text(
+            feat.id,
+            geometry.json if geometry is not None else None,
+            json.dumps(properties))))
+    return rendered
+
+def render_postgis(features, size, fields=None, precision=DEFAULT_PRECISION,
+                   simplify=None):
+    """[(id, feature text)] for the first `size` features, with the
+    GeoJSON built by PostGIS. Census
+    features' boundaries are read with a subquery rather than a join
+    so that this works on any Feature queryset.
+
+    When simplifying, census boundaries start from their
+    SimplifiedBoundary for the coarsest band no coarser than
+    `simplify`, where there is one, rather than the full polygon."""
+    table = features.model._meta.db_table
+    params = []
+    boundary_sql = "(SELECT geometry FROM {0} WHERE id = {1}.boundary_id)".format(
+        Boundary._meta.db_table, table)
+    band = band_for_tolerance(simplify) if simplify else None
+    if band is not None:
+        boundary_sql = """(SELECT COALESCE(s.geometry, b.geometry) FROM {0} b
+                           LEFT JOIN {1} s ON s.boundary_id = b.id AND s.zoom = %s
+                               AND s.content_hash = b.content_hash
+                           WHERE b.id = {2}.boundary_id)""".format(
+            Boundary._meta.db_table, SimplifiedBoundary._meta.db_table, table)
+        params.append(band)
+    geometry_sql = "COALESCE({0}, {1})".format(
+        ", ".join('"{0}"."{1}"'.format(table, field) for field in GEOMETRY_FIELDS),
+        boundary_sql)
+    if simplify:
+        geometry_sql = "ST_SimplifyPreserveTopology({}, %s)".format(geometry_sql)
+        params.append(simplify)
+    params.append(precision)
+    select = OrderedDict((('geometry_json', "ST_AsGeoJSON({}, %s)".format(geometry_sql)),
+                          ('properties_json', '"{}"."properties"::text'.format(table))))
+    rows = (features.extra(select=select, select_params=params)
+            .values_list('id', 'geometry_json', 'properties_json')[:size])
+    rendered = []
+    for feat_id, geometry_json, properties_json in rows:
+        if fields is not None:
+            properties_json = json.dumps(project(json.loads(properties_json), fields))
+        rendered.append((feat_id, feature_text(feat_id, geometry_json, properties_json)))
+    return rendered
+
+def feature_collection(features, fields=None, limit=None, chunk_size=CHUNK_SIZE,
+                       precision=DEFAULT_PRECISION, simplify=None, render=None):
+    """Yield the text of a FeatureCollection of `features`, in id order.
+    `fields` picks which properties to include (all by default). With a
+    `limit`, a "next_cursor" member gives the id to continue after, or
+    null if there are no more features.
+
+    `precision` is the number of decimal places in coordinates and
+    `simplify` a tolerance (in degrees) to simplify geometries by.
+    `render` is render_postgis or render_geos; by default the first
+    on PostgreSQL and the second elsewhere."""
+    if render is None:
+        if connections[features.db].vendor == 'postgresql':
+            render = render_postgis
+        else:
+            render = render_geos
+    features = features.order_by('id')
+    yield '{"type": "FeatureCollection", "features": ['
+    written = 0
+    last_id = None
+    while limit is None or written < limit:
+        batch = features if last_id is None else features.filter(id__gt=last_id)
+        size = chunk_size if limit is None else min(chunk_size, limit - written)
+        batch = render(batch, size, fields, precision, simplify)
+        for feat_id, text in batch:
+            yield ("," if written else "") + text
+            written += 1
+        if len(batch) < size:
+            last_id = None
+            break
+        last_id = batch[-1][0]
+
+    if limit is None:
+        yield ']}'
+    else:
+        if last_id is not None and not features.filter(id__gt=last_id).exists():
+            last_id = None
+        yield '], "next_cursor": {}}}'.format(json.dumps(last_id))
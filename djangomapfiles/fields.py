@@ -0,0 +1,30 @@
+"""Custom model fields used by the djangomapfiles models."""
+import json
+
+from django.db import models
+from django.utils import six
+
+
+class JSONField(six.with_metaclass(models.SubfieldBase, models.TextField)):
+    """Holds a JSON document. It's stored as jsonb on PostgreSQL
+    (so it can be queried there) and as plain text everywhere else."""
+
+    def db_type(self, connection):
+        if connection.vendor == 'postgresql':
+            return 'jsonb'
+        return super(JSONField, self).db_type(connection)
+
+    def to_python(self, value):
+        if isinstance(value, six.string_types):
+            if not value:
+                return {}
+            return json.loads(value)
+        return value
+
+    def get_prep_value(self, value):
+        if value is None:
+            return value
+        return json.dumps(value)
+
+    def value_to_string(self, obj):
+        return self.get_prep_value(self._get_val_from_obj(obj))
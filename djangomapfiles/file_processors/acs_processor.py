@@ -1,23 +1,26 @@
 import csv
 import os
-import requests
-import json
+import time
 
-from django.contrib.gis.geos import GEOSGeometry
-
-from djangomapfiles.models import DataFile, Feature, Attribute
+from djangomapfiles.models import DataFile, Feature
+from .base import BaseProcessor
+from .boundaries import BoundaryCache
 from .exceptions import AcsException
+from .feature_writer import FeatureWriter, save_fields
+from .field_types import convert, infer_type, widen
 
 
-class ProcessAcs:
-    
-    def __init__(self, file_type):
-        self.file_type = file_type
+## What the Census Bureau puts in a cell that has no estimate
+ACS_MISSING_VALUES = ("(X)", "-", "N", "**", "***", "*****")
 
-        ## Census Geographic JSON API
-        ## Use the following url to retrieve geographic boundaries:
-        ## http://census.ire.org/geo/1.0/boundary-set/{geography-type}/{geoid}
-        self.ire_census_url = "http://census.ire.org/geo/1.0/boundary-set/{0}/{1}"
+
+class ProcessAcs(BaseProcessor):
+    
+    def __init__(self, file_type, batch_size=500, stats=None):
+        BaseProcessor.__init__(self, file_type, batch_size, stats)
+        ## Boundaries come from the database when we already have them
+        ## and from the configured provider otherwise; see boundaries.py
+        self.boundaries = BoundaryCache()
 
     def get_path(self, file_id):
         """This method performs raw file processing and type-checking
@@ -27,101 +30,137 @@ class ProcessAcs:
         Here we are processing an American Community Survey .csv file."""
      
         self.datafile = DataFile.objects.get(id=file_id)
-        self.datafile.process_note = "Initiated datafile processing."
-        self.datafile.save()
+        self.stats.note(self.datafile, "Initiated datafile processing.")
         self.file_path = self.datafile.stored_file.path
         *file_path, extension = os.path.splitext(self.file_path)
         if extension == ".zip":
-            self.datafile.process_note = "Zip archive found: please unpack zip and upload csv with named fields."
-            self.datafile.save()
+            self.stats.note(self.datafile, "Zip archive found: please unpack zip and upload csv with named fields.", force=True)
             raise AcsException("Please unpack your zip archive and upload a csv.")
 
         elif extension == ".csv":
             self.acs_filepath = self.file_path
             if os.path.exists(self.acs_filepath):
-                self.datafile.process_note = "Located datafile for processing."
-                self.datafile.save()
+                self.stats.note(self.datafile, "Located datafile for processing.")
             else:
                 err_msg = "File does not exist. Was it deleted?"
-                self.datafile.process_note = err_msg
-                self.datafile.save()
-                raise DataFileException("File does not exist")
+                self.stats.note(self.datafile, err_msg, force=True)
+                raise AcsException("File does not exist")
 
         else:
             err_msg = """Exception: this file went down the acs-processing
             path and yet the file extension is neither '.csv' nor
             '.zip'. How did it end up getting processed here?"""
-            self.datafile.process_note = err_msg
-            self.datafile.save()
-            raise DataFileException("Unknown filetype or archive uploaded.")
+            self.stats.note(self.datafile, err_msg, force=True)
+            raise AcsException("Unknown filetype or archive uploaded.")
 
         return self.acs_filepath
 
-    def parse_csv(self, file_path):
+    def read_rows(self, f):
+        # They usually use numeric ids for first row field names.
+        # We are tossing this first row and using the text fields 
+        # instead; IF there are weird results, check that uploaded
+        # file has fieldnames.      
+        _ = next(f)
+        return csv.DictReader(f)
+
+    def column_types(self, file_path):
+        """Read the whole file once for each column's type, so that every
+        value in a column is stored as the same type: one ZIP code with a
+        leading zero keeps the whole column as strings, and one decimal
+        makes it floats. Returns (fieldnames, {field name: attr_type})."""
         with open(file_path, 'r') as f:
-            self.datafile.process_note = "File opened for parsing..."
-            self.datafile.save()
-            feats = 0
-            # They usually use numeric ids for first row field names.
-            # We are tossing this first row and using the text fields 
-            # instead; IF there are weird results, check that uploaded
-            # file has fieldnames.      
-            _ = next(f)
-            dictread = csv.DictReader(f)
+            dictread = self.read_rows(f)
+            fieldnames = dictread.fieldnames
+            column_types = dict((name, None) for name in fieldnames)
             for row in dictread:
-                geo_id = row['Id2']
-                feat = self.process_feature(geo_id)
-                if feat:
-                    feats += 1 
-                    self.process_attributes(feat, row)
-            self.datafile.process_note = "{0} features in file processed.".format(feats)
-            self.datafile.save()
-
-    def process_feature(self, geo_id):
-        feature_type = "Census {}".format(self.file_type)
+                for name in fieldnames:
+                    text = row.get(name)
+                    if text is None or text.strip() in ACS_MISSING_VALUES:
+                        continue
+                    column_types[name] = widen(column_types[name], infer_type(text))
+        return fieldnames, column_types
 
-        if Feature.objects.filter(reference = feature_type, 
-                                  federal_geo_id = geo_id).exists():
-            already_saved_feature = Feature.objects.filter(
-                reference = feature_type, 
-                federal_geo_id = geo_id).first()
-            geo_object = already_saved_feature.geom_multipolygon
-            new_feature = Feature(datafile = self.datafile,
-                                  reference = feature_type,
-                                  federal_geo_id = geo_id,
-                                  geom_multipolygon = geo_object)
-            new_feature.save()
+    def parse_csv(self, file_path):
+        writer = FeatureWriter(self.datafile, self.batch_size,
+                               stats=self.stats)
+        self.stats.note(self.datafile, "Reading column types...")
+        with self.stats.stage('scan'):
+            fieldnames, column_types = self.column_types(file_path)
 
-        else:
-            shape = self.get_geo_boundaries(geo_id)
-            if shape:
-                geo_object = GEOSGeometry(json.dumps(shape))
-                new_feature = Feature(datafile = self.datafile,
-                                      reference = feature_type,
-                                      federal_geo_id = geo_id,
-                                      geom_multipolygon = geo_object)
-                new_feature.save()
-            else:
-                return False
+        with open(file_path, 'r') as f:
+            self.stats.note(self.datafile, "File opened for parsing...")
+            dictread = self.read_rows(f)
+
+            began = time.time()
+            index = 0
+            ## (index, row) for up to batch_size rows at a time, so
+            ## their boundaries can be looked up together.
+            pending = []
+            with self.timing_features():
+                for row in dictread:
+                    ## Rows before the checkpoint were committed by an
+                    ## earlier run.
+                    if index >= writer.resume_position:
+                        pending.append((index, row))
+                        if len(pending) >= self.batch_size:
+                            self.write_rows(writer, pending, column_types)
+                            pending = []
+                    index += 1
+                self.write_rows(writer, pending, column_types)
+                writer.close()
+            self.process_fields(fieldnames, column_types)
+            elapsed = time.time() - began
+            rows_per_second = index / elapsed if elapsed > 0 else 0.0
+            self.stats.note(self.datafile,
+                            "{0} rows read ({1:.0f} rows/sec); {2}".format(
+                                index, rows_per_second, writer.summary()),
+                            force=True)
+
+    def write_rows(self, writer, rows, column_types):
+        """Look up the boundaries of a batch of (index, row) pairs in
+        one go and hand the rows' features to the writer. Only one
+        batch's boundary ids are ever held, however long the file."""
+        if not rows:
+            return
+        with self.stats.stage('boundaries'):
+            self.boundary_map = self.boundaries.get_ids(
+                self.file_type, [row['Id2'] for _, row in rows])
+        for index, row in rows:
+            properties = self.process_values(row, column_types)
+            feat = self.process_feature(row['Id2'], properties)
+            if feat:
+                writer.add(feat, index + 1)
+
+    def process_feature(self, geo_id, properties):
+        feature_type = "Census {}".format(self.file_type)
+        boundary_id = self.boundary_map.get(geo_id)
+        if boundary_id is None:
+            return False
 
+        new_feature = Feature(datafile = self.datafile,
+                              reference = feature_type,
+                              federal_geo_id = geo_id,
+                              boundary_id = boundary_id,
+                              properties = properties)
         return new_feature
-        
-
-    def get_geo_boundaries(self, federal_geo_id):
-        url = self.ire_census_url.format(self.file_type, federal_geo_id)
-        result = requests.get(url)
-        if result.status_code == 200:
-            payload = result.json()
-            shape = payload['simple_shape']
-            return shape
-        else:
-            return False
 
-    def process_attributes(self, feat, attr_dict):
-        for key in attr_dict:
-            attribute = Attribute(feature=feat,
-                                  field_name = key,
-                                  attr_type = "",
-                                  field_value = attr_dict[key])
-            attribute.save()
+    def process_values(self, row, column_types):
+        """Type the values in a row by their columns' types (see
+        column_types); cells without an estimate become None."""
+        properties = {}
+        for name, text in row.items():
+            ## DictReader files cells past the header under None
+            if name is None:
+                continue
+            if text is None or text.strip() in ACS_MISSING_VALUES:
+                properties[name] = None
+            else:
+                properties[name] = convert(text, column_types[name])
+        return properties
+
+    def process_fields(self, fieldnames, column_types):
+        save_fields(self.datafile,
+                    [(name, column_types[name] or "", None, None)
+                     for name in fieldnames])
+        self.stats.count(rows=len(fieldnames))
 
@@ -0,0 +1,54 @@
+"""What the file processors have in common.
+
+Each processor reads features out of one kind of file and hands them
+to a FeatureWriter; the bookkeeping around that loop is the same for
+all of them and lives here."""
+import time
+from contextlib import contextmanager
+
+from django.contrib.gis.geos import MultiLineString
+from django.contrib.gis.geos import MultiPolygon
+
+from djangomapfiles.models import DataFile
+from .metrics import IngestStats
+
+
+def multi_geometry(geometry):
+    """Our Feature model stores polygons and lines in Multi* columns,
+    so single ones have to be wrapped. Anything else is left alone."""
+    if geometry.geom_type == "Polygon":
+        return MultiPolygon(geometry, srid=geometry.srid)
+    elif geometry.geom_type == "LineString":
+        return MultiLineString(geometry, srid=geometry.srid)
+    return geometry
+
+
+class BaseProcessor:
+
+    def __init__(self, file_type, batch_size=500, stats=None):
+        self.file_type = file_type
+        self.batch_size = batch_size
+        self.stats = stats or IngestStats(file_type)
+
+    @contextmanager
+    def timing_features(self):
+        """Time a loop that reads features and writes them: whatever
+        time in it wasn't spent in another stage (inserting, looking
+        up boundaries) went into reading and transforming features."""
+        began = time.time()
+        staged = sum(self.stats.timings.values())
+        try:
+            yield
+        finally:
+            staged = sum(self.stats.timings.values()) - staged
+            self.stats.add_time('transform', time.time() - began - staged)
+
+    def save_geom_type(self, geom_types):
+        """Record the datafile's geometry type: the one its features
+        all share, or GeometryCollection if they're mixed."""
+        if len(geom_types) == 1:
+            geom_type = next(iter(geom_types))
+        else:
+            geom_type = "GeometryCollection"
+        DataFile.objects.filter(id=self.datafile.id).update(geom_type=geom_type)
+        self.datafile.geom_type = geom_type
@@ -0,0 +1,320 @@
+"""Where census boundaries come from.
+
+ACS files carry no geometry, only geo ids, so each geography's boundary
+is looked up in this order:
+
+    1. an in-process LRU of recently used Boundary rows,
+    2. the Boundary table (every boundary ever fetched is kept there),
+    3. the configured BoundaryProvider, usually a remote API.
+
+So once a geography has been loaded, later uploads covering it never
+touch the network. The provider is set with MAPFILES_BOUNDARY_PROVIDER
+(a dotted path) and MAPFILES_BOUNDARY_PROVIDER_OPTIONS (keyword
+arguments for it)."""
+import abc
+import importlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from django.conf import settings
+from django.contrib.gis.geos import GEOSGeometry
+from django.contrib.gis.geos import MultiPolygon
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, transaction
+from django.utils import six, timezone
+
+from djangomapfiles.models import Boundary, Feature
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROVIDER = "djangomapfiles.file_processors.boundaries.IreCensusProvider"
+
+## Geo ids per `IN (...)` lookup; SQLite allows 999 parameters a query
+LOOKUP_CHUNK_SIZE = 500
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def shape_to_geometry(shape):
+    """GeoJSON geometry (a dict) -> MultiPolygon in 4326."""
+    geometry = GEOSGeometry(json.dumps(shape), srid=4326)
+    if geometry.geom_type == "Polygon":
+        geometry = MultiPolygon(geometry, srid=4326)
+    return geometry
+
+
+class BoundaryProvider(six.with_metaclass(abc.ABCMeta, object)):
+    """Fetches boundaries from somewhere outside the database.
+
+    Subclasses must implement fetch(). fetch_many() calls it once per
+    geo id; override it if the source can do better in bulk (see
+    IreCensusProvider). MAPFILES_BOUNDARY_PROVIDER names the subclass
+    to use and MAPFILES_BOUNDARY_PROVIDER_OPTIONS its keyword
+    arguments."""
+
+    @abc.abstractmethod
+    def fetch(self, geography_type, federal_geo_id):
+        """Return the boundary as a MultiPolygon, or None if there
+        isn't one."""
+
+    def fetch_many(self, geography_type, federal_geo_ids):
+        """Return {geo id: MultiPolygon} for the ids that have one."""
+        geometries = {}
+        for geo_id in federal_geo_ids:
+            geometry = self.fetch(geography_type, geo_id)
+            if geometry is not None:
+                geometries[geo_id] = geometry
+        return geometries
+
+
+class NullBoundaryProvider(BoundaryProvider):
+    """Never fetches anything: boundaries come only from the Boundary
+    table, e.g. as loaded by the load_tiger_boundaries command."""
+
+    def fetch(self, geography_type, federal_geo_id):
+        return None
+
+    def fetch_many(self, geography_type, federal_geo_ids):
+        return {}
+
+
+class IreCensusProvider(BoundaryProvider):
+    """Census Geographic JSON API:
+    http://census.ire.org/geo/1.0/boundary-set/{geography-type}/{geoid}
+
+    fetch_many() runs up to `workers` requests at a time over one
+    keep-alive session. Connection errors and 5xx/429 responses are
+    retried `retries` times, backing off exponentially from `backoff`
+    seconds. Lookups that still fail, or get back something that isn't
+    a boundary, are counted in `failures`."""
+
+    def __init__(self, url="http://census.ire.org/geo/1.0/boundary-set/{0}/{1}",
+                 timeout=10, workers=8, retries=3, backoff=0.5):
+        self.url = url
+        self.timeout = timeout
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self._session = None
+        self.failures = 0
+        self._failures_lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            retry = Retry(total=self.retries, backoff_factor=self.backoff,
+                          status_forcelist=(429, 500, 502, 503, 504))
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers,
+                                  max_retries=retry)
+            self._session = requests.Session()
+            self._session.mount("http://", adapter)
+            self._session.mount("https://", adapter)
+        return self._session
+
+    def fetch_shape(self, geography_type, federal_geo_id):
+        """The boundary's GeoJSON, or None. Safe to call from threads:
+        GEOS objects are only built back in the calling thread."""
+        url = self.url.format(geography_type, federal_geo_id)
+        try:
+            result = self.session.get(url, timeout=self.timeout)
+        except requests.RequestException:
+            return self._failed(url, "request failed")
+        if result.status_code == 404:
+            return None
+        if result.status_code != 200:
+            return self._failed(url, "status {}".format(result.status_code))
+        try:
+            return result.json()['simple_shape']
+        except (KeyError, TypeError, ValueError):
+            return self._failed(url, "malformed response")
+
+    def _failed(self, url, reason):
+        with self._failures_lock:
+            self.failures += 1
+        logger.warning("Boundary lookup %s: %s", url, reason)
+        return None
+
+    def fetch(self, geography_type, federal_geo_id):
+        shape = self.fetch_shape(geography_type, federal_geo_id)
+        return None if shape is None else shape_to_geometry(shape)
+
+    def fetch_many(self, geography_type, federal_geo_ids):
+        federal_geo_ids = list(federal_geo_ids)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            shapes = pool.map(lambda geo_id: self.fetch_shape(geography_type, geo_id),
+                              federal_geo_ids)
+            return dict((geo_id, shape_to_geometry(shape))
+                        for geo_id, shape in zip(federal_geo_ids, shapes)
+                        if shape is not None)
+
+
+class FileBoundaryProvider(BoundaryProvider):
+    """Reads boundaries from files laid out like the IRE API:
+    <directory>/<geography-type>/<geoid>.json, holding either the API's
+    payload or a bare GeoJSON geometry. For tests and offline clusters."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def fetch(self, geography_type, federal_geo_id):
+        path = os.path.join(self.directory, geography_type,
+                            "{}.json".format(federal_geo_id))
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            payload = json.load(f)
+        return shape_to_geometry(payload.get('simple_shape', payload))
+
+
+def get_boundary_provider():
+    path = getattr(settings, "MAPFILES_BOUNDARY_PROVIDER", DEFAULT_PROVIDER)
+    options = getattr(settings, "MAPFILES_BOUNDARY_PROVIDER_OPTIONS", {})
+    module_name, class_name = path.rsplit(".", 1)
+    try:
+        provider_class = getattr(importlib.import_module(module_name), class_name)
+    except (ImportError, AttributeError):
+        raise ImproperlyConfigured("Could not load boundary provider {}".format(path))
+    return provider_class(**options)
+
+
+## Boundary rows this worker has used lately, keyed by
+## (geography_type, federal_geo_id). Shared by every BoundaryCache.
+_recent_boundaries = OrderedDict()
+
+class BoundaryCache:
+
+    def __init__(self, provider=None, max_size=None):
+        self.provider = provider or get_boundary_provider()
+        if max_size is None:
+            max_size = getattr(settings, "MAPFILES_BOUNDARY_CACHE_SIZE", 5000)
+        self.max_size = max_size
+        self.fetched = 0
+
+    def _remember(self, key, boundary):
+        _recent_boundaries[key] = boundary
+        _recent_boundaries.move_to_end(key)
+        while len(_recent_boundaries) > self.max_size:
+            _recent_boundaries.popitem(last=False)
+
+    def get(self, geography_type, federal_geo_id):
+        """Return the Boundary for a geography, or None if there is
+        no boundary for it anywhere."""
+        return self.get_many(geography_type, [federal_geo_id]).get(federal_geo_id)
+
+    def get_many(self, geography_type, federal_geo_ids):
+        """Return {geo id: Boundary} for every geo id that has one.
+        Stored boundaries are read LOOKUP_CHUNK_SIZE ids to a query, and
+        everything missing is fetched from the provider in one go and
+        stored in one batch, so the number of queries doesn't grow with
+        the number of rows in a file."""
+        boundaries = {}
+        missing = []
+        for geo_id in set(federal_geo_ids):
+            key = (geography_type, geo_id)
+            if key in _recent_boundaries:
+                _recent_boundaries.move_to_end(key)
+                boundaries[geo_id] = _recent_boundaries[key]
+            else:
+                missing.append(geo_id)
+
+        for chunk in chunked(missing, LOOKUP_CHUNK_SIZE):
+            for boundary in Boundary.objects.filter(geography_type = geography_type,
+                                                    federal_geo_id__in = chunk):
+                boundaries[boundary.federal_geo_id] = boundary
+        missing = [geo_id for geo_id in missing if geo_id not in boundaries]
+
+        if missing:
+            legacy = self._legacy_copies(geography_type, missing)
+            boundaries.update(self._store(geography_type, legacy))
+            missing = [geo_id for geo_id in missing if geo_id not in legacy]
+
+        if missing:
+            geometries = self.provider.fetch_many(geography_type, missing)
+            self.fetched += len(missing)
+            boundaries.update(self._store(geography_type, geometries))
+
+        for geo_id, boundary in boundaries.items():
+            self._remember((geography_type, geo_id), boundary)
+        return boundaries
+
+    def get_ids(self, geography_type, federal_geo_ids):
+        """Like get_many, but returns {geo id: Boundary id} and works
+        through the ids LOOKUP_CHUNK_SIZE at a time, so a whole file's
+        worth of geometries is never in memory at once."""
+        ids = {}
+        for chunk in chunked(list(set(federal_geo_ids)), LOOKUP_CHUNK_SIZE):
+            for geo_id, boundary in self.get_many(geography_type, chunk).items():
+                ids[geo_id] = boundary.id
+        return ids
+
+    def _store(self, geography_type, geometries):
+        """Save fetched geometries as Boundary rows, all at once."""
+        if not geometries:
+            return {}
+        new_boundaries = {}
+        for geo_id, geometry in geometries.items():
+            boundary = Boundary(geography_type = geography_type,
+                                federal_geo_id = geo_id,
+                                geometry = geometry)
+            boundary.content_hash = boundary.compute_hash()
+            new_boundaries[geo_id] = boundary
+        try:
+            with transaction.atomic():
+                Boundary.objects.bulk_create(list(new_boundaries.values()),
+                                             batch_size=500)
+        except IntegrityError:
+            ## Another worker stored some of them first.
+            self._upsert(geography_type, new_boundaries)
+        ## bulk_create doesn't hand back primary keys
+        stored = {}
+        for chunk in chunked(list(geometries), LOOKUP_CHUNK_SIZE):
+            for boundary in Boundary.objects.filter(geography_type = geography_type,
+                                                    federal_geo_id__in = chunk):
+                stored[boundary.federal_geo_id] = boundary
+        return stored
+
+    def _upsert(self, geography_type, new_boundaries):
+        """Store {geo id: unsaved Boundary}, where some geo ids may
+        already have a row. Rows whose content_hash matches are left
+        alone; the rest get the new geometry."""
+        for chunk in chunked(list(new_boundaries), LOOKUP_CHUNK_SIZE):
+            stored = dict(Boundary.objects
+                          .filter(geography_type = geography_type,
+                                  federal_geo_id__in = chunk)
+                          .values_list('federal_geo_id', 'content_hash'))
+            for geo_id in chunk:
+                boundary = new_boundaries[geo_id]
+                if geo_id not in stored:
+                    Boundary.objects.get_or_create(
+                        geography_type = geography_type,
+                        federal_geo_id = geo_id,
+                        defaults = {'geometry': boundary.geometry})
+                elif stored[geo_id] != boundary.content_hash:
+                    (Boundary.objects
+                     .filter(geography_type = geography_type,
+                             federal_geo_id = geo_id)
+                     .update(geometry = boundary.geometry,
+                             content_hash = boundary.content_hash,
+                             updated = timezone.now()))
+
+    def _legacy_copies(self, geography_type, federal_geo_ids):
+        """Files loaded before boundaries were shared each kept a copy."""
+        geometries = {}
+        for chunk in chunked(federal_geo_ids, LOOKUP_CHUNK_SIZE):
+            geometries.update(Feature.objects
+                              .filter(reference = "Census {}".format(geography_type),
+                                      federal_geo_id__in = chunk,
+                                      geom_multipolygon__isnull = False)
+                              .values_list('federal_geo_id', 'geom_multipolygon'))
+        return geometries
@@ -16,3 +16,6 @@ class AcsException(ProcessingException):
 
 class FileTooLarge(ProcessingException):
     pass
+
+class GeoJsonException(ProcessingException):
+    pass
@@ -0,0 +1,118 @@
+"""Batched writer for Features.
+
+Processors hand this guy unsaved Feature objects (with their field
+values already in Feature.properties) and it writes them with
+bulk_create in chunks, one transaction per chunk, instead of one
+INSERT per row.
+
+Each chunk also moves the datafile's IngestCheckpoint forward in
+the same transaction, so a restarted job never writes a feature twice."""
+import time
+
+from django.db import transaction
+
+from djangomapfiles.models import DataField, Feature, IngestCheckpoint
+from .exceptions import ProcessingException
+
+
+def save_fields(datafile, fields):
+    """Replace the DataField rows describing a datafile's fields.
+    `fields` is a list of (field_name, attr_type, width, precision)."""
+    DataField.objects.filter(datafile=datafile).delete()
+    DataField.objects.bulk_create([
+        DataField(datafile=datafile,
+                  field_name=name,
+                  attr_type=attr_type,
+                  width=width,
+                  precision=precision,
+                  position=position)
+        for position, (name, attr_type, width, precision) in enumerate(fields)])
+
+
+class FeatureWriter:
+
+    def __init__(self, datafile, batch_size=500, start=0, stats=None,
+                 shared_progress=False, chunk_size=None):
+        """`start` identifies the range of the file this writer is
+        loading and `chunk_size` the size of the ranges the file was
+        split into, None if it isn't (see IngestCheckpoint). A
+        checkpoint left by a load split another way can't be resumed
+        from, and raises ProcessingException. Inserts are timed and
+        counted on `stats` (an IngestStats), if given.
+
+        Set `shared_progress` when other writers are loading other
+        ranges of the same file at the same time: progress notes then
+        count what every range has committed, not just this one."""
+        self.datafile = datafile
+        self.batch_size = batch_size
+        self.stats = stats
+        self.shared_progress = shared_progress
+        self.pending = []
+        self.features_written = 0
+        self.started = time.time()
+        self.checkpoint, _ = IngestCheckpoint.objects.get_or_create(
+            datafile=datafile, start=start,
+            defaults={'position': start, 'chunk_size': chunk_size})
+        if self.checkpoint.chunk_size != chunk_size:
+            raise ProcessingException(
+                "Checkpoint for {0} was made loading chunks of {1}, not {2}.".format(
+                    datafile, self.checkpoint.chunk_size, chunk_size))
+        self.position = self.checkpoint.position
+
+    def _get_resume_position(self):
+        """Index of the first feature/row not yet committed."""
+        return self.checkpoint.position
+    resume_position = property(_get_resume_position)
+
+    def add(self, feature, position):
+        """Buffer a feature. `position` is the index just past the
+        feature (or csv row) it came from."""
+        self.pending.append(feature)
+        self.position = position
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        began = time.time()
+        with transaction.atomic():
+            Feature.objects.bulk_create(self.pending)
+            self.checkpoint.position = self.position
+            IngestCheckpoint.objects.filter(id=self.checkpoint.id).update(
+                position=self.position)
+        self.features_written += len(self.pending)
+        if self.stats:
+            self.stats.add_time('insert', time.time() - began)
+            self.stats.count(features=len(self.pending),
+                             rows=len(self.pending))
+            ## Counting every range's progress takes a query, so
+            ## only do it when the note is going to be written.
+            if not self.shared_progress:
+                self.stats.note(self.datafile, "{0} features loaded...".format(
+                    self.features_written))
+            elif self.stats.note_due():
+                self.stats.note(self.datafile, "{0} features loaded...".format(
+                    self.committed()))
+        self.pending = []
+
+    def committed(self):
+        """Features committed so far across all of the datafile's
+        ranges, from their IngestCheckpoints."""
+        return sum(position - start for start, position in
+                   IngestCheckpoint.objects.filter(datafile=self.datafile)
+                   .values_list('start', 'position'))
+
+    def close(self):
+        self.flush()
+
+    def _features_per_second(self):
+        elapsed = time.time() - self.started
+        if elapsed <= 0:
+            return 0.0
+        return self.features_written / elapsed
+    features_per_second = property(_features_per_second)
+
+    def summary(self):
+        return "{0} features in file processed ({1:.0f} features/sec).".format(
+            self.features_written, self.features_per_second)
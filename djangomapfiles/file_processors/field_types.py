@@ -0,0 +1,93 @@
+"""Field types for Feature.properties.
+
+Values are stored as typed JSON (numbers as numbers, missing values as
+null, dates as ISO strings), and each DataField records one of the
+types below, so that numeric and date fields can be filtered and
+summed in the database (see FeatureQuerySet)."""
+import datetime
+import math
+
+INTEGER = "int"
+REAL = "float"
+DATE = "date"
+DATETIME = "datetime"
+BOOLEAN = "bool"
+STRING = "str"
+
+## OGR field type names -> our types
+OGR_FIELD_TYPES = {"OFTInteger": INTEGER,
+                   "OFTInteger64": INTEGER,
+                   "OFTReal": REAL,
+                   "OFTDate": DATE,
+                   "OFTDateTime": DATETIME,
+                   "OFTString": STRING,
+                   "OFTWideString": STRING,
+                   "OFTTime": STRING}
+
+
+def json_value(value):
+    """Make a value read from a data file fit to store in JSON.
+    NaN and infinity have no JSON form, so they become None."""
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+def infer_type(text):
+    """The narrowest type that holds a value read from a csv, or None
+    for an empty cell. Anything with a leading zero (like the geo ids
+    in ACS files) is a string, or it'd lose its zeros, and so are "nan"
+    and "inf", which aren't numbers JSON can hold. A column's type is
+    every one of its values' types widened together (see widen)."""
+    text = text.strip()
+    if not text:
+        return None
+    if len(text) > 1 and text[0] == "0" and text[1] != ".":
+        return STRING
+    try:
+        int(text)
+        return INTEGER
+    except ValueError:
+        pass
+    try:
+        number = float(text)
+    except ValueError:
+        return STRING
+    return REAL if math.isfinite(number) else STRING
+
+def convert(text, attr_type):
+    """Turn a value read from a csv into a value of its column's type,
+    so that every value in a column is stored the same way."""
+    text = text.strip()
+    if not text:
+        return None
+    if attr_type == INTEGER:
+        return int(text)
+    if attr_type == REAL:
+        return float(text)
+    return text
+
+def value_type(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return BOOLEAN
+    if isinstance(value, int):
+        return INTEGER
+    if isinstance(value, float):
+        return REAL
+    return STRING
+
+def widen(current, new):
+    """Return the narrowest type that holds values of both types:
+    ints and floats make floats, any other mix makes strings."""
+    if current is None or current == new:
+        return new
+    if new is None:
+        return current
+    if set((current, new)) == set((INTEGER, REAL)):
+        return REAL
+    return STRING
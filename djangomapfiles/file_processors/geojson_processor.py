@@ -0,0 +1,263 @@
+"""This module processes GeoJSON files: either a FeatureCollection
+('geojson') or a text sequence with one feature per line ('geojsonseq').
+
+Neither is ever loaded whole. Sequences are read a line at a time, and
+a FeatureCollection's "features" array is decoded one feature at a time
+from a sliding buffer (see FeatureCollectionReader), so files bigger
+than memory load fine; one feature may be at most
+MAPFILES_GEOJSON_MAX_FEATURE_MB megabytes of text. Property names are kept as they are, which
+shapefiles can't do past 10 characters."""
+import json
+import os
+
+from django.conf import settings
+from django.contrib.gis.geos import GEOSGeometry
+
+from djangomapfiles.models import DataFile, Feature
+from .base import BaseProcessor, multi_geometry
+from .exceptions import GeoJsonException
+from .feature_writer import FeatureWriter, save_fields
+from .field_types import value_type, widen
+
+
+GEOMETRY_FIELDS = {"Point": "geom_point",
+                   "MultiPoint": "geom_multipoint",
+                   "LineString": "geom_multilinestring",
+                   "MultiLineString": "geom_multilinestring",
+                   "Polygon": "geom_multipolygon",
+                   "MultiPolygon": "geom_multipolygon",
+                   "GeometryCollection": "geom_geometrycollection"}
+
+## RFC 8142 sequences start each record with an ASCII record separator
+RECORD_SEPARATOR = "\x1e"
+
+## A decoding error this close to the end of the buffer may just mean
+## the value carries on in the next block; anything earlier is malformed.
+TRUNCATION_SLACK = 32
+
+
+def non_finite(name):
+    """json accepts NaN and Infinity, which aren't JSON and can't go
+    in a jsonb column; like json_value, we store them as null."""
+    return None
+
+def max_feature_size():
+    return int(getattr(settings, "MAPFILES_GEOJSON_MAX_FEATURE_MB", 64)) * 1024 * 1024
+
+def _xy(coordinates):
+    if coordinates and isinstance(coordinates[0], (int, float)):
+        return coordinates[:2]
+    return [_xy(part) for part in coordinates or []]
+
+def two_dimensional(geojson_geometry):
+    """A copy of a GeoJSON geometry with any altitudes dropped, since
+    our geometry columns are 2D."""
+    if geojson_geometry.get("type") == "GeometryCollection":
+        return dict(geojson_geometry,
+                    geometries=[two_dimensional(part) for part in
+                                geojson_geometry.get("geometries") or []])
+    return dict(geojson_geometry, coordinates=_xy(geojson_geometry.get("coordinates")))
+
+
+class FeatureCollectionReader:
+    """Pulls the members of a FeatureCollection's "features" array out of
+    a text stream one at a time. Only the feature being decoded (and
+    whatever is left of the last block read) is held in memory, and a
+    feature longer than `max_size` characters raises GeoJsonException
+    rather than being read whole."""
+
+    def __init__(self, stream, block_size=64 * 1024, max_size=None):
+        self.stream = stream
+        self.block_size = block_size
+        self.max_size = max_size or max_feature_size()
+        self.decoder = json.JSONDecoder(parse_constant=non_finite)
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """Drop what's been consumed and read more. The read grows with
+        the buffer, so one huge feature doesn't get re-decoded over and
+        over a block at a time."""
+        if self.eof:
+            return False
+        if len(self.buf) - self.pos > self.max_size:
+            raise GeoJsonException(
+                "Invalid GeoJSON: a feature is over {} characters long".format(
+                    self.max_size))
+        block = self.stream.read(max(self.block_size, len(self.buf) - self.pos))
+        if not block:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + block
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        """Skip whitespace and return the next character ('' at the end)."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise GeoJsonException("Invalid GeoJSON: expected '{}'".format(char))
+        self.pos += 1
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError as e:
+                if not self._truncated(e) or not self._fill():
+                    raise GeoJsonException("Invalid or truncated GeoJSON: {}".format(e))
+                continue
+            ## A number at the very end of the buffer may continue
+            ## in the next block.
+            if end == len(self.buf) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def _truncated(self, error):
+        """Whether a decoding error could just be the buffer ending
+        partway through a value, so that reading more might fix it."""
+        pos = getattr(error, 'pos', None)
+        if pos is None or getattr(error, 'msg', "").startswith("Unterminated string"):
+            return True
+        return pos >= len(self.buf) - TRUNCATION_SLACK
+
+    def features(self):
+        self._expect("{")
+        if self._peek() == "}":
+            return
+        while True:
+            key = self._value()
+            self._expect(":")
+            if key == "features":
+                self._expect("[")
+                if self._peek() == "]":
+                    self.pos += 1
+                else:
+                    while True:
+                        yield self._value()
+                        if self._peek() != ",":
+                            break
+                        self.pos += 1
+                    self._expect("]")
+            else:
+                ## "type", "crs", "bbox" and so on: small, and unused.
+                self._value()
+            if self._peek() != ",":
+                break
+            self.pos += 1
+        self._expect("}")
+
+
+class ProcessGeoJson(BaseProcessor):
+
+    def get_path(self, file_id):
+        """This method performs raw file processing and type-checking
+        only. For the methods that import the data into the database once
+        the file has been retrieved, see below."""
+        self.datafile = DataFile.objects.get(id=file_id)
+        self.stats.note(self.datafile, "Initiated datafile processing.")
+        self.file_path = self.datafile.stored_file.path
+
+        if self.file_type not in ("geojson", "geojsonseq"):
+            err_msg = """Exception: this file went down the geojson-processing
+            path and yet the file type is listed as neither 'geojson' nor
+            'geojsonseq'. How did it end up getting processed here?"""
+            self.stats.note(self.datafile, err_msg, force=True)
+            raise GeoJsonException("Unknown filetype uploaded.")
+        if not os.path.exists(self.file_path):
+            self.stats.note(self.datafile, "File does not exist. Was it deleted?", force=True)
+            raise GeoJsonException("File does not exist")
+
+        return self.file_path
+
+    def sequence_features(self, stream):
+        for number, line in enumerate(stream, 1):
+            line = line.strip().lstrip(RECORD_SEPARATOR)
+            if not line:
+                continue
+            try:
+                feature = json.loads(line, parse_constant=non_finite)
+            except ValueError as e:
+                self.stats.note(self.datafile, "Invalid GeoJSON on line {0}: {1}".format(
+                    number, e), force=True)
+                raise GeoJsonException("Invalid GeoJSON on line {}".format(number))
+            yield feature
+
+    def collection_features(self, stream):
+        try:
+            for feature in FeatureCollectionReader(stream).features():
+                yield feature
+        except GeoJsonException as e:
+            self.stats.note(self.datafile, str(e), force=True)
+            raise
+
+    def feature_geometry(self, geojson_feature):
+        """Return (geometry field, geometry) for the Feature model,
+        or (None, None) if the feature has no geometry."""
+        if geojson_feature.get("type") == "Feature":
+            geojson_geometry = geojson_feature.get("geometry")
+        else:
+            ## A bare geometry, as sequences sometimes hold
+            geojson_geometry = geojson_feature
+        if not geojson_geometry or geojson_geometry.get("type") not in GEOMETRY_FIELDS:
+            return None, None
+
+        geometry = multi_geometry(GEOSGeometry(json.dumps(two_dimensional(geojson_geometry)),
+                                               srid=4326))
+        return GEOMETRY_FIELDS[geojson_geometry["type"]], geometry
+
+    def parse_geojson(self, file_path):
+        self.stats.note(self.datafile, "File opened for parsing...")
+        writer = FeatureWriter(self.datafile, self.batch_size,
+                               stats=self.stats)
+        ## field name -> attr_type, in the order fields are first seen
+        fields = {}
+        field_names = []
+        geom_types = set()
+
+        with self.timing_features(), open(file_path, 'r', encoding='utf-8') as stream:
+            if self.file_type == "geojsonseq":
+                geojson_features = self.sequence_features(stream)
+            else:
+                geojson_features = self.collection_features(stream)
+
+            for index, geojson_feature in enumerate(geojson_features):
+                properties = geojson_feature.get("properties") or {}
+                for name, value in properties.items():
+                    if name not in fields:
+                        field_names.append(name)
+                        fields[name] = None
+                    fields[name] = widen(fields[name], value_type(value))
+
+                geometry_field, geometry = self.feature_geometry(geojson_feature)
+                if geometry is None:
+                    continue
+                geom_types.add(geometry.geom_type)
+                ## Features before the checkpoint were committed by an
+                ## earlier run; we only read them for their fields and
+                ## geometry types.
+                if index < writer.resume_position:
+                    continue
+                args = {}
+                args['datafile'] = self.datafile
+                args[geometry_field] = geometry
+                args['properties'] = properties
+                writer.add(Feature(**args), index + 1)
+            writer.close()
+
+        save_fields(self.datafile,
+                    [(name, fields[name] or "", None, None) for name in field_names])
+        self.stats.count(rows=len(field_names))
+        self.save_geom_type(geom_types)
+        self.stats.note(self.datafile, writer.summary(), force=True)
@@ -0,0 +1,262 @@
+"""This module processes KML and KMZ files.
+
+The KML document is read with an incremental parser, one Placemark at
+a time, and each finished Placemark is thrown away once it has been
+turned into a Feature, so memory stays bounded however large the
+file is. KMZ members are read straight out of the archive.
+
+Placemark names, descriptions and ExtendedData values become the
+feature's properties. Placemarks whose geometry has no usable
+coordinates are skipped, and counted in the final note."""
+import os
+import zipfile
+from contextlib import contextmanager
+from xml.etree import ElementTree
+
+from django.contrib.gis.geos import GeometryCollection
+from django.contrib.gis.geos import LinearRing
+from django.contrib.gis.geos import LineString
+from django.contrib.gis.geos import MultiLineString
+from django.contrib.gis.geos import MultiPoint
+from django.contrib.gis.geos import MultiPolygon
+from django.contrib.gis.geos import Point
+from django.contrib.gis.geos import Polygon
+
+from djangomapfiles.models import DataFile, Feature
+from .base import BaseProcessor, multi_geometry
+from .exceptions import KmlException
+from .feature_writer import FeatureWriter, save_fields
+from .field_types import STRING
+
+
+KML_GEOMETRIES = ("Point", "LineString", "LinearRing",
+                  "Polygon", "MultiGeometry")
+
+
+def local_name(tag):
+    """Strip the namespace: KML comes in a few of them."""
+    return tag.rsplit('}', 1)[-1]
+
+def find_child(elem, name):
+    for child in elem:
+        if local_name(child.tag) == name:
+            return child
+    return None
+
+def find_descendant(elem, name):
+    for child in elem.iter():
+        if local_name(child.tag) == name:
+            return child
+    return None
+
+def parse_coordinates(text):
+    """KML coordinates are 'lon,lat[,alt]' tuples separated by
+    whitespace. Our geometry columns are 2D, so altitude is dropped."""
+    coords = []
+    for tuple_text in (text or "").split():
+        values = tuple_text.split(',')
+        try:
+            coords.append((float(values[0]), float(values[1])))
+        except (IndexError, ValueError):
+            raise KmlException("Invalid KML coordinates: {}".format(tuple_text))
+    return coords
+
+def element_coordinates(elem):
+    """The coordinates of a KML geometry element, [] if it has none."""
+    coordinates = find_descendant(elem, "coordinates")
+    if coordinates is None:
+        return []
+    return parse_coordinates(coordinates.text)
+
+
+class ProcessKml(BaseProcessor):
+
+    def get_path(self, file_id):
+        """This method performs raw file processing and type-checking
+        only. For the methods that import the data into the database once
+        the file has been retrieved, see below.
+
+        We are processing either a 'kml' or a 'kmz'. If it is a KMZ, we
+        check that the archive holds a KML document."""
+        self.datafile = DataFile.objects.get(id=file_id)
+        self.stats.note(self.datafile, "Initiated datafile processing.")
+        self.file_path = self.datafile.stored_file.path
+
+        if self.file_type == "kmz":
+            if not zipfile.is_zipfile(self.file_path):
+                self.stats.note(self.datafile, "Exception raised: Not a valid KMZ archive.", force=True)
+                raise KmlException("Not a valid kmz archive")
+            with zipfile.ZipFile(self.file_path) as zipf:
+                members = [name for name in zipf.namelist()
+                           if os.path.splitext(name)[1].lower() == ".kml"]
+            if not members:
+                self.stats.note(self.datafile, "Exception raised: KMZ archive has no KML document.", force=True)
+                raise KmlException("Not a valid kmz archive")
+            ## The main document is doc.kml by convention; otherwise
+            ## Google Earth takes the first .kml in the archive.
+            self.kml_member = "doc.kml" if "doc.kml" in members else members[0]
+
+        elif self.file_type != "kml":
+            err_msg = """Exception: this file went down the kml-processing
+            path and yet the file type is listed as neither 'kml' nor
+            'kmz'. How did it end up getting processed here?"""
+            self.stats.note(self.datafile, err_msg, force=True)
+            raise KmlException("Unknown filetype or archive uploaded.")
+
+        return self.file_path
+
+    @contextmanager
+    def open_kml(self, file_path):
+        """Open the KML document for reading, in place if it's in a KMZ."""
+        if self.file_type == "kmz":
+            with zipfile.ZipFile(file_path) as zipf:
+                with zipf.open(self.kml_member) as kml:
+                    yield kml
+        else:
+            with open(file_path, 'rb') as kml:
+                yield kml
+
+    def placemarks(self, kml):
+        """Yield each Placemark element as soon as it has been parsed.
+        Once it has been handled, the Placemark is removed from its
+        parent so the parsed tree never grows past one Placemark."""
+        open_elems = []
+        for event, elem in ElementTree.iterparse(kml, events=('start', 'end')):
+            if event == 'start':
+                open_elems.append(elem)
+                continue
+            open_elems.pop()
+            if local_name(elem.tag) == 'Placemark':
+                yield elem
+                if open_elems:
+                    open_elems[-1].remove(elem)
+
+    def placemark_properties(self, placemark):
+        properties = {}
+        for name in ("name", "description"):
+            child = find_child(placemark, name)
+            if child is not None:
+                properties[name] = (child.text or "").strip()
+
+        extended_data = find_child(placemark, "ExtendedData")
+        if extended_data is not None:
+            for elem in extended_data.iter():
+                tag = local_name(elem.tag)
+                ## A value without a name has no field to go in.
+                if tag not in ("Data", "SimpleData") or not elem.get("name"):
+                    continue
+                if tag == "Data":
+                    value = find_child(elem, "value")
+                    properties[elem.get("name")] = "" if value is None else (value.text or "")
+                else:
+                    properties[elem.get("name")] = elem.text or ""
+        return properties
+
+    def kml_geometry(self, elem):
+        """Build a GEOS geometry from a KML geometry element, or None
+        if it doesn't have enough coordinates to make one."""
+        tag = local_name(elem.tag)
+        if tag == "Point":
+            coords = element_coordinates(elem)
+            if not coords:
+                return None
+            return Point(coords[0], srid=4326)
+        elif tag in ("LineString", "LinearRing"):
+            coords = element_coordinates(elem)
+            if len(coords) < 2:
+                return None
+            return LineString(coords, srid=4326)
+        elif tag == "Polygon":
+            rings = {"outerBoundaryIs": [], "innerBoundaryIs": []}
+            for child in elem:
+                if local_name(child.tag) in rings:
+                    coords = element_coordinates(child)
+                    ## Rings need four points, the last the same as the first.
+                    if len(coords) >= 4 and coords[0] == coords[-1]:
+                        rings[local_name(child.tag)].append(LinearRing(coords))
+            if not rings["outerBoundaryIs"]:
+                return None
+            return Polygon(rings["outerBoundaryIs"][0], *rings["innerBoundaryIs"],
+                           srid=4326)
+        elif tag == "MultiGeometry":
+            parts = [self.kml_geometry(child) for child in elem
+                     if local_name(child.tag) in KML_GEOMETRIES]
+            parts = [part for part in parts if part is not None]
+            if not parts:
+                return None
+            return GeometryCollection(*parts, srid=4326)
+        raise KmlException("Unknown KML geometry: {}".format(tag))
+
+    def feature_geometry(self, placemark):
+        """Return (geometry field, geometry) for the Feature model,
+        or (None, None) if the placemark has no geometry."""
+        elem = next((child for child in placemark
+                     if local_name(child.tag) in KML_GEOMETRIES), None)
+        if elem is None:
+            return None, None
+        geometry = self.kml_geometry(elem)
+        if geometry is None:
+            raise KmlException("Placemark has no usable coordinates")
+
+        if geometry.geom_type == "Point":
+            return "geom_point", geometry
+        elif geometry.geom_type == "LineString":
+            return "geom_multilinestring", multi_geometry(geometry)
+        elif geometry.geom_type == "Polygon":
+            return "geom_multipolygon", multi_geometry(geometry)
+
+        ## MultiGeometry: use a Multi* column if the parts allow it.
+        part_types = set(part.geom_type for part in geometry)
+        collections = {"Point": ("geom_multipoint", MultiPoint),
+                       "LineString": ("geom_multilinestring", MultiLineString),
+                       "Polygon": ("geom_multipolygon", MultiPolygon)}
+        if len(part_types) == 1 and part_types.issubset(collections):
+            field, collection = collections[part_types.pop()]
+            return field, collection(*[part for part in geometry], srid=4326)
+        return "geom_geometrycollection", geometry
+
+    def parse_kml(self, file_path):
+        self.stats.note(self.datafile, "File opened for parsing...")
+        writer = FeatureWriter(self.datafile, self.batch_size,
+                               stats=self.stats)
+        field_names = []
+        geom_types = set()
+        skipped = 0
+
+        with self.timing_features(), self.open_kml(file_path) as kml:
+            for index, placemark in enumerate(self.placemarks(kml)):
+                properties = self.placemark_properties(placemark)
+                for name in properties:
+                    if name not in field_names:
+                        field_names.append(name)
+
+                try:
+                    geometry_field, geometry = self.feature_geometry(placemark)
+                except KmlException:
+                    skipped += 1
+                    continue
+                if geometry is None:
+                    continue
+                geom_types.add(geometry.geom_type)
+                ## Placemarks before the checkpoint were committed by an
+                ## earlier run; we only read them for their fields and
+                ## geometry types.
+                if index < writer.resume_position:
+                    continue
+                args = {}
+                args['datafile'] = self.datafile
+                args[geometry_field] = geometry
+                args['properties'] = properties
+                writer.add(Feature(**args), index + 1)
+            writer.close()
+
+        ## KML doesn't declare its fields, so they're only known now.
+        save_fields(self.datafile,
+                    [(name, STRING, None, None) for name in field_names])
+        self.stats.count(rows=len(field_names))
+        self.save_geom_type(geom_types)
+        summary = writer.summary()
+        if skipped:
+            summary += " Placemarks skipped for lack of coordinates: {}.".format(
+                skipped)
+        self.stats.note(self.datafile, summary, force=True)
@@ -0,0 +1,145 @@
+"""Instrumentation for data file processing.
+
+An IngestStats object follows one processing run (or one chunk of
+one): it times the stages of the run, counts what gets written, throttles
+status notes, and when the run is done saves a ProcessingStats record
+and hands that record to the configured metrics sinks.
+
+Sinks are listed by dotted path in MAPFILES_METRICS_SINKS; each is a
+class taking no arguments with an emit(record) method."""
+import importlib
+import logging
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from djangomapfiles.models import DataFile, ProcessingStats
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SINKS = ("djangomapfiles.file_processors.metrics.LoggingSink",)
+
+
+class IngestStats:
+
+    def __init__(self, label="", note_interval=None, started=None):
+        """`started` is when the run began, as a time.time(); now, by
+        default. A chord's callback passes its parent's, so that its
+        record times the whole run."""
+        self.label = label
+        self.timings = {}
+        self.features = 0
+        self.rows = 0
+        self.started = started or time.time()
+        ## Minimum seconds between process_note writes, unless forced
+        if note_interval is None:
+            note_interval = getattr(settings, "MAPFILES_STATUS_INTERVAL", 5.0)
+        self.note_interval = note_interval
+        self._last_note = 0.0
+
+    @contextmanager
+    def stage(self, name):
+        """Time a stage; repeated stages add up."""
+        began = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.time() - began)
+
+    def add_time(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def count(self, features=0, rows=0):
+        self.features += features
+        self.rows += rows
+
+    def note_due(self):
+        """Whether an unforced note would be written now."""
+        return time.time() - self._last_note >= self.note_interval
+
+    def note(self, datafile, text, force=False):
+        """Set the datafile's process_note. It is only written to the
+        database (as a single-column UPDATE) every note_interval seconds,
+        unless `force` is set; error notes should always be forced."""
+        datafile.process_note = text[:255]
+        if force or self.note_due():
+            DataFile.objects.filter(id=datafile.id).update(
+                process_note=datafile.process_note)
+            self._last_note = time.time()
+
+    def _elapsed(self):
+        return time.time() - self.started
+    elapsed = property(_elapsed)
+
+    def finish(self, datafile_id):
+        """Save this run's ProcessingStats and send it to the sinks."""
+        record = ProcessingStats.objects.create(datafile_id=datafile_id,
+                                                label=self.label,
+                                                stage_timings=self.timings,
+                                                features=self.features,
+                                                rows=self.rows,
+                                                elapsed=self.elapsed)
+        for sink in get_sinks():
+            try:
+                sink.emit(record)
+            except Exception:
+                logger.exception("Metrics sink %r failed", sink)
+        return record
+
+
+def get_sinks():
+    sinks = []
+    for path in getattr(settings, "MAPFILES_METRICS_SINKS", DEFAULT_SINKS):
+        module_name, class_name = path.rsplit(".", 1)
+        try:
+            sink_class = getattr(importlib.import_module(module_name), class_name)
+        except (ImportError, AttributeError):
+            raise ImproperlyConfigured("Could not load metrics sink {}".format(path))
+        sinks.append(sink_class())
+    return sinks
+
+
+class LoggingSink:
+
+    def emit(self, record):
+        timings = ", ".join("{0}={1:.2f}s".format(stage, seconds)
+                            for stage, seconds in sorted(record.stage_timings.items()))
+        logger.info("datafile %s %s: %d features, %d rows in %.2fs (%.0f features/sec) [%s]",
+                    record.datafile_id, record.label, record.features,
+                    record.rows, record.elapsed, record.features_per_second,
+                    timings)
+
+
+## Prometheus metrics can only be registered once per process.
+_prometheus_metrics = {}
+
+class PrometheusSink:
+
+    def __init__(self):
+        if prometheus_client is None:
+            raise ImproperlyConfigured("PrometheusSink requires prometheus_client")
+        if not _prometheus_metrics:
+            _prometheus_metrics['stage'] = prometheus_client.Histogram(
+                'mapfiles_ingest_stage_seconds',
+                'Wall time spent in each data file processing stage',
+                ['stage'])
+            _prometheus_metrics['features'] = prometheus_client.Counter(
+                'mapfiles_ingest_features_total',
+                'Features written while processing data files')
+            _prometheus_metrics['rows'] = prometheus_client.Counter(
+                'mapfiles_ingest_rows_total',
+                'Rows written while processing data files')
+        self.metrics = _prometheus_metrics
+
+    def emit(self, record):
+        for stage, seconds in record.stage_timings.items():
+            self.metrics['stage'].labels(stage).observe(seconds)
+        self.metrics['features'].inc(record.features)
+        self.metrics['rows'].inc(record.rows)
@@ -16,5 +16,5 @@ def set_center(features):
     total = len(centers)
     fold_centers = reduce(add_tuples, centers)
     avglon, avglat = map(lambda x: x / total, fold_centers)
-    center = Point(avglat, avglon)
+    center = Point(avglon, avglat, srid=4326)
     return center
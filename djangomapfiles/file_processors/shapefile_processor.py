@@ -11,22 +11,68 @@ import tempfile
 import zipfile
 
 from django.contrib.gis.gdal import DataSource
+from django.contrib.gis.gdal import OGRException
 from django.contrib.gis.gdal import OGRGeomType
 from django.contrib.gis.gdal import SpatialReference
 from django.contrib.gis.gdal import CoordTransform
 from django.contrib.gis.geos import GEOSGeometry
-from django.contrib.gis.geos.collections import MultiPolygon
-from django.contrib.gis.geos.collections import MultiLineString
 
-from djangomapfiles.models import DataFile, Feature, Attribute
+from djangomapfiles.models import DataFile, Feature
+from .base import BaseProcessor, multi_geometry
 from .exceptions import ProcessingException
 from .exceptions import ShapefileException
+from .feature_writer import FeatureWriter, save_fields
+from .field_types import OGR_FIELD_TYPES, STRING, json_value
 
 
-class ProcessShapefile:
+## The pieces of reading a shapefile that don't need a DataFile;
+## tiger.py loads boundaries with them too.
+
+def shp_member(zipf):
+    """Name of the .shp in an open ZipFile, or None. Archives made on
+    macOS also hold __MACOSX/._<name>.shp resource forks, which aren't
+    shapefiles, so those (and any other dot files) are passed over."""
+    for name in zipf.namelist():
+        if name.startswith('__MACOSX/') or os.path.basename(name).startswith('.'):
+            continue
+        if os.path.splitext(name)[1].lower() == '.shp':
+            return name
+    return None
+
+def vsizip_path(zip_path, member):
+    """Path GDAL reads a ZIP member through in place, without
+    extracting it."""
+    return "/vsizip/{0}/{1}".format(zip_path, member)
+
+def open_layer(file_path):
+    """Open a shapefile and return its DataSource and first layer.
+    Hang onto the DataSource: the layer is only good while it lives."""
+    try:
+        ds = DataSource(file_path)
+        layer = ds[0]
+    except (IOError, IndexError, OGRException):
+        raise ShapefileException("Could not open {}".format(file_path))
+    return ds, layer
+
+def transform_to_4326(layer):
+    return CoordTransform(SpatialReference(layer.srs.wkt), SpatialReference(4326))
+
+def ogr_to_geos(geo, ct):
+    """Transform an OGR geometry to 4326 and hand it to GEOS as WKB
+    (no WKT text round-trip), wrapped for our Multi* columns."""
+    geo.transform(ct)
+    return multi_geometry(GEOSGeometry(geo.wkb, srid=4326))
+
+
+class ProcessShapefile(BaseProcessor):
     
-    def __init__(self, file_type):
-        self.file_type = file_type
+    def __init__(self, file_type, batch_size=500, use_vsizip=True,
+                 stats=None):
+        BaseProcessor.__init__(self, file_type, batch_size, stats)
+        ## Open ZIP members in place through GDAL's /vsizip/
+        ## filesystem instead of extracting them to a tempdir.
+        self.use_vsizip = use_vsizip
+        self.tempdir = None
         # Common reference datums:
         self.REFERENCE_DATUMS = ("NAD27", "NAD83", "WGS84")
 
@@ -55,12 +101,7 @@ class ProcessShapefile:
         """Shapefiles use simpler geometries than our GeoDjango App
         will use, so we need to wrap those geometries. This comes 
         from the book Python for Geo-Spatial Development."""
-        if geometry.geom_type == "Polygon":
-            return MultiPolygon(geometry)
-        elif geometry.geom_type == "LineString":
-            return MultiLineString(geometry)
-        else:
-            return geometry        
+        return multi_geometry(geometry)
 
     def get_path(self, file_id):
         """This method performs raw file processing and type-checking
@@ -69,15 +110,13 @@ class ProcessShapefile:
 
         We are processing either a 'shapefile' or a 'shapefile_zip'        
         If it is a ZIP, we check to make sure all files are included."""
-        ## This must be the only function that calls self.teardown()
-        
-        self.datafile = DataFile.objects.get(id=file_id)
-        self.datafile.process_note = "Initiated datafile processing."
-        self.datafile.save()
+        self.get_datafile(file_id)
+        self.stats.note(self.datafile, "Initiated datafile processing.")
         self.file_path = self.datafile.stored_file.path
 
         if self.file_type == "shapefile_zip":
-            self.shapefile_path = self.save_zip(self.file_path)
+            with self.stats.stage('unpack'):
+                self.shapefile_path = self.save_zip(self.file_path)
 
         elif self.file_type == "shapefile":
             self.shapefile_path = self.file_path
@@ -86,24 +125,31 @@ class ProcessShapefile:
             err_msg = """Exception: this file went down the shapefile-processing
             path and yet the file type is listed as neither 'shapefile' nor
             'shapefile_zip'. How did it end up getting processed here?"""
-            self.datafile.process_note = err_msg
-            self.datafile.save()
+            self.stats.note(self.datafile, err_msg, force=True)
             raise ProcessingException("Unknown filetype or archive uploaded.")
 
         return self.shapefile_path
 
+    def get_datafile(self, file_id):
+        """Just load the datafile, for chunks of a shapefile whose path
+        has already been found by get_path."""
+        self.datafile = DataFile.objects.get(id=file_id)
+        return self.datafile
+
     def save_zip(self, file_path):
         """Check for files required to make a proper shapefile
-        zip archive and return None, error message if they are not
-        present."""
+        zip archive (using only the archive's central directory) and
+        raise ShapefileException if they are not present.
+
+        Returns a /vsizip/ path to the .shp member, or the path of the
+        extracted .shp if use_vsizip is off."""
         required_files = { ".shp",
                            ".shx",
                            ".dbf",
                            ".prj"} # This one's optional?
         self.zip_file = file_path
         if not zipfile.is_zipfile(self.zip_file):
-            self.datafile.process_note = "Exception raised: Not a valid ZIP archive."
-            self.datafile.save()
+            self.stats.note(self.datafile, "Exception raised: Not a valid ZIP archive.", force=True)
             raise ShapefileException("Not a valid zip archive")
         
         with zipfile.ZipFile(self.zip_file) as zipf:
@@ -114,83 +160,133 @@ class ProcessShapefile:
                 err_msg = "Exception raised: Archive missing the following file types: {}"
                 err_msg = err_msg.format(" ".join(
                     required_files - zip_extensions))
-                self.datafile.process_note = err_msg
-                self.datafile.save()
+                self.stats.note(self.datafile, err_msg, force=True)
                 raise ShapefileException("Not a valid zip archive")
                 
+            shp_name = shp_member(zipf)
+            if self.use_vsizip:
+                ## Only the central directory has been read so far;
+                ## GDAL reads the members straight out of the archive.
+                shapefile_path = vsizip_path(self.zip_file, shp_name)
             else:
                 self.tempdir = tempfile.mkdtemp()
                 for fname in zipf.namelist():
                     fname_ext = os.path.splitext(fname)[1].lower()
                     if fname_ext in required_files:
                         zipf.extract(fname, path = self.tempdir) 
-                    if fname_ext == '.shp':
-                        shapefile_path = os.path.join(self.tempdir,
-                                                      fname)
-        self.datafile.process_note = "Shapefile found in zip. Processing shapefile."
-        self.datafile.save()
+                shapefile_path = os.path.join(self.tempdir, shp_name)
+        self.stats.note(self.datafile, "Shapefile found in zip. Processing shapefile.")
         return shapefile_path
 
 
-    def process_shapefile(self, file_path):
-        """This is where the shapefile is processed and data is added
-        to the models."""
+    def teardown(self):
+        """Remove anything extracted by save_zip."""
+        if self.tempdir:
+            shutil.rmtree(self.tempdir, ignore_errors=True)
+            self.tempdir = None
+
+    def open_layer(self, file_path):
+        """Open the shapefile and return its DataSource and first layer."""
         try:
-            ds = DataSource(file_path)
-            layer = ds[0]
-        except (IOError, IndexError):
-            self.datafile.process_note = "Either DataSource couldn't be created or layer could not be indexed. Check shapefile: does it have one data layer?"
-            self.datafile.save()
-            raise InvalidShapefile("Check shapefile.") 
-        
-        ## Process shapefile
-        self.datafile.srs_wkt = layer.srs.wkt
-        self.datafile.geom_type = layer.geom_type.name
-        self.datafile.process_note = "Processing attributes and featuers."
-        self.datafile.save()
+            with self.stats.stage('open'):
+                ds, layer = open_layer(file_path)
+        except ShapefileException:
+            self.stats.note(self.datafile, "Either DataSource couldn't be created or layer could not be indexed. Check shapefile: does it have one data layer?", force=True)
+            raise ShapefileException("Check shapefile.") 
+        return ds, layer
 
-        ## Find the field_name each feature will have and
-        ## Prepopulate attribute information.
-        attr_data = list(zip(layer.fields, 
-                        map(lambda x : x.__name__, 
+    def layer_fields(self, layer):
+        """Return (field_name, attr_type, width, precision) for each
+        field in the layer. See field_types for the attr_types."""
+        return list(zip(layer.fields, 
+                        map(lambda x : OGR_FIELD_TYPES.get(x.__name__, STRING), 
                             layer.field_types),
                         layer.field_widths, 
                         layer.field_precisions))
 
+    def record_layer_info(self, layer):
+        ## Only these columns: a full save() would write back stale
+        ## copies of the rest (version, processed) over other updates.
+        self.datafile.srs_wkt = layer.srs.wkt
+        self.datafile.geom_type = layer.geom_type.name
+        DataFile.objects.filter(id=self.datafile.id).update(
+            srs_wkt=self.datafile.srs_wkt, geom_type=self.datafile.geom_type)
+        self.stats.note(self.datafile, "Processing attributes and features.")
+        fields = self.layer_fields(layer)
+        save_fields(self.datafile, fields)
+        self.stats.count(rows=len(fields))
+
+    def feature_ranges(self, file_path, chunk_size):
+        """Record the layer's SRS and geometry type on the datafile and
+        split the layer's features into [start, stop) index ranges of
+        at most chunk_size features each. Each range can be handed
+        to process_shapefile separately."""
+        ds, layer = self.open_layer(file_path)
+        self.record_layer_info(layer)
+        num_feat = layer.num_feat
+        return [(start, min(start + chunk_size, num_feat))
+                for start in range(0, num_feat, chunk_size)]
+
+    def process_shapefile(self, file_path, start=0, stop=None,
+                          chunk_size=None):
+        """This is where the shapefile is processed and data is added
+        to the models. Extracted files are removed even if it fails.
+
+        Pass start/stop to load only that range of the layer's features,
+        and the chunk_size the layer was split by (see feature_ranges).
+        Loading resumes after the last feature committed for the range.
+        Returns the number of features written."""
+        try:
+            return self._process_shapefile(file_path, start, stop, chunk_size)
+        finally:
+            self.teardown()
+
+    def _process_shapefile(self, file_path, start, stop, chunk_size):
+        ds, layer = self.open_layer(file_path)
+        whole_layer = start == 0 and stop is None
+        if whole_layer:
+            self.record_layer_info(layer)
+        ## A stop past the end (e.g. a benchmark's limit) means the end.
+        if stop is None or stop > layer.num_feat:
+            stop = layer.num_feat
+
+        ## Find the field_name each feature will have.
+        ## (The rest of the field information is in DataField.)
+        field_names = layer.fields
+
         ## Set up coordinate transformation to 4326.
         ## This is used to transform feature's geometry
-        srs = SpatialReference(layer.srs.wkt)
-        ct = CoordTransform(srs, SpatialReference(4326))
-
-        ## Process features
-        for feat_datum in layer:
-            geo = feat_datum.geom
-            geo.transform(ct)
-            geometry = GEOSGeometry(geo.wkt)
-            geometry = self.wrap_GEOS_geometry(geometry)
-            geometry_field = self.calc_geometry_field(layer.geom_type.name)
-            
-            args = {}
-            args['datafile'] = self.datafile
-            args[geometry_field] = geometry
-            model_feature = Feature(**args)
-            model_feature.save()
-
-            for attr in attr_data:
-                if attr[0] in [f.decode('utf-8') 
-                               for f in feat_datum.fields]:
-                    val = str(feat_datum.get(attr[0]))
-                else:
-                    val = "None"
-
-                attribute = Attribute(feature=model_feature,
-                                      field_name = attr[0],
-                                      attr_type = attr[1],
-                                      width = attr[2],
-                                      precision = attr[3],
-                                      field_value = val)
-                attribute.save()
-        try:
-            shutil.rmtree(self.tempdir)
-        except FileNotFoundError:
-            pass
+        ct = transform_to_4326(layer)
+
+        ## Per-layer decisions: every feature lands in the same column.
+        geometry_field = self.calc_geometry_field(layer.geom_type.name)
+
+        ## Process features: these are buffered and written
+        ## in chunks of self.batch_size.
+        writer = FeatureWriter(self.datafile, self.batch_size, start,
+                               self.stats, shared_progress=not whole_layer,
+                               chunk_size=chunk_size)
+        with self.timing_features():
+            for index in range(writer.resume_position, stop):
+                feat_datum = layer[index]
+                geometry = ogr_to_geos(feat_datum.geom, ct)
+
+                feat_fields = set(f.decode('utf-8') for f in feat_datum.fields)
+                properties = {}
+                for name in field_names:
+                    if name in feat_fields:
+                        properties[name] = json_value(feat_datum.get(name))
+                    else:
+                        properties[name] = None
+
+                args = {}
+                args['datafile'] = self.datafile
+                args[geometry_field] = geometry
+                args['properties'] = properties
+                writer.add(Feature(**args), index + 1)
+            writer.close()
+        ## Chunks running in parallel leave the note to whoever
+        ## finalizes the datafile.
+        if whole_layer:
+            self.stats.note(self.datafile, writer.summary(), force=True)
+        return writer.features_written
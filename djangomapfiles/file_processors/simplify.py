@@ -0,0 +1,141 @@
+"""Simplified geometries for drawing a DataFile at lower zoom levels.
+
+After a file is loaded, each line and polygon Feature gets one
+SimplifiedGeometry per zoom band in MAPFILES_SIMPLIFY_ZOOMS. A band's
+tolerance is the size of a pixel at that band's zoom, so nothing
+visibly changes, and simplification preserves topology so polygons
+don't collapse or cross themselves. Points are never simplified.
+
+Census features have no geometry of their own but a shared Boundary,
+so the boundaries are what get simplified: once per band, into
+SimplifiedBoundary, and only again if the boundary changes."""
+from django.conf import settings
+from django.db import connection, transaction
+
+from djangomapfiles.models import Boundary, Feature
+from djangomapfiles.models import SimplifiedBoundary, SimplifiedGeometry
+
+DEFAULT_ZOOMS = (6, 10, 14)
+
+## Tiles are 256 pixels wide and zoom 0 shows all 360 degrees
+TILE_SIZE = 256
+
+## Geometry columns worth simplifying
+SIMPLIFIED_FIELDS = ("geom_multilinestring", "geom_multipolygon",
+                     "geom_geometrycollection")
+
+
+def simplify_zooms():
+    return tuple(sorted(getattr(settings, "MAPFILES_SIMPLIFY_ZOOMS", DEFAULT_ZOOMS)))
+
+def tolerance_for_zoom(zoom):
+    """Degrees covered by one pixel at this zoom level."""
+    return 360.0 / (TILE_SIZE * 2 ** zoom)
+
+def band_for_zoom(zoom, zooms=None):
+    """The band to draw at `zoom`: the smallest band zoom at or above
+    it, or None if only the full geometry will do."""
+    zooms = zooms if zooms is not None else simplify_zooms()
+    return next((band for band in zooms if band >= zoom), None)
+
+def band_for_tolerance(tolerance, zooms=None):
+    """The coarsest band simplified by no more than `tolerance`
+    degrees, or None if every band is simplified by more."""
+    zooms = zooms if zooms is not None else simplify_zooms()
+    return next((band for band in zooms
+                 if tolerance_for_zoom(band) <= tolerance), None)
+
+
+def build_simplified_geometries(datafile_id, zooms=None):
+    """(Re)build every band of simplified geometries for a datafile,
+    and simplify any of its boundaries that haven't been yet. Returns
+    the number of SimplifiedGeometry and SimplifiedBoundary rows written."""
+    zooms = zooms if zooms is not None else simplify_zooms()
+    written = 0
+    with transaction.atomic():
+        SimplifiedGeometry.objects.filter(datafile=datafile_id).delete()
+        for zoom in zooms:
+            if connection.vendor == 'postgresql':
+                written += _build_band_postgis(datafile_id, zoom)
+                written += _build_boundary_band_postgis(datafile_id, zoom)
+            else:
+                written += _build_band(datafile_id, zoom)
+                written += _build_boundary_band(datafile_id, zoom)
+    return written
+
+def _build_band_postgis(datafile_id, zoom):
+    geometry_sql = "COALESCE({0})".format(
+        ", ".join("f." + field for field in SIMPLIFIED_FIELDS))
+    cursor = connection.cursor()
+    cursor.execute("""INSERT INTO {0} (datafile_id, feature_id, zoom, geometry)
+                      SELECT f.datafile_id, f.id, %s,
+                             ST_SimplifyPreserveTopology({2}, %s)
+                      FROM {1} f
+                      WHERE f.datafile_id = %s AND {2} IS NOT NULL""".format(
+                          SimplifiedGeometry._meta.db_table,
+                          Feature._meta.db_table,
+                          geometry_sql),
+                   [zoom, tolerance_for_zoom(zoom), datafile_id])
+    return cursor.rowcount
+
+def _build_boundary_band_postgis(datafile_id, zoom):
+    """Simplify the datafile's boundaries that have no up-to-date
+    SimplifiedBoundary for this band. Other files' loads may be doing
+    the same, so rows they got to first are left be."""
+    tables = {'simplified': SimplifiedBoundary._meta.db_table,
+              'boundary': Boundary._meta.db_table,
+              'feature': Feature._meta.db_table}
+    used = "SELECT boundary_id FROM {feature} WHERE datafile_id = %s".format(**tables)
+    cursor = connection.cursor()
+    cursor.execute("""DELETE FROM {simplified} s USING {boundary} b
+                      WHERE s.boundary_id = b.id AND s.zoom = %s
+                        AND s.content_hash <> b.content_hash
+                        AND b.id IN ({used})""".format(used=used, **tables),
+                   [zoom, datafile_id])
+    cursor.execute("""INSERT INTO {simplified} (boundary_id, zoom, content_hash, geometry)
+                      SELECT b.id, %s, b.content_hash,
+                             ST_SimplifyPreserveTopology(b.geometry, %s)
+                      FROM {boundary} b
+                      WHERE b.id IN ({used})
+                      ON CONFLICT (boundary_id, zoom) DO NOTHING""".format(
+                          used=used, **tables),
+                   [zoom, tolerance_for_zoom(zoom), datafile_id])
+    return cursor.rowcount
+
+def _build_boundary_band(datafile_id, zoom):
+    tolerance = tolerance_for_zoom(zoom)
+    boundaries = Boundary.objects.filter(
+        id__in=Feature.objects.filter(datafile=datafile_id).values('boundary_id'))
+    current = dict(SimplifiedBoundary.objects
+                   .filter(boundary__in=boundaries, zoom=zoom)
+                   .values_list('boundary_id', 'content_hash'))
+    simplified = []
+    for boundary in boundaries.iterator():
+        if current.get(boundary.id) == boundary.content_hash:
+            continue
+        if boundary.id in current:
+            SimplifiedBoundary.objects.filter(boundary=boundary, zoom=zoom).delete()
+        simplified.append(SimplifiedBoundary(
+            boundary=boundary,
+            zoom=zoom,
+            content_hash=boundary.content_hash,
+            geometry=boundary.geometry.simplify(tolerance, preserve_topology=True)))
+    SimplifiedBoundary.objects.bulk_create(simplified, batch_size=500)
+    return len(simplified)
+
+def _build_band(datafile_id, zoom):
+    tolerance = tolerance_for_zoom(zoom)
+    ## Census features are drawn from their SimplifiedBoundary
+    features = Feature.objects.filter(datafile=datafile_id, boundary__isnull=True)
+    simplified = []
+    for feat in features.iterator():
+        geometry = feat.geometry
+        if geometry is None or geometry.geom_type in ("Point", "MultiPoint"):
+            continue
+        simplified.append(SimplifiedGeometry(
+            datafile_id=datafile_id,
+            feature=feat,
+            zoom=zoom,
+            geometry=geometry.simplify(tolerance, preserve_topology=True)))
+    SimplifiedGeometry.objects.bulk_create(simplified, batch_size=500)
+    return len(simplified)
@@ -0,0 +1,93 @@
+"""Load Census TIGER/Line shapefiles into the Boundary table.
+
+With every boundary a file needs already loaded, ACS processing only
+joins against Boundary and never calls out to a boundary API (set
+MAPFILES_BOUNDARY_PROVIDER to boundaries.NullBoundaryProvider to make
+sure of it). See the load_tiger_boundaries management command."""
+import zipfile
+
+from django.db import transaction
+from django.utils import timezone
+
+from djangomapfiles.models import Boundary
+from .exceptions import ShapefileException
+from .shapefile_processor import ogr_to_geos, open_layer, shp_member
+from .shapefile_processor import transform_to_4326, vsizip_path
+
+## The geo id field has been named for the census it came from
+GEOID_FIELDS = ("GEOID", "GEOID20", "GEOID10", "GEOID00")
+
+
+def shapefile_path(path):
+    """TIGER/Line files come as ZIP archives, read in place through
+    GDAL's /vsizip/ filesystem; a bare .shp is used as it is."""
+    if not zipfile.is_zipfile(path):
+        return path
+    with zipfile.ZipFile(path) as zipf:
+        member = shp_member(zipf)
+    if member is None:
+        raise ShapefileException("No shapefile in {}".format(path))
+    return vsizip_path(path, member)
+
+
+class TigerLoader:
+
+    def __init__(self, geography_type, batch_size=500, geoid_field=None,
+                 replace=False):
+        self.geography_type = geography_type
+        self.batch_size = batch_size
+        self.geoid_field = geoid_field
+        ## Overwrite boundaries already loaded (from an older vintage)
+        self.replace = replace
+        self.created = 0
+        self.updated = 0
+
+    def load(self, path):
+        """Load every feature in the archive. Returns the number read."""
+        ds, layer = open_layer(shapefile_path(path))
+
+        geoid_field = self.geoid_field or next(
+            (name for name in GEOID_FIELDS if name in layer.fields), None)
+        if geoid_field not in layer.fields:
+            raise ShapefileException("No geo id field in {}".format(path))
+        ## TIGER/Line is NAD83 (4269)
+        ct = transform_to_4326(layer)
+
+        read = 0
+        batch = {}
+        for feat in layer:
+            batch[feat.get(geoid_field)] = ogr_to_geos(feat.geom, ct)
+            read += 1
+            if len(batch) >= self.batch_size:
+                self.store(batch)
+                batch = {}
+        if batch:
+            self.store(batch)
+        return read
+
+    def store(self, geometries):
+        """Write one batch: a bulk insert for new geo ids, and updates
+        for the ones already there if we're replacing them."""
+        with transaction.atomic():
+            existing = set(Boundary.objects
+                           .filter(geography_type = self.geography_type,
+                                   federal_geo_id__in = list(geometries))
+                           .values_list('federal_geo_id', flat=True))
+            new_boundaries = []
+            for geo_id, geometry in geometries.items():
+                boundary = Boundary(geography_type = self.geography_type,
+                                    federal_geo_id = geo_id,
+                                    geometry = geometry)
+                boundary.content_hash = boundary.compute_hash()
+                if geo_id not in existing:
+                    new_boundaries.append(boundary)
+                elif self.replace:
+                    self.updated += (Boundary.objects
+                     .filter(geography_type = self.geography_type,
+                             federal_geo_id = geo_id)
+                     .exclude(content_hash = boundary.content_hash)
+                     .update(geometry = geometry,
+                             content_hash = boundary.content_hash,
+                             updated = timezone.now()))
+            Boundary.objects.bulk_create(new_boundaries, batch_size=self.batch_size)
+            self.created += len(new_boundaries)
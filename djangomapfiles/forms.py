@@ -1,5 +1,5 @@
 from django import forms
-from .models import DataFile
+from .models import DataFile, ChunkedUpload
 
 
 class DataFileUploadForm(forms.ModelForm):
@@ -14,3 +14,14 @@ class DataFileUploadForm(forms.ModelForm):
 class DataFileEditForm(forms.ModelForm):
     class Meta:
         model = DataFile
+
+
+class ChunkedUploadStartForm(forms.ModelForm):
+    class Meta:
+        model = ChunkedUpload
+        fields = ['name',
+                  'file_type',
+                  'encoding',
+                  'filename',
+                  'total_size',
+                  'checksum']
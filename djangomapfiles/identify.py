@@ -0,0 +1,108 @@
+"""Which features of a DataFile are at a point (for hover and identify).
+
+By default this is one query, with each geometry column tested on its
+own (and census boundaries in a subquery) so every test can use that
+column's spatial index. With MAPFILES_IDENTIFY_STRTREE on (it needs
+Shapely 2), each worker instead keeps an STRtree of the file's
+geometries in memory, built on the first lookup and rebuilt when
+DataFile.version changes, which answers in well under a millisecond.
+Files with more than MAPFILES_IDENTIFY_STRTREE_MAX_FEATURES features
+always use the query, and a worker keeps the trees of only the
+MAPFILES_IDENTIFY_STRTREE_CACHE_SIZE files it used most recently."""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.db.models import Q
+
+from .models import Boundary, Feature
+
+try:
+    import shapely
+    import shapely.wkb
+except ImportError:
+    shapely = None
+
+GEOMETRY_FIELDS = ("geom_point", "geom_multipoint", "geom_multilinestring",
+                   "geom_multipolygon", "geom_geometrycollection")
+
+## Points and lines have no area, so lookups take in this many
+## degrees around the point (about 10m at the equator).
+DEFAULT_TOLERANCE = 0.0001
+
+
+def use_strtree():
+    return shapely is not None and getattr(settings, "MAPFILES_IDENTIFY_STRTREE", False)
+
+def features_at(features, point, tolerance=DEFAULT_TOLERANCE):
+    """The features whose geometry is within `tolerance` of the point."""
+    area = point.buffer(tolerance) if tolerance else point
+    area.srid = 4326
+    ## Boundaries are matched in a subquery: OR-ing a test on the
+    ## joined boundary table would defeat the columns' indexes.
+    intersects = Q(boundary_id__in=Boundary.objects.filter(
+        geometry__intersects=area).values('id'))
+    for field in GEOMETRY_FIELDS:
+        intersects |= Q(**{field + "__intersects": area})
+    return features.filter(intersects)
+
+
+class FeatureTree:
+    """An STRtree over a DataFile's geometries, prepared so that
+    intersection tests are cheap."""
+
+    def __init__(self, datafile):
+        features = (Feature.objects.filter(datafile=datafile)
+                    .select_related('boundary').order_by('id'))
+        self.ids = []
+        geometries = []
+        for feat in features.iterator():
+            geometry = feat.geometry
+            if geometry is None:
+                continue
+            self.ids.append(feat.id)
+            geometries.append(shapely.wkb.loads(bytes(geometry.wkb)))
+        shapely.prepare(geometries)
+        self.tree = shapely.STRtree(geometries)
+
+    def ids_at(self, lon, lat, tolerance=DEFAULT_TOLERANCE):
+        area = shapely.Point(lon, lat)
+        if tolerance:
+            area = area.buffer(tolerance)
+        return sorted(self.ids[index] for index in
+                      self.tree.query(area, predicate='intersects'))
+
+
+## datafile id -> (version, FeatureTree or None), for this worker,
+## least recently used first
+_trees = OrderedDict()
+_trees_lock = threading.Lock()
+
+def tree_for(datafile):
+    """This worker's FeatureTree for the datafile, rebuilt if the file
+    has been reprocessed since; None if it has too many features."""
+    with _trees_lock:
+        cached = _trees.get(datafile.id)
+        if cached is None or cached[0] != datafile.version:
+            max_features = getattr(settings, "MAPFILES_IDENTIFY_STRTREE_MAX_FEATURES", 50000)
+            if Feature.objects.filter(datafile=datafile).count() > max_features:
+                tree = None
+            else:
+                tree = FeatureTree(datafile)
+            cached = _trees[datafile.id] = (datafile.version, tree)
+        _trees.move_to_end(datafile.id)
+        max_trees = getattr(settings, "MAPFILES_IDENTIFY_STRTREE_CACHE_SIZE", 8)
+        while len(_trees) > max_trees:
+            _trees.popitem(last=False)
+    return cached[1]
+
+def feature_ids_at(datafile, lon, lat, tolerance=DEFAULT_TOLERANCE):
+    """Ids of the datafile's features at (lon, lat), in id order."""
+    if use_strtree():
+        tree = tree_for(datafile)
+        if tree is not None:
+            return tree.ids_at(lon, lat, tolerance)
+    features = features_at(Feature.objects.filter(datafile=datafile),
+                           Point(lon, lat, srid=4326), tolerance)
+    return list(features.order_by('id').values_list('id', flat=True))
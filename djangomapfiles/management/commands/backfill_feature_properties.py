@@ -0,0 +1,131 @@
+"""Copy the old one-row-per-field Attribute data into DataField
+and Feature.properties for data files processed before those existed.
+
+Attribute rows hold every value as text, with "None" for a missing one,
+and shapefile rows name OGR's field types. Both are turned into what
+the processors store now: field_types types and typed JSON values."""
+import json
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from djangomapfiles.models import DataFile, Feature, Attribute
+from djangomapfiles.file_processors import field_types
+from djangomapfiles.file_processors.feature_writer import save_fields
+
+
+def stored_value(text, attr_type):
+    """An Attribute's text as the value a processor would have stored
+    for a field of `attr_type`."""
+    if text is None or text == "None":
+        return None
+    if attr_type == field_types.DATETIME:
+        ## str() of a datetime puts a space where isoformat puts a T
+        text = text.strip().replace(" ", "T", 1)
+    try:
+        return field_types.json_value(field_types.convert(text, attr_type))
+    except ValueError:
+        return None
+
+
+class Command(BaseCommand):
+    args = '<datafile_id datafile_id ...>'
+    help = "Copy Attribute rows into DataField and Feature.properties."
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size',
+                    type='int',
+                    dest='batch_size',
+                    default=500,
+                    help='Number of features updated per transaction.'),
+        make_option('--delete',
+                    action='store_true',
+                    dest='delete',
+                    default=False,
+                    help='Delete the Attribute rows once they are copied.'),
+    )
+
+    def handle(self, *args, **options):
+        datafiles = DataFile.objects.all()
+        if args:
+            datafiles = datafiles.filter(id__in=args)
+        for datafile in datafiles:
+            count = self.backfill(datafile,
+                                  options['batch_size'],
+                                  options['delete'])
+            self.stdout.write("{0}: {1} features backfilled.".format(
+                datafile, count))
+
+    def backfill(self, datafile, batch_size, delete):
+        attributes = Attribute.objects.filter(feature__datafile=datafile)
+        first = attributes.order_by('feature', 'id').first()
+        if first is None:
+            return 0
+
+        ## Every feature in a file has the same fields,
+        ## so the first feature's attributes describe them all.
+        fields = list(attributes.filter(feature=first.feature_id).order_by('id'))
+        types = self.field_types(attributes, fields)
+        save_fields(datafile,
+                    [(attr.field_name, types[attr.field_name], attr.width, attr.precision)
+                     for attr in fields])
+
+        feature_ids = list(Feature.objects.filter(datafile=datafile)
+                           .order_by('id')
+                           .values_list('id', flat=True))
+        for start in range(0, len(feature_ids), batch_size):
+            ids = feature_ids[start:start + batch_size]
+            properties = dict((feat_id, {}) for feat_id in ids)
+            values = (Attribute.objects.filter(feature__in=ids)
+                      .order_by('id')
+                      .values_list('feature', 'field_name', 'field_value'))
+            for feat_id, name, value in values:
+                properties[feat_id][name] = stored_value(value, types.get(name))
+
+            with transaction.atomic():
+                self.update_properties(properties)
+                if delete:
+                    Attribute.objects.filter(feature__in=ids).delete()
+        return len(feature_ids)
+
+    def field_types(self, attributes, fields):
+        """{field name: attr_type}. Shapefile rows name an OGR type; csv
+        rows name none, so those fields get the narrowest type all of
+        their values fit, as ProcessAcs gives csv columns now."""
+        types = {}
+        untyped = []
+        for attr in fields:
+            if attr.attr_type:
+                types[attr.field_name] = field_types.OGR_FIELD_TYPES.get(
+                    attr.attr_type, field_types.STRING)
+            else:
+                types[attr.field_name] = None
+                untyped.append(attr.field_name)
+        if untyped:
+            values = (attributes.filter(field_name__in=untyped)
+                      .values_list('field_name', 'field_value'))
+            for name, value in values.iterator():
+                if value != "None":
+                    types[name] = field_types.widen(types[name],
+                                                    field_types.infer_type(value))
+        for name in untyped:
+            types[name] = types[name] or field_types.STRING
+        return types
+
+    def update_properties(self, properties):
+        """Set Feature.properties for {feature id: properties}. On
+        PostgreSQL that's one UPDATE ... FROM (VALUES ...) for the whole
+        batch; elsewhere one UPDATE per feature."""
+        if connection.vendor != 'postgresql':
+            for feat_id, values in properties.items():
+                Feature.objects.filter(id=feat_id).update(properties=values)
+            return
+        rows = ", ".join(["(%s, %s::jsonb)"] * len(properties))
+        params = []
+        for feat_id, values in properties.items():
+            params += [feat_id, json.dumps(values)]
+        cursor = connection.cursor()
+        cursor.execute("""UPDATE {0} AS f SET properties = v.properties
+                          FROM (VALUES {1}) AS v (id, properties)
+                          WHERE f.id = v.id""".format(Feature._meta.db_table, rows),
+                       params)
@@ -0,0 +1,54 @@
+"""Compare the two ways of rendering a DataFile's GeoJSON: building
+it in PostGIS (ST_AsGeoJSON) or feature by feature through GEOS."""
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from djangomapfiles.models import DataFile, Feature
+from djangomapfiles import export
+
+
+class Command(BaseCommand):
+    args = '<datafile_id>'
+    help = "Time GeoJSON rendering in PostGIS against rendering through GEOS."
+    option_list = BaseCommand.option_list + (
+        make_option('--limit',
+                    type='int',
+                    dest='limit',
+                    default=10000,
+                    help='Number of features to render.'),
+        make_option('--precision',
+                    type='int',
+                    dest='precision',
+                    default=export.DEFAULT_PRECISION,
+                    help='Decimal places for PostGIS coordinates.'),
+        make_option('--simplify',
+                    type='float',
+                    dest='simplify',
+                    default=0,
+                    help='Simplification tolerance, in degrees.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Give one datafile id.")
+        try:
+            datafile = DataFile.objects.get(id=args[0])
+        except DataFile.DoesNotExist:
+            raise CommandError("No datafile {}.".format(args[0]))
+        features = Feature.objects.filter(datafile=datafile)
+
+        for name, render in (("postgis", export.render_postgis),
+                             ("geos", export.render_geos)):
+            began = time.time()
+            size = 0
+            for text in export.feature_collection(features,
+                                                  limit=options['limit'],
+                                                  precision=options['precision'],
+                                                  simplify=options['simplify'],
+                                                  render=render):
+                size += len(text)
+            elapsed = time.time() - began
+            self.stdout.write("{0:8s} {1:8.2f}s  {2:10.1f} KB".format(
+                name, elapsed, size / 1024.0))
@@ -0,0 +1,56 @@
+"""Time moving a shapefile geometry from OGR to GEOS as WKB, the way
+ProcessShapefile does, against the old WKT text round-trip. The
+geometry is a made-up polygon in web mercator with as many vertices
+as asked for, transformed to 4326 first just like a shapefile's."""
+import math
+import time
+from optparse import make_option
+
+from django.contrib.gis.gdal import CoordTransform, OGRGeometry, SpatialReference
+from django.contrib.gis.geos import GEOSGeometry
+from django.core.management.base import BaseCommand
+
+from djangomapfiles.file_processors.shapefile_processor import ProcessShapefile
+
+
+def circle_wkt(vertices, radius=100000.0):
+    """A polygon with this many vertices, in meters around (0, 0)."""
+    points = ["{0} {1}".format(radius * math.cos(2 * math.pi * n / vertices),
+                               radius * math.sin(2 * math.pi * n / vertices))
+              for n in range(vertices)]
+    return "POLYGON(({0}, {1}))".format(", ".join(points), points[0])
+
+
+class Command(BaseCommand):
+    help = "Time OGR to GEOS geometry conversion through WKB and through WKT."
+    option_list = BaseCommand.option_list + (
+        make_option('--vertices',
+                    type='int',
+                    dest='vertices',
+                    default=100000,
+                    help='Vertices in the polygon.'),
+        make_option('--repeat',
+                    type='int',
+                    dest='repeat',
+                    default=10,
+                    help='Conversions to time for each method.'),
+    )
+
+    def handle(self, *args, **options):
+        wrap = ProcessShapefile("shapefile").wrap_GEOS_geometry
+        source = OGRGeometry(circle_wkt(options['vertices']), SpatialReference(3857))
+        ct = CoordTransform(SpatialReference(3857), SpatialReference(4326))
+
+        self.stdout.write("method  median ms  max ms")
+        for name, convert in (("wkb", lambda geo: GEOSGeometry(geo.wkb, srid=4326)),
+                              ("wkt", lambda geo: GEOSGeometry(geo.wkt, srid=4326))):
+            timings = []
+            for _ in range(options['repeat']):
+                geo = source.clone()
+                began = time.time()
+                geo.transform(ct)
+                wrap(convert(geo))
+                timings.append((time.time() - began) * 1000)
+            timings.sort()
+            self.stdout.write("{0:6s}  {1:9.2f}  {2:6.2f}".format(
+                name, timings[len(timings) // 2], timings[-1]))
@@ -0,0 +1,62 @@
+"""Time loading a shapefile DataFile's features at several batch sizes.
+
+Each run loads the file into a scratch copy of the DataFile, which is
+deleted afterwards, so the original is left alone. A batch size of 1
+writes one INSERT per feature, as loading used to; compare it with
+MAPFILES_INGEST_BATCH_SIZE to see what batching buys."""
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from djangomapfiles.models import DataFile
+from djangomapfiles.file_processors.metrics import IngestStats
+from djangomapfiles.file_processors.shapefile_processor import ProcessShapefile
+
+
+class Command(BaseCommand):
+    args = '<datafile_id>'
+    help = "Time loading a shapefile data file's features at several batch sizes."
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-sizes',
+                    dest='batch_sizes',
+                    default='1,{}'.format(getattr(settings, "MAPFILES_INGEST_BATCH_SIZE", 500)),
+                    help='Comma-separated batch sizes.'),
+        make_option('--limit',
+                    type='int',
+                    dest='limit',
+                    default=None,
+                    help='Only load this many features.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Give one datafile id.")
+        try:
+            datafile = DataFile.objects.get(id=args[0])
+        except DataFile.DoesNotExist:
+            raise CommandError("No datafile {}.".format(args[0]))
+        if datafile.file_type not in ("shapefile", "shapefile_zip"):
+            raise CommandError("{} isn't a shapefile.".format(datafile))
+        use_vsizip = getattr(settings, "MAPFILES_SHAPEFILE_VSIZIP", True)
+
+        self.stdout.write("batch  features  seconds  features/sec  insert s")
+        for batch_size in [int(size) for size in options['batch_sizes'].split(',')]:
+            scratch = DataFile.objects.create(name="benchmark: {}".format(datafile.name),
+                                              file_type=datafile.file_type,
+                                              stored_file=datafile.stored_file.name)
+            try:
+                stats = IngestStats("benchmark", note_interval=float('inf'))
+                processor = ProcessShapefile(datafile.file_type, batch_size,
+                                             use_vsizip, stats)
+                shapefile = processor.get_path(scratch.id)
+                began = time.time()
+                features = processor.process_shapefile(shapefile, 0, options['limit'])
+                elapsed = time.time() - began
+            finally:
+                scratch.delete()
+            self.stdout.write("{0:5d}  {1:8d}  {2:7.2f}  {3:12.0f}  {4:8.2f}".format(
+                batch_size, features, elapsed,
+                features / elapsed if elapsed > 0 else 0.0,
+                stats.timings.get('insert', 0.0)))
@@ -0,0 +1,67 @@
+"""Time how long PostGIS takes to build a DataFile's vector tiles
+at several zoom levels. Tiles are rendered directly, not from the
+cache, so this measures the database work each cache miss costs."""
+import math
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from djangomapfiles.models import DataFile
+from djangomapfiles import tiles
+
+
+def tile_for(lon, lat, z):
+    """The x, y of the tile at zoom z that holds a point."""
+    n = 2 ** z
+    x = int((lon + 180.0) / 360.0 * n)
+    lat = math.radians(lat)
+    y = int((1.0 - math.log(math.tan(lat) + 1.0 / math.cos(lat)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+class Command(BaseCommand):
+    args = '<datafile_id>'
+    help = "Time vector tile rendering for a data file at several zoom levels."
+    option_list = BaseCommand.option_list + (
+        make_option('--zooms',
+                    dest='zooms',
+                    default='4,8,12,16',
+                    help='Comma-separated zoom levels.'),
+        make_option('--radius',
+                    type='int',
+                    dest='radius',
+                    default=2,
+                    help='Render the tiles this many tiles around the center.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Give one datafile id.")
+        try:
+            datafile = DataFile.objects.get(id=args[0])
+        except DataFile.DoesNotExist:
+            raise CommandError("No datafile {}.".format(args[0]))
+        if not datafile.default_center:
+            raise CommandError("{} hasn't been processed yet.".format(datafile))
+        lon, lat = datafile.default_center.tuple
+        radius = options['radius']
+
+        self.stdout.write("zoom  tiles  median ms  p95 ms  max ms  avg KB")
+        for z in [int(zoom) for zoom in options['zooms'].split(',')]:
+            center_x, center_y = tile_for(lon, lat, z)
+            timings = []
+            sizes = []
+            for x in range(center_x - radius, center_x + radius + 1):
+                for y in range(center_y - radius, center_y + radius + 1):
+                    if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+                        continue
+                    began = time.time()
+                    tile = tiles.render_tile(datafile.id, z, x, y)
+                    timings.append((time.time() - began) * 1000)
+                    sizes.append(len(tile))
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            self.stdout.write("{0:4d}  {1:5d}  {2:9.1f}  {3:6.1f}  {4:6.1f}  {5:6.1f}".format(
+                z, len(timings), timings[len(timings) // 2], p95, timings[-1],
+                sum(sizes) / len(sizes) / 1024.0))
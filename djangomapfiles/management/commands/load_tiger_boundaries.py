@@ -0,0 +1,57 @@
+"""Load Census TIGER/Line shapefile archives into the Boundary table,
+so ACS files can be processed without a boundary API."""
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from djangomapfiles.models import DataFile
+from djangomapfiles.file_processors.exceptions import ShapefileException
+from djangomapfiles.file_processors.tiger import TigerLoader
+
+
+class Command(BaseCommand):
+    args = '<geography_type> <archive archive ...>'
+    help = "Load TIGER/Line shapefile archives into the Boundary table."
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size',
+                    type='int',
+                    dest='batch_size',
+                    default=500,
+                    help='Number of boundaries written per transaction.'),
+        make_option('--geoid-field',
+                    dest='geoid_field',
+                    default=None,
+                    help='Field holding the geo id (default: GEOID, GEOID20, GEOID10 or GEOID00).'),
+        make_option('--replace',
+                    action='store_true',
+                    dest='replace',
+                    default=False,
+                    help='Overwrite boundaries that are already loaded.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) < 2:
+            raise CommandError("Give a geography type and at least one archive.")
+        geography_type, archives = args[0], args[1:]
+        ## Boundaries are keyed by the ACS file types
+        acs_types = dict(dict(DataFile.FILE_UPLOAD_TYPES)[DataFile.Am_Com_Surv_Label])
+        if geography_type not in acs_types:
+            raise CommandError("Geography type must be one of: {}".format(
+                ", ".join(acs_types)))
+
+        loader = TigerLoader(geography_type,
+                             batch_size=options['batch_size'],
+                             geoid_field=options['geoid_field'],
+                             replace=options['replace'])
+        for archive in archives:
+            began = time.time()
+            try:
+                read = loader.load(archive)
+            except ShapefileException as e:
+                raise CommandError(str(e))
+            elapsed = time.time() - began
+            self.stdout.write("{0}: {1} boundaries read in {2:.1f}s ({3:.0f}/sec).".format(
+                archive, read, elapsed, read / elapsed if elapsed else 0))
+        self.stdout.write("{0} boundaries created, {1} replaced.".format(
+            loader.created, loader.updated))
@@ -1,13 +1,23 @@
+import datetime
+import hashlib
 import os
 
+from django.conf import settings
 from django.contrib.gis.db import models
+from django.contrib.gis.db.models.query import GeoQuerySet
+from django.db import connections
 from django.core.urlresolvers import reverse
 from django.core.exceptions import ValidationError
 
+from .fields import JSONField
+from .file_processors import field_types
+
 
 def validate_file(file_obj):
+    ## Form uploads only: anything bigger should come in through
+    ## the chunked upload API (see chunked_upload.py).
     filesize = file_obj.file.size
-    megabyte_limit = 12.0
+    megabyte_limit = float(getattr(settings, "MAPFILES_MAX_UPLOAD_MB", 12.0))
     if filesize > megabyte_limit*1024*1024:
         raise ValidationError("This file is too large: max file size is {}MB".format(str(megabyte_limit)))
 
@@ -32,6 +42,11 @@ class DataFile(models.Model):
             ("kml", "KML (.kml)"),
             ("kmz", "KMZ (.kmz)"),
         )
+     ),
+        ("GeoJSON Files", (
+            ("geojson", "GeoJSON FeatureCollection (.geojson, .json)"),
+            ("geojsonseq", "GeoJSON Text Sequence, one feature per line (.geojsonl, .geojsons)"),
+        )
      ),
         (Am_Com_Surv_Label, (
             ("tracts", "by Census Tract"),
@@ -62,6 +77,9 @@ class DataFile(models.Model):
     updated = models.DateField(auto_now=True)
     first_uploaded = models.DateField(auto_now_add=True)
     processed = models.BooleanField(default=False)
+    ## Goes up every time the file's features are reloaded or finished
+    ## loading; anything cached from them is keyed by it.
+    version = models.PositiveIntegerField(default=0, editable=False)
     process_note = models.CharField(max_length=255, blank=True)
     encoding = models.CharField(max_length=20, 
                                 choices=CHARACTER_ENCODINGS,
@@ -93,14 +111,280 @@ class DataFile(models.Model):
         return os.path.basename(self.stored_file.path)
     filename = property(_actual_filename)
 
+    def reset_processing(self):
+        """Throw away everything loaded from this file (features, fields
+        and checkpoints) so that it can be processed from scratch."""
+        self.feature_set.all().delete()
+        self.datafield_set.all().delete()
+        self.ingestcheckpoint_set.all().delete()
+        self.processed = False
+        self.process_note = ""
+        self.version += 1
+        self.save()
+
     def _get_fieldnames(self):
-        return self.feature_set.first().attribute_set.all().values_list('field_name', flat=True)
+        return self.datafield_set.all().values_list('field_name', flat=True)
+    fieldnames = property(_get_fieldnames)
 
     class Meta:
         verbose_name = "Map Data File"
         verbose_name_plural = "Map Data Files"
         ordering = ['-first_uploaded']
 
+class DataField(models.Model):
+    """Describes one field (column) of a DataFile. Every Feature in
+    the file keeps its values for these fields in Feature.properties,
+    so the field metadata is stored once per file here."""
+    datafile = models.ForeignKey(DataFile)
+    field_name = models.CharField(max_length=255)
+    attr_type = models.CharField(max_length=20, blank=True)
+    width = models.IntegerField(blank=True,
+                                null=True)
+    precision = models.IntegerField(blank=True,
+                                    null=True)
+    position = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.field_name
+
+    def create_index(self):
+        """On PostgreSQL, index this numeric field's values for this
+        file, so FeatureQuerySet.property_range can use the index.
+        Returns False if the field can't be indexed."""
+        connection = connections[self._state.db or 'default']
+        if connection.vendor != 'postgresql':
+            return False
+        if self.attr_type not in (field_types.INTEGER, field_types.REAL):
+            return False
+        index_name = "djangomapfiles_prop_{0}_{1}".format(self.datafile_id,
+                                                         self.id)
+        ## The same expression property_range filters on
+        value_sql, value_params = number_value_sql(Feature._meta.db_table,
+                                                   self.field_name)
+        cursor = connection.cursor()
+        cursor.execute("""CREATE INDEX IF NOT EXISTS {0}
+                          ON {1} ({2})
+                          WHERE datafile_id = %s""".format(
+                              index_name, Feature._meta.db_table, value_sql),
+                       value_params + [self.datafile_id])
+        return True
+
+    class Meta:
+        ordering = ['position']
+
+class ChunkedUpload(models.Model):
+    """A file being uploaded piece by piece. The pieces are appended
+    to a part file on disk; once all `total_size` bytes are in, the
+    part file becomes the stored_file of a new DataFile."""
+    upload_id = models.CharField(max_length=32, unique=True)
+    name = models.CharField(max_length=255,
+                            verbose_name="File Name")
+    file_type = models.CharField(max_length=100,
+                                 choices=DataFile.FILE_UPLOAD_TYPES)
+    encoding = models.CharField(max_length=20,
+                                choices=DataFile.CHARACTER_ENCODINGS,
+                                blank=True)
+    filename = models.CharField(max_length=255)
+    total_size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    ## Optional sha256 (hex) of the whole file, checked on completion
+    checksum = models.CharField(max_length=64, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    datafile = models.ForeignKey(DataFile, blank=True, null=True)
+
+    def __str__(self):
+        return "{0} ({1}/{2})".format(self.filename, self.received,
+                                      self.total_size)
+
+    def _part_path(self):
+        return os.path.join(settings.MEDIA_ROOT, "uploads", "mapfiles",
+                            "chunks", self.upload_id + ".part")
+    part_path = property(_part_path)
+
+class IngestCheckpoint(models.Model):
+    """Records how far processing of a DataFile has gotten, so a
+    re-queued job can pick up where a dead worker left off.
+
+    `start` is the first feature (or csv row) index of the range being
+    loaded, 0 for a file loaded in one go; `position` is the index
+    just past the last feature committed for that range. `chunk_size`
+    is the size of the ranges the file was split into, or None if it
+    is loaded in one go: checkpoints are only good for ranges of the
+    same size."""
+    datafile = models.ForeignKey(DataFile)
+    start = models.PositiveIntegerField(default=0)
+    position = models.PositiveIntegerField(default=0)
+    chunk_size = models.PositiveIntegerField(blank=True, null=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "{0} [{1}:{2}]".format(self.datafile_id, self.start,
+                                      self.position)
+
+    class Meta:
+        unique_together = ('datafile', 'start')
+
+class ProcessingStats(models.Model):
+    """Stage timings and counts from one processing run (or one chunk
+    of a run) of a DataFile. See file_processors/metrics.py. When a
+    file is loaded in chunks, the "finalize" record counts every
+    chunk's features and its `elapsed` runs from the start of the
+    whole load."""
+    datafile = models.ForeignKey(DataFile)
+    label = models.CharField(max_length=100, blank=True)
+    stage_timings = JSONField(blank=True, default=dict)
+    features = models.PositiveIntegerField(default=0)
+    rows = models.PositiveIntegerField(default=0)
+    elapsed = models.FloatField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return "{0} {1}".format(self.datafile_id, self.label)
+
+    def _features_per_second(self):
+        if not self.elapsed:
+            return 0.0
+        return self.features / self.elapsed
+    features_per_second = property(_features_per_second)
+
+    class Meta:
+        verbose_name_plural = "Processing stats"
+        ordering = ['-created']
+
+class Boundary(models.Model):
+    """A census boundary shared by every Feature that covers it, so
+    each ACS upload doesn't store its own copy of the polygon.
+    `content_hash` is the sha256 of the geometry's WKB."""
+    geography_type = models.CharField(max_length=50)
+    federal_geo_id = models.CharField(max_length=100)
+    geometry = models.MultiPolygonField(srid=4326)
+    content_hash = models.CharField(max_length=64)
+    updated = models.DateTimeField(auto_now=True)
+    objects = models.GeoManager()
+
+    def __str__(self):
+        return "{0} {1}".format(self.geography_type, self.federal_geo_id)
+
+    def compute_hash(self):
+        return hashlib.sha256(bytes(self.geometry.wkb)).hexdigest()
+
+    def save(self, *args, **kwargs):
+        self.content_hash = self.compute_hash()
+        super(Boundary, self).save(*args, **kwargs)
+
+    class Meta:
+        unique_together = ('geography_type', 'federal_geo_id')
+
+## ISO dates (and the start of ISO datetimes), as json_value writes them
+DATE_PATTERN = r'^\d{4}-\d{2}-\d{2}'
+
+## PostgreSQL doesn't promise to check the rest of a WHERE clause
+## before casting, so each cast is guarded by a CASE: values that
+## can't be cast come out NULL instead of failing the query.
+
+def number_value_sql(table, name):
+    """(sql, params) for a field's value as numeric, or NULL if it
+    isn't a number."""
+    return ("""(CASE WHEN jsonb_typeof("{0}"."properties"->%s) = 'number'
+                THEN ("{0}"."properties"->>%s)::numeric END)""".format(table),
+            [name, name])
+
+def date_value_sql(table, name):
+    """(sql, params) for a field's value as a date, or NULL if it
+    isn't an ISO date string."""
+    return ("""(CASE WHEN jsonb_typeof("{0}"."properties"->%s) = 'string'
+                AND "{0}"."properties"->>%s ~ %s
+                THEN left("{0}"."properties"->>%s, 10)::date END)""".format(table),
+            [name, name, DATE_PATTERN, name])
+
+class FeatureQuerySet(GeoQuerySet):
+    """Range filters and sums over a field in Feature.properties.
+
+    On PostgreSQL these run in the database against the jsonb values
+    (see also DataField.create_index); elsewhere they fall back
+    to Python. Values that aren't numbers (or, for dates, strings)
+    are left out."""
+
+    def _is_postgresql(self):
+        return connections[self.db].vendor == 'postgresql'
+
+    def property_range(self, name, minimum=None, maximum=None):
+        """Features whose `name` value is between minimum and maximum
+        (inclusive; either may be None). Pass dates to compare dates."""
+        sample = minimum if minimum is not None else maximum
+        is_date = isinstance(sample, datetime.date)
+
+        if not self._is_postgresql():
+            def in_range(value):
+                if is_date:
+                    try:
+                        value = datetime.datetime.strptime(value[:10], "%Y-%m-%d").date()
+                    except (TypeError, ValueError):
+                        return False
+                elif field_types.value_type(value) not in (field_types.INTEGER,
+                                                            field_types.REAL):
+                    return False
+                return ((minimum is None or value >= minimum) and
+                        (maximum is None or value <= maximum))
+            ids = [feat.id for feat in self.only('id', 'properties')
+                   if in_range(feat.properties.get(name))]
+            return self.filter(id__in=ids)
+
+        table = self.model._meta.db_table
+        if is_date:
+            value_sql, value_params = date_value_sql(table, name)
+        else:
+            value_sql, value_params = number_value_sql(table, name)
+        where = [value_sql + ' IS NOT NULL']
+        params = list(value_params)
+        if minimum is not None:
+            where.append(value_sql + ' >= %s')
+            params += value_params + [minimum]
+        if maximum is not None:
+            where.append(value_sql + ' <= %s')
+            params += value_params + [maximum]
+        return self.extra(where=[" AND ".join(where)], params=params)
+
+    def property_sum(self, name):
+        """Sum of the numeric `name` values of these features."""
+        if not self._is_postgresql():
+            values = (feat.properties.get(name)
+                      for feat in self.only('id', 'properties'))
+            return sum(value for value in values
+                       if field_types.value_type(value) in (field_types.INTEGER,
+                                                            field_types.REAL))
+
+        table = self.model._meta.db_table
+        sql, params = self.values('id').query.sql_with_params()
+        cursor = connections[self.db].cursor()
+        value_sql, value_params = number_value_sql(table, name)
+        cursor.execute("SELECT SUM({0}) FROM {1} WHERE id IN ({2})".format(
+                           value_sql, table, sql),
+                       value_params + list(params))
+        return cursor.fetchone()[0] or 0
+
+    def property_values(self, name):
+        """(feature id, value) for each feature whose `name` value is
+        a number, ordered by id. Values are floats."""
+        if not self._is_postgresql():
+            values = ((feat.id, feat.properties.get(name))
+                      for feat in self.only('id', 'properties').order_by('id'))
+            return [(feat_id, float(value)) for feat_id, value in values
+                    if field_types.value_type(value) in (field_types.INTEGER,
+                                                         field_types.REAL)]
+
+        value_sql, value_params = number_value_sql(self.model._meta.db_table, name)
+        return list(self.property_range(name)
+                    .extra(select={'property_value': value_sql + '::float8'},
+                           select_params=value_params)
+                    .order_by('id')
+                    .values_list('id', 'property_value'))
+
+class FeatureManager(models.GeoManager):
+
+    def get_queryset(self):
+        return FeatureQuerySet(self.model, using=self._db)
+
 class Feature(models.Model):
     """Generic geographic data model:
     This model is used when we are parsing a shapefile and we do not
@@ -123,7 +407,12 @@ class Feature(models.Model):
     geom_geometrycollection = models.GeometryCollectionField(srid=4326,
                                                              blank=True,
                                                              null=True)
-    objects = models.GeoManager()
+    ## Features for census geographies use a shared boundary
+    ## instead of a geometry of their own.
+    boundary = models.ForeignKey(Boundary, blank=True, null=True)
+    ## Field values for this feature, keyed by DataField.field_name
+    properties = JSONField(blank=True, default=dict)
+    objects = FeatureManager()
 
     def __str__(self):
         return "{}".format(self.id)
@@ -133,17 +422,60 @@ class Feature(models.Model):
         geoms = [self.geom_point, self.geom_multipoint,
                  self.geom_multilinestring, self.geom_multipolygon,
                  self.geom_geometrycollection]
-        geom = next(filter(lambda x: x, geoms))
+        geom = next(filter(lambda x: x, geoms), None)
+        if geom is None and self.boundary_id:
+            ## select_related('boundary') to avoid a query per feature
+            geom = self.boundary.geometry
         return geom
     geometry = property(_get_geometry)
 
+    class Meta:
+        ## Census boundaries are looked up by these
+        index_together = [('reference', 'federal_geo_id')]
+
+class SimplifiedGeometry(models.Model):
+    """A Feature's geometry simplified for display at zoom levels up to
+    `zoom` (see file_processors/simplify.py)."""
+    datafile = models.ForeignKey(DataFile)
+    feature = models.ForeignKey(Feature)
+    zoom = models.PositiveSmallIntegerField()
+    geometry = models.GeometryField(srid=4326)
+    objects = models.GeoManager()
+
+    def __str__(self):
+        return "{0} @ z{1}".format(self.feature_id, self.zoom)
+
+    class Meta:
+        unique_together = ('feature', 'zoom')
+        index_together = [('datafile', 'zoom')]
+
+class SimplifiedBoundary(models.Model):
+    """A Boundary's geometry simplified for display at zoom levels up
+    to `zoom`. Census features are drawn from these instead of having
+    SimplifiedGeometry rows of their own, so each boundary is simplified
+    once however many files use it. `content_hash` is the boundary's
+    when this was made: if they differ, the boundary has changed since."""
+    boundary = models.ForeignKey(Boundary)
+    zoom = models.PositiveSmallIntegerField()
+    content_hash = models.CharField(max_length=64)
+    geometry = models.GeometryField(srid=4326)
+    objects = models.GeoManager()
+
+    def __str__(self):
+        return "{0} @ z{1}".format(self.boundary_id, self.zoom)
+
+    class Meta:
+        unique_together = ('boundary', 'zoom')
+
 class Attribute(models.Model):
     """This model is for holding generic values that appear in the
     data files that are uploaded. This data is bound to a feature object
     (above), which is collected in a whole DataFile.
 
-    This model is where most of the interesting data lives, but is
-    stored generically, because it could really be anything..."""
+    This model is where the interesting data used to live, one row per
+    field per feature. Processors now write Feature.properties and
+    DataField instead; these rows are only kept around until they've
+    been copied over with `manage.py backfill_feature_properties`."""
     feature = models.ForeignKey(Feature)
     field_name = models.CharField(max_length=255)
     attr_type = models.CharField(max_length=20)
@@ -19,3 +19,39 @@ function switchup(someobj) {
 function crunch_vals(data) {
     return _.map(data, switchup);
 }
+
+// Choropleth classes (see the datafile_classes view):
+// data.ids[i] is a feature id and data.classes[i] its class.
+var CLASS_COLORS = ['#f7fbff', '#deebf7', '#c6dbef', '#9ecae1', '#6baed6',
+                    '#4292c6', '#2171b5', '#08519c', '#08306b'];
+
+function class_color(index, classes) {
+    var step = (CLASS_COLORS.length - 1) / Math.max(classes - 1, 1);
+    return CLASS_COLORS[Math.round(index * step)];
+}
+
+// Map each classified feature id to its class color
+function class_lookup(data) {
+    var classes = data.breaks.length - 1;
+    var colors = {};
+    for (var i = 0; i < data.ids.length; i++) {
+	colors[data.ids[i]] = class_color(data.classes[i], classes);
+    }
+    return colors;
+}
+
+// Attributes for many features at once (see the feature_attributes
+// view): field names once, then one list of values per field.
+// Returns popup text by feature id.
+function attribute_text(data) {
+    var text = {};
+    for (var i = 0; i < data.ids.length; i++) {
+	var content = "";
+	for (var j = 0; j < data.fields.length; j++) {
+	    var value = data.values[j][i];
+	    content += data.fields[j] + " : " + (value === null ? "" : value) + "<br />";
+	}
+	text[data.ids[i]] = content;
+    }
+    return text;
+}
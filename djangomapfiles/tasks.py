@@ -4,20 +4,55 @@ files.
 
 It uses the database model to examine  
 """
-from celery import task
+from celery import chord, task
+
+from django.conf import settings
 
 from .file_processors import shapefile_processor
 from .file_processors import acs_processor
-# from .file_processors import kml_processor
+from .file_processors import kml_processor
+from .file_processors import geojson_processor
 from .file_processors.set_center import set_center
+from .file_processors.simplify import build_simplified_geometries
+from .file_processors.metrics import IngestStats
+from .artifacts import build_artifacts
 
-from .models import DataFile, Feature
+from .models import DataFile, Feature, IngestCheckpoint
 
-@task
+## acks_late: if a worker dies mid-file, the task is handed to another
+## worker, which resumes from the datafile's IngestCheckpoints.
+@task(acks_late=True)
 def process_files(model_id, file_type):
     processor = FileProcessor(model_id, file_type)
     processor.process()
+    ## Big shapefiles are handed off to a chord of chunk tasks;
+    ## the chord's callback finishes the datafile in that case.
+    if not processor.deferred:
+        processor.simplify_geometries()
+        processor.set_default_center()
+        processor.build_geojson_artifacts()
+    processor.stats.finish(model_id)
+
+@task(acks_late=True)
+def process_shapefile_chunk(model_id, file_type, shapefile, start, stop, chunk_size):
+    processor = FileProcessor(model_id, file_type,
+                              label="{0} [{1}:{2}]".format(file_type, start, stop))
+    features = processor.process_shapefile_range(shapefile, start, stop, chunk_size)
+    processor.stats.finish(model_id)
+    return features
+
+## `started` is when process_files began, so that this run's stats
+## give the wall time of the whole load, chunks and all.
+@task
+def finalize_datafile(feature_counts, model_id, file_type, started=None):
+    processor = FileProcessor(model_id, file_type,
+                              label="{} finalize".format(file_type),
+                              started=started)
+    processor.simplify_geometries()
     processor.set_default_center()
+    processor.build_geojson_artifacts()
+    processor.stats.count(features=sum(feature_counts))
+    processor.stats.finish(model_id)
 
 
 ## API Goals: Everything this guy calls should
@@ -27,9 +62,19 @@ def process_files(model_id, file_type):
 
 class FileProcessor:
 
-    def __init__(self, model_id, file_type):
+    def __init__(self, model_id, file_type, label=None, started=None):
         self.model_id = model_id
         self.file_type = file_type
+        ## Stage timings and counts for this run; see metrics.py
+        self.stats = IngestStats(label or file_type, started=started)
+        ## How many features get written per bulk insert/transaction
+        self.batch_size = getattr(settings, "MAPFILES_INGEST_BATCH_SIZE", 500)
+        ## Read shapefile ZIPs in place instead of extracting them
+        self.use_vsizip = getattr(settings, "MAPFILES_SHAPEFILE_VSIZIP", True)
+        ## Shapefiles with more features than this are split into
+        ## chunks that load in parallel across workers.
+        self.chunk_size = getattr(settings, "MAPFILES_SHAPEFILE_CHUNK_SIZE", 25000)
+        self.deferred = False
         self._router()
 
     def _router(self):
@@ -40,37 +85,110 @@ class FileProcessor:
                        "places": self.process_acs_datafile,
                        "kml": self.process_kml_file,
                        "kmz": self.process_kml_file,
+                       "geojson": self.process_geojson_file,
+                       "geojsonseq": self.process_geojson_file,
                        "shapefile": self.process_shapefile,
                        "shapefile_zip": self.process_shapefile }
         self.process = self.types[self.file_type]
 
+    def _shapefile_processor(self):
+        return shapefile_processor.ProcessShapefile(self.file_type,
+                                                    self.batch_size,
+                                                    self.use_vsizip,
+                                                    self.stats)
+
+    def _can_split_shapefile(self):
+        ## Every worker has to be able to open the file itself, which
+        ## rules out a ZIP that was extracted into a local tempdir.
+        if not self.chunk_size:
+            return False
+        return self.file_type == "shapefile" or self.use_vsizip
+
+    def _restart_if_split_differently(self, datafile, chunk_size):
+        """Checkpoints only line up with ranges of the size they were
+        made for. If an earlier run split the file another way (the
+        chunk size setting changed, or the file was loaded whole),
+        throw away what it loaded and start over."""
+        if (IngestCheckpoint.objects.filter(datafile=datafile)
+                .exclude(chunk_size=chunk_size).exists()):
+            datafile.reset_processing()
+
     def process_shapefile(self):
-        file_processor = shapefile_processor.ProcessShapefile(self.file_type)
+        file_processor = self._shapefile_processor()
         shapefile = file_processor.get_path(self.model_id)
+        if self._can_split_shapefile():
+            ranges = file_processor.feature_ranges(shapefile, self.chunk_size)
+            if len(ranges) > 1:
+                self._restart_if_split_differently(file_processor.datafile,
+                                                   self.chunk_size)
+                ## Chunks get the path (and chunk size) found here
+                ## rather than each working it out again.
+                header = [process_shapefile_chunk.s(self.model_id,
+                                                    self.file_type,
+                                                    shapefile,
+                                                    start, stop,
+                                                    self.chunk_size)
+                          for start, stop in ranges]
+                chord(header)(finalize_datafile.s(self.model_id,
+                                                  self.file_type,
+                                                  self.stats.started))
+                self.deferred = True
+                return
+        self._restart_if_split_differently(file_processor.datafile, None)
         file_processor.process_shapefile(shapefile)
 
+    def process_shapefile_range(self, shapefile, start, stop, chunk_size):
+        file_processor = self._shapefile_processor()
+        file_processor.get_datafile(self.model_id)
+        return file_processor.process_shapefile(shapefile, start, stop,
+                                                chunk_size)
+
 
     def process_acs_datafile(self):
-        file_processor = acs_processor.ProcessAcs(self.file_type)
+        file_processor = acs_processor.ProcessAcs(self.file_type,
+                                                  self.batch_size,
+                                                  self.stats)
         acs_file = file_processor.get_path(self.model_id)
         file_processor.parse_csv(acs_file)
 
     def process_kml_file(self):
-        pass
+        file_processor = kml_processor.ProcessKml(self.file_type,
+                                                  self.batch_size,
+                                                  self.stats)
+        kml_file = file_processor.get_path(self.model_id)
+        file_processor.parse_kml(kml_file)
+
+    def process_geojson_file(self):
+        file_processor = geojson_processor.ProcessGeoJson(self.file_type,
+                                                          self.batch_size,
+                                                          self.stats)
+        geojson_file = file_processor.get_path(self.model_id)
+        file_processor.parse_geojson(geojson_file)
 
         
+    def simplify_geometries(self):
+        with self.stats.stage('simplify'):
+            rows = build_simplified_geometries(self.model_id)
+        self.stats.count(rows=rows)
+
     def set_default_center(self):
-        file_features = Feature.objects.filter(datafile__id=self.model_id)
+        file_features = (Feature.objects.filter(datafile__id=self.model_id)
+                         .select_related('boundary'))
+        self.datafile = DataFile.objects.get(id=self.model_id)
         if file_features: 
-            center_point = set_center(file_features)
-            self.datafile = DataFile.objects.get(id=self.model_id)
+            with self.stats.stage('center'):
+                center_point = set_center(file_features)
             self.datafile.default_center = center_point
             self.datafile.process_note = "Center point saved. Processing complete."
         else: 
             self.datafile.process_note = "No Features saved. Center could not be processed."
         self.datafile.processed = True
+        self.datafile.version += 1
         self.datafile.save()
 
-
-
+    def build_geojson_artifacts(self):
+        ## After set_default_center: artifacts are named for the
+        ## version it leaves the datafile at.
+        with self.stats.stage('artifacts'):
+            build_artifacts(self.datafile)
 
@@ -5,14 +5,18 @@ register = template.Library()
 @register.inclusion_tag('js_map_libs.html')
 def load_map_lib(requested_lib):
         map_libs = {'openlayers-js' : 'http://openlayers.org/api/OpenLayers.js',
-                    'leaflet-js' : 'http://cdn.leafletjs.com/leaflet-0.7.2/leaflet.js'}
-        map_styles = {'leaflet-css' : 'http://cdn.leafletjs.com/leaflet-0.7.2/leaflet.css'}
+                    'leaflet-js' : '//unpkg.com/leaflet@1.0.3/dist/leaflet.js',
+                    'leaflet-vectorgrid-js' : '//unpkg.com/leaflet.vectorgrid@1.2.0/dist/Leaflet.VectorGrid.bundled.js'}
+        map_styles = {'leaflet-css' : '//unpkg.com/leaflet@1.0.3/dist/leaflet.css'}
 
         maps = {}
         maps_css = {}
         if requested_lib == 'leaflet':
                 maps['js'] = map_libs['leaflet-js']
                 maps_css['css'] = map_styles['leaflet-css']
+        elif requested_lib == 'leaflet-vectorgrid':
+                ## Load after "leaflet"
+                maps['js'] = map_libs['leaflet-vectorgrid-js']
         elif requested_lib == 'openlayers':
                 maps['js'] = map_libs['openlayers-js']
         else:
@@ -0,0 +1,97 @@
+"""Mapbox Vector Tiles for a DataFile, built by PostGIS (ST_AsMVT).
+
+Each tile holds one layer, "features", whose features carry only their
+id; the viewer fetches attributes on click. Lines and polygons are
+drawn from the SimplifiedGeometry band for the tile's zoom where there
+is one (the SimplifiedBoundary band, for census features), and everything is clipped to the tile (plus a buffer so strokes
+don't show seams). Tiles are cached in the Django cache, keyed by
+DataFile.version, so reprocessing a file makes its old tiles stale."""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from .models import Boundary, Feature, SimplifiedBoundary, SimplifiedGeometry
+from .file_processors.simplify import band_for_zoom
+
+## Half the width of the web mercator world, in meters
+MERCATOR_EXTENT = 20037508.342789244
+
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+LAYER_NAME = "features"
+
+GEOMETRY_FIELDS = ("geom_point", "geom_multipoint", "geom_multilinestring",
+                   "geom_multipolygon", "geom_geometrycollection")
+
+
+class TileError(Exception):
+    pass
+
+
+def tile_envelope(z, x, y):
+    """(xmin, ymin, xmax, ymax) of a tile in web mercator (3857)."""
+    size = 2 * MERCATOR_EXTENT / 2 ** z
+    xmin = -MERCATOR_EXTENT + x * size
+    ymax = MERCATOR_EXTENT - y * size
+    return (xmin, ymax - size, xmin + size, ymax)
+
+def tile_key(datafile, z, x, y):
+    return "mapfiles:tile:{0}:{1}:{2}:{3}:{4}".format(
+        datafile.id, datafile.version, z, x, y)
+
+def get_tile(datafile, z, x, y):
+    """The tile's MVT bytes, from the cache if we've built it before."""
+    if not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+        raise TileError("No tile {0}/{1}/{2}.".format(z, x, y))
+    key = tile_key(datafile, z, x, y)
+    tile = cache.get(key)
+    if tile is None:
+        tile = render_tile(datafile.id, z, x, y)
+        cache.set(key, tile,
+                  getattr(settings, "MAPFILES_TILE_CACHE_TIMEOUT", 60 * 60 * 24 * 7))
+    return tile
+
+def render_tile(datafile_id, z, x, y):
+    if connection.vendor != 'postgresql':
+        raise TileError("Vector tiles need PostGIS.")
+    envelope = "ST_MakeEnvelope(%s, %s, %s, %s, 3857)"
+    ## Each of the feature table's geometry columns is tested against
+    ## the tile on its own, so the planner can combine their spatial
+    ## indexes (a BitmapOr). A test on the joined boundary table in
+    ## the same OR would defeat that, so boundaries are matched in a
+    ## subquery that uses the boundary table's index instead.
+    overlaps = " OR ".join(
+        ["f.{0} && ST_Transform({1}, 4326)".format(field, envelope)
+         for field in GEOMETRY_FIELDS] +
+        ["f.boundary_id IN (SELECT id FROM {0} WHERE geometry && "
+         "ST_Transform({1}, 4326))".format(Boundary._meta.db_table, envelope)])
+    geometry_sql = "COALESCE(s.geometry, {0}, sb.geometry, b.geometry)".format(
+        ", ".join("f." + field for field in GEOMETRY_FIELDS))
+    sql = """SELECT ST_AsMVT(tile, %s, {extent}, 'geom') FROM (
+                 SELECT f.id,
+                        ST_AsMVTGeom(ST_Transform({geometry}, 3857), {envelope},
+                                     {extent}, {buffer}, true) AS geom
+                 FROM {feature} f
+                 LEFT JOIN {boundary} b ON b.id = f.boundary_id
+                 LEFT JOIN {simplified} s ON s.feature_id = f.id AND s.zoom = %s
+                 LEFT JOIN {simplified_boundary} sb ON sb.boundary_id = b.id
+                     AND sb.zoom = %s AND sb.content_hash = b.content_hash
+                 WHERE f.datafile_id = %s AND ({overlaps})
+             ) AS tile WHERE geom IS NOT NULL""".format(
+                 extent=TILE_EXTENT,
+                 buffer=TILE_BUFFER,
+                 geometry=geometry_sql,
+                 envelope=envelope,
+                 overlaps=overlaps,
+                 feature=Feature._meta.db_table,
+                 boundary=Boundary._meta.db_table,
+                 simplified=SimplifiedGeometry._meta.db_table,
+                 simplified_boundary=SimplifiedBoundary._meta.db_table)
+    bounds = list(tile_envelope(z, x, y))
+    band = band_for_zoom(z)
+    params = ([LAYER_NAME] + bounds + [band, band, datafile_id] +
+              bounds * (len(GEOMETRY_FIELDS) + 1))
+    cursor = connection.cursor()
+    cursor.execute(sql, params)
+    tile = cursor.fetchone()[0]
+    return bytes(tile) if tile is not None else b""
@@ -13,12 +13,34 @@ urlpatterns = patterns('',
                             views.edit_datafile, name='edit_datafile'),
                         url(r'^delete/(?P<file_id>\d+)$', 
                             views.delete_datafile, name='delete_datafile'),
+                        url(r'^classes/(?P<file_id>\d+)$',
+                            views.datafile_classes, name='datafile_classes'),
+                        url(r'^tiles/(?P<file_id>\d+)/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.pbf$',
+                            views.datafile_tile, name='datafile_tile'),
+                        url(r'^geojson/(?P<file_id>\d+)$',
+                            views.datafile_geojson, name='datafile_geojson'),
+)
+
+## Chunked upload API
+urlpatterns += patterns('',
+                        url(r'^upload/start$',
+                            views.start_chunked_upload, name='start_chunked_upload'),
+                        url(r'^upload/(?P<upload_id>[0-9a-f]{32})$',
+                            views.chunked_upload_status, name='chunked_upload_status'),
+                        url(r'^upload/(?P<upload_id>[0-9a-f]{32})/chunk$',
+                            views.upload_chunk, name='upload_chunk'),
+                        url(r'^upload/(?P<upload_id>[0-9a-f]{32})/complete$',
+                            views.complete_chunked_upload, name='complete_chunked_upload'),
 )
 
 ## Feature patterns
 urlpatterns += patterns('',
                         url(r'^feature/view/(?P<feat_id>\d+)$', 
                             views.view_feature, name='view_feature'),
+                        url(r'^feature/attributes/(?P<file_id>\d+)$',
+                            views.feature_attributes, name='feature_attributes'),
+                        url(r'^feature/identify/(?P<file_id>\d+)$',
+                            views.identify_features, name='identify_features'),
                         url(r'^feature/locfind/$', 
                             views.feature_detail_by_loc, name='feature_detail_by_loc'),
 )
@@ -1,17 +1,33 @@
+import hashlib
+import json
+
 from django.shortcuts import render
 from django.views.decorators.cache import cache_page
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_headers
+from django.core.files.storage import default_storage
 from django.core import serializers
 from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.http import HttpResponseRedirect, HttpResponse, Http404
+from django.http import HttpResponseBadRequest, HttpResponseNotAllowed
+from django.http import StreamingHttpResponse
 from django.contrib.gis.shortcuts import render_to_kml
+from django.contrib.gis.geos import Point
 
 from django.contrib.admin.views.decorators import staff_member_required
 from django.views.decorators.clickjacking import xframe_options_exempt
 
-from .models import DataFile, Feature, Attribute
-from .forms import DataFileUploadForm, DataFileEditForm
+from .models import DataFile, Feature, ChunkedUpload
+from .forms import DataFileUploadForm, DataFileEditForm, ChunkedUploadStartForm
 from .tasks import process_files
+from . import chunked_upload
+from . import artifacts
+from . import classify
+from . import export
+from . import identify
+from . import tiles
 
 
 ONE_MINUTE = 60
@@ -49,23 +65,181 @@ def upload_datafile(request,
         form = DataFileUploadForm()
     return render(request, template_file, {'form': form})
 
-@cache_page(ONE_MINUTE)
+def _json_response(data, response_class=HttpResponse):
+    return response_class(json.dumps(data), content_type="application/json")
+
+def _upload_status(upload):
+    status = {'upload_id': upload.upload_id,
+              'received': upload.received,
+              'total_size': upload.total_size,
+              'chunk_size': chunked_upload.max_chunk_size()}
+    if upload.datafile_id:
+        status['datafile'] = upload.datafile_id
+    return status
+
+####### ---------------------------- #######
+###       Chunked File Uploading     ###
+####### ---------------------------- #######
+
+## Large files come in as raw chunks: POST to start, POST each chunk
+## (body is the raw bytes; ?offset= and ?checksum= give its position
+## and md5), GET the status to resume, then POST to complete.
+
+@staff_member_required
+def start_chunked_upload(request):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    form = ChunkedUploadStartForm(request.POST)
+    if not form.is_valid():
+        return _json_response({'errors': form.errors}, HttpResponseBadRequest)
+    try:
+        upload = chunked_upload.start_upload(form.save(commit=False))
+    except chunked_upload.ChunkedUploadError as e:
+        return _json_response({'errors': str(e)}, HttpResponseBadRequest)
+    return _json_response(_upload_status(upload))
+
+@staff_member_required
+def chunked_upload_status(request, upload_id):
+    upload = get_object_or_404(ChunkedUpload, upload_id=upload_id)
+    return _json_response(_upload_status(upload))
+
+@staff_member_required
+def upload_chunk(request, upload_id):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    upload = get_object_or_404(ChunkedUpload, upload_id=upload_id)
+    try:
+        offset = int(request.GET['offset'])
+        length = int(request.META['CONTENT_LENGTH'])
+        checksum = request.GET['checksum']
+    except (KeyError, ValueError):
+        return _json_response({'errors': "offset, checksum and Content-Length are required."},
+                              HttpResponseBadRequest)
+    try:
+        chunked_upload.write_chunk(upload, request, offset, length, checksum)
+    except chunked_upload.ChunkedUploadError as e:
+        return _json_response({'errors': str(e)}, HttpResponseBadRequest)
+    return _json_response(_upload_status(upload))
+
+@staff_member_required
+def complete_chunked_upload(request, upload_id):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    upload = get_object_or_404(ChunkedUpload, upload_id=upload_id)
+    try:
+        datafile, created = chunked_upload.finish_upload(upload)
+    except chunked_upload.ChunkedUploadError as e:
+        return _json_response({'errors': str(e)}, HttpResponseBadRequest)
+    if created:
+        process_files.delay(datafile.id, datafile.file_type)
+    return _json_response(_upload_status(upload))
+
 def view_datafile(request, file_id,
                   template_file = 'viewdatafile.html'):
-    all_features = Feature.objects.filter(
-        datafile__id=file_id)
-    datafile = DataFile.objects.get(id=file_id)
-    lat, lon = datafile.default_center.tuple
+    ## Features are drawn from vector tiles (see datafile_tile),
+    ## so the page is the same size however big the file is.
+    datafile = get_object_or_404(DataFile, id=file_id)
+    lon, lat = datafile.default_center.tuple
     zoom = datafile.default_zoom
     if not zoom:
         zoom = 10
-    temp_vars = {'features' : all_features,
-                 'datafile': datafile,
+    temp_vars = {'datafile': datafile,
+                 ## ?field= colors features by that field's classes
+                 'field': request.GET.get('field', ''),
+                 'method': request.GET.get('method', 'quantile'),
                  'lat': lat,
                  'lon': lon,
                  'zoom': zoom}
     return render(request, template_file, temp_vars)
- 
+
+def datafile_tile(request, file_id, z, x, y):
+    datafile = get_object_or_404(DataFile, id=file_id)
+    try:
+        tile = tiles.get_tile(datafile, int(z), int(x), int(y))
+    except tiles.TileError:
+        raise Http404
+    response = HttpResponse(tile, content_type="application/vnd.mapbox-vector-tile")
+    ## The viewer asks for ?v=<version>, so a new version is a new URL
+    patch_cache_control(response, public=True, max_age=ONE_DAY)
+    return response
+
+## A datafile's GeoJSON only changes when it is reprocessed. Each
+## encoding and each query is its own representation, though, so
+## they're in the ETag too.
+def _geojson_etag(request, file_id):
+    datafile = DataFile.objects.filter(id=file_id).only('id', 'version').first()
+    if datafile is None:
+        return None
+    etag = "{0}-{1}".format(file_id, datafile.version)
+    if request.GET:
+        query = request.GET.urlencode().encode('utf-8')
+        return "{0}-{1}".format(etag, hashlib.md5(query).hexdigest()[:16])
+    encoding, _ = artifacts.find_artifact(
+        datafile, request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    return "{0}-{1}".format(etag, encoding or "identity")
+
+def _geojson_last_modified(request, file_id):
+    datafile = DataFile.objects.filter(id=file_id).only('id', 'version').first()
+    if datafile is None:
+        return None
+    path = artifacts.artifact_path(datafile, "gzip")
+    if not default_storage.exists(path):
+        return None
+    return default_storage.modified_time(path)
+
+def _serve_artifact(encoding, path):
+    artifact = default_storage.open(path)
+    response = StreamingHttpResponse(artifact.chunks(),
+                                     content_type="application/geo+json")
+    response['Content-Encoding'] = encoding
+    response['Content-Length'] = artifact.size
+    return response
+
+## Vary goes on every response, 304s included: whether the artifact
+## is served depends on Accept-Encoding.
+@vary_on_headers('Accept-Encoding')
+@condition(etag_func=_geojson_etag, last_modified_func=_geojson_last_modified)
+def datafile_geojson(request, file_id):
+    """Stream the features as a GeoJSON FeatureCollection.
+    ?bbox=minlon,minlat,maxlon,maxlat keeps the ones in a box,
+    ?fields=a,b picks properties, ?limit= with ?cursor= pages
+    through them (each page gives the next page's cursor), and
+    ?precision= and ?simplify= trim the geometries.
+
+    The whole collection is served from the precompressed artifact
+    written when the file was processed, if the client accepts it."""
+    datafile = get_object_or_404(DataFile, id=file_id)
+    if not request.GET:
+        encoding, path = artifacts.find_artifact(
+            datafile, request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if path is not None:
+            return _serve_artifact(encoding, path)
+    features = Feature.objects.filter(datafile=datafile)
+    try:
+        if 'bbox' in request.GET:
+            features = export.filter_bbox(features,
+                                          export.bbox_polygon(request.GET['bbox']))
+        if 'cursor' in request.GET:
+            features = features.filter(id__gt=int(request.GET['cursor']))
+        limit = int(request.GET['limit']) if 'limit' in request.GET else None
+        precision = int(request.GET.get('precision', export.DEFAULT_PRECISION))
+        simplify = float(request.GET.get('simplify', 0))
+    except ValueError:
+        return _json_response({'errors': "bbox, cursor, limit, precision or simplify is malformed."},
+                              HttpResponseBadRequest)
+    if limit is not None and limit < 1:
+        return _json_response({'errors': "limit must be at least 1."},
+                              HttpResponseBadRequest)
+    if not 0 <= precision <= 15 or simplify < 0:
+        return _json_response({'errors': "precision must be 0-15 and simplify at least 0."},
+                              HttpResponseBadRequest)
+    fields = None
+    if 'fields' in request.GET:
+        fields = [name for name in request.GET['fields'].split(',') if name]
+    return StreamingHttpResponse(export.feature_collection(features, fields, limit,
+                                                           precision=precision,
+                                                           simplify=simplify),
+                                 content_type="application/geo+json")
 
 @staff_member_required
 def edit_datafile(request, file_id,
@@ -89,6 +263,7 @@ def delete_datafile(request, file_id,
     temp_vars = {'datafile' : datafile_to_del}
     if request.method == "POST":
         datafile_to_del.stored_file.delete()
+        artifacts.remove_artifacts(datafile_to_del)
         datafile_to_del.delete()
         return redirect('list_datafiles')
             
@@ -101,25 +276,96 @@ def delete_datafile(request, file_id,
 
 @cache_page(ONE_MINUTE)
 def view_feature(request, feat_id):
-    attributes = Attribute.objects.filter(feature__id=feat_id)
-    json_values = serializers.serialize('json', 
-                                        attributes,
-                                        fields=('field_name', 'field_value'))
+    ## Same shape as the model serializer's output used to be,
+    ## so the viewer's javascript doesn't need to change.
+    feature = get_object_or_404(Feature, id=feat_id)
+    attributes = [{"fields": {"field_name": name,
+                              "field_value": feature.properties.get(name, "")}}
+                  for name in feature.datafile.fieldnames]
+    json_values = json.dumps(attributes)
     return HttpResponse(json_values, content_type="application/json")
 
+def datafile_classes(request, file_id):
+    """Choropleth classes for one numeric field:
+    ?field=<name>&method=quantile|equal_interval|jenks&classes=<2-9>"""
+    datafile = get_object_or_404(DataFile, id=file_id)
+    try:
+        classes = int(request.GET.get('classes', 5))
+    except ValueError:
+        classes = 0
+    if not 2 <= classes <= 9:
+        return _json_response({'errors': "classes must be between 2 and 9."},
+                              HttpResponseBadRequest)
+    try:
+        result = classify.classify(datafile,
+                                   request.GET.get('field', ''),
+                                   request.GET.get('method', 'quantile'),
+                                   classes)
+    except classify.ClassificationError as e:
+        return _json_response({'errors': str(e)}, HttpResponseBadRequest)
+    return _json_response(result)
+
+## Most feature ids a single feature_attributes request may ask for
+MAX_ATTRIBUTE_IDS = 500
+
+def _attribute_columns(datafile, ids):
+    fields = list(datafile.fieldnames)
+    features = (Feature.objects.filter(datafile=datafile, id__in=ids)
+                .only('id', 'properties').order_by('id'))
+    found_ids = []
+    values = [[] for name in fields]
+    for feat in features:
+        found_ids.append(feat.id)
+        for column, name in zip(values, fields):
+            column.append(feat.properties.get(name))
+    return {'fields': fields, 'ids': found_ids, 'values': values}
+
+def feature_attributes(request, file_id):
+    """Field values for many of a datafile's features at once:
+    ?ids=1,2,3 gives {"fields": [...], "ids": [...], "values": [...]},
+    where values holds one list per field, in the order of ids."""
+    datafile = get_object_or_404(DataFile, id=file_id)
+    try:
+        ids = [int(feat_id) for feat_id in request.GET.get('ids', '').split(',') if feat_id]
+    except ValueError:
+        return _json_response({'errors': "ids must be a list of numbers."},
+                              HttpResponseBadRequest)
+    if len(ids) > MAX_ATTRIBUTE_IDS:
+        return _json_response({'errors': "At most {} ids at a time.".format(MAX_ATTRIBUTE_IDS)},
+                              HttpResponseBadRequest)
+    return _json_response(_attribute_columns(datafile, ids))
+
+def identify_features(request, file_id):
+    """The datafile's features at ?lon=&lat= (within ?tolerance=
+    degrees), with their attributes in the same columns as
+    feature_attributes."""
+    datafile = get_object_or_404(DataFile, id=file_id)
+    try:
+        lon = float(request.GET['lon'])
+        lat = float(request.GET['lat'])
+        tolerance = float(request.GET.get('tolerance', identify.DEFAULT_TOLERANCE))
+    except (KeyError, ValueError):
+        return _json_response({'errors': "lon and lat are required numbers."},
+                              HttpResponseBadRequest)
+    if not 0 <= tolerance <= 1:
+        return _json_response({'errors': "tolerance must be between 0 and 1."},
+                              HttpResponseBadRequest)
+    ids = identify.feature_ids_at(datafile, lon, lat, tolerance)
+    return _json_response(_attribute_columns(datafile, ids[:MAX_ATTRIBUTE_IDS]))
+
 @cache_page(ONE_MINUTE)
 def feature_detail_by_loc(request):
-    if request.GET:
-        if request.GET['longitude'] and request.GET['latitude']:
-            lat = float(request.GET.get('latitude', ''))
-            lon = float(request.GET.get('longitude', ''))
-            detail_pt = Point(lon, lat)
-            feature = Feature.objects.filter(geometry__contains=detail_pt)
-            edata = serializers.serialize("json", feature)
-            return HttpResponse(edata, mimetype='application/json')
-        else:
-            raise Http404
-    else:
+    """Features containing ?longitude=&latitude=, in any datafile
+    (or only ?datafile=), in the model serializer's format."""
+    try:
+        lon = float(request.GET['longitude'])
+        lat = float(request.GET['latitude'])
+        datafile_id = int(request.GET.get('datafile') or 0)
+    except (KeyError, ValueError):
         raise Http404
-
-
+    features = Feature.objects.all()
+    if datafile_id:
+        features = features.filter(datafile=datafile_id)
+    features = identify.features_at(features, Point(lon, lat, srid=4326), tolerance=0)
+    edata = serializers.serialize("json", features)
+    return HttpResponse(edata, content_type='application/json')
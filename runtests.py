@@ -1,4 +1,6 @@
+import os
 import sys
+import tempfile
 
 try:
     from django.conf import settings
@@ -6,16 +8,27 @@ try:
     settings.configure(
         DEBUG=True,
         USE_TZ=True,
+        ## The models need a spatial database: PostGIS, unless
+        ## MAPFILES_TEST_DB_ENGINE says otherwise (e.g. spatialite,
+        ## where the PostgreSQL-only tests are skipped).
         DATABASES={
             "default": {
-                "ENGINE": "django.db.backends.sqlite3",
+                "ENGINE": os.environ.get("MAPFILES_TEST_DB_ENGINE",
+                                         "django.contrib.gis.db.backends.postgis"),
+                "NAME": os.environ.get("MAPFILES_TEST_DB_NAME", "mapfiles"),
+                "USER": os.environ.get("MAPFILES_TEST_DB_USER", ""),
+                "PASSWORD": os.environ.get("MAPFILES_TEST_DB_PASSWORD", ""),
+                "HOST": os.environ.get("MAPFILES_TEST_DB_HOST", ""),
             }
         },
+        ## Uploaded files and artifacts written by the tests
+        MEDIA_ROOT=tempfile.mkdtemp(),
         ROOT_URLCONF="djangomapfiles.urls",
         INSTALLED_APPS=[
             "django.contrib.auth",
             "django.contrib.contenttypes",
             "django.contrib.sites",
+            "django.contrib.gis",
             "djangomapfiles",
         ],
         SITE_ID=1,
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_acs
+------------
+
+Tests that ACS csv files are loaded a batch of rows at a time.
+"""
+
+import os
+import shutil
+import tempfile
+
+import mock
+from django.contrib.gis.geos import MultiPolygon, Polygon
+from django.test import TestCase
+
+from djangomapfiles.models import Boundary, DataField, Feature
+from djangomapfiles.file_processors import boundaries
+from djangomapfiles.file_processors.acs_processor import ProcessAcs
+
+from .utils import make_datafile
+
+
+def square(x):
+    return MultiPolygon(Polygon(((x, 0), (x, 1), (x + 1, 1),
+                                 (x + 1, 0), (x, 0))), srid=4326)
+
+
+def write_acs(path, geo_ids):
+    with open(path, "w") as f:
+        f.write("GEO.id,GEO.id2,HC01_VC03\n")
+        f.write("Id,Id2,Total\n")
+        for n, geo_id in enumerate(geo_ids):
+            f.write("1400000US{0},{0},{1}\n".format(geo_id, n * 10))
+
+
+class TestAcsBatches(TestCase):
+
+    def setUp(self):
+        boundaries._recent_boundaries.clear()
+        self.directory = tempfile.mkdtemp()
+        self.geo_ids = ["{:05d}".format(n) for n in range(10)]
+        ## The last geography has no boundary anywhere
+        for n, geo_id in enumerate(self.geo_ids[:-1]):
+            Boundary.objects.create(geography_type="counties",
+                                    federal_geo_id=geo_id,
+                                    geometry=square(n))
+        path = os.path.join(self.directory, "acs.csv")
+        write_acs(path, self.geo_ids)
+        self.datafile = make_datafile(path, "counties")
+
+    def tearDown(self):
+        boundaries._recent_boundaries.clear()
+        shutil.rmtree(self.directory)
+
+    def process(self):
+        processor = ProcessAcs("counties", batch_size=4)
+        processor.boundaries = boundaries.BoundaryCache(
+            provider=boundaries.NullBoundaryProvider())
+        processor.parse_csv(processor.get_path(self.datafile.id))
+        return processor
+
+    def test_boundaries_are_looked_up_a_batch_at_a_time(self):
+        get_ids = boundaries.BoundaryCache.get_ids
+        with mock.patch.object(boundaries.BoundaryCache, "get_ids", autospec=True,
+                               side_effect=get_ids) as patched:
+            self.process()
+        batches = [call[0][2] for call in patched.call_args_list]
+        self.assertEqual(batches, [self.geo_ids[0:4], self.geo_ids[4:8],
+                                   self.geo_ids[8:10]])
+
+    def test_rows_with_boundaries_become_features(self):
+        self.process()
+        features = Feature.objects.filter(datafile=self.datafile).order_by('federal_geo_id')
+        self.assertEqual([feat.federal_geo_id for feat in features], self.geo_ids[:-1])
+        self.assertEqual([feat.properties["Total"] for feat in features],
+                         [n * 10 for n in range(9)])
+        self.assertEqual(features[3].boundary.federal_geo_id, self.geo_ids[3])
+        self.assertEqual(list(DataField.objects.filter(datafile=self.datafile)
+                              .values_list('field_name', 'attr_type')),
+                         [("Id", "str"), ("Id2", "str"), ("Total", "int")])
+
+    def test_only_one_batch_of_boundary_ids_is_kept(self):
+        processor = self.process()
+        self.assertEqual(set(processor.boundary_map), set(self.geo_ids[8:9]))
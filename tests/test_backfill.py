@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_backfill
+------------
+
+Tests for copying old Attribute rows into typed DataFields and
+Feature.properties.
+"""
+
+from django.contrib.gis.geos import Point
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.six import StringIO
+
+from djangomapfiles.models import Attribute, DataFile, Feature
+
+from .utils import requires_postgis
+
+
+class TestBackfill(TestCase):
+
+    def make_file(self, name, file_type, rows, fields):
+        """`fields` is [(name, attr_type)]; each row is the field_value
+        texts, in the same order."""
+        datafile = DataFile.objects.create(name=name, file_type=file_type,
+                                           stored_file=name)
+        for n, row in enumerate(rows):
+            feat = Feature.objects.create(datafile=datafile,
+                                          geom_point=Point(n, n, srid=4326))
+            for (field_name, attr_type), value in zip(fields, row):
+                Attribute.objects.create(feature=feat, field_name=field_name,
+                                         attr_type=attr_type, field_value=value)
+        return datafile
+
+    def backfill(self, datafile):
+        call_command('backfill_feature_properties', str(datafile.id), stdout=StringIO())
+        features = Feature.objects.filter(datafile=datafile).order_by('id')
+        types = dict(datafile.datafield_set.values_list('field_name', 'attr_type'))
+        return types, [feat.properties for feat in features]
+
+    def test_shapefile_types_and_values(self):
+        datafile = self.make_file(
+            "roads.zip", "shapefile_zip",
+            [["A", "12", "1.5", "2020-01-02", "2020-01-02 03:04:05"],
+             ["B", "None", "None", "None", "None"]],
+            [("NAME", "OFTString"), ("LANES", "OFTInteger"), ("LENGTH", "OFTReal"),
+             ("OPENED", "OFTDate"), ("CHECKED", "OFTDateTime")])
+        types, properties = self.backfill(datafile)
+        self.assertEqual(types, {"NAME": "str", "LANES": "int", "LENGTH": "float",
+                                 "OPENED": "date", "CHECKED": "datetime"})
+        self.assertEqual(properties, [
+            {"NAME": "A", "LANES": 12, "LENGTH": 1.5,
+             "OPENED": "2020-01-02", "CHECKED": "2020-01-02T03:04:05"},
+            {"NAME": "B", "LANES": None, "LENGTH": None,
+             "OPENED": None, "CHECKED": None}])
+
+    def test_csv_columns_get_one_type(self):
+        datafile = self.make_file(
+            "acs.csv", "counties",
+            [["06001", "10", "3"], ["06003", "", "4.5"], ["06005", "7", "None"]],
+            [("GEOID", ""), ("POP", ""), ("RATE", "")])
+        types, properties = self.backfill(datafile)
+        self.assertEqual(types, {"GEOID": "str", "POP": "int", "RATE": "float"})
+        self.assertEqual([props["GEOID"] for props in properties],
+                         ["06001", "06003", "06005"])
+        self.assertEqual([props["POP"] for props in properties], [10, None, 7])
+        self.assertEqual([props["RATE"] for props in properties], [3.0, 4.5, None])
+
+    def test_delete(self):
+        datafile = self.make_file("a.zip", "shapefile_zip", [["1"]],
+                                  [("N", "OFTInteger")])
+        call_command('backfill_feature_properties', str(datafile.id),
+                     delete=True, stdout=StringIO())
+        self.assertFalse(Attribute.objects.filter(feature__datafile=datafile).exists())
+
+    @requires_postgis
+    def test_backfilled_numbers_can_be_summed(self):
+        datafile = self.make_file("b.zip", "shapefile_zip", [["1"], ["None"], ["5"]],
+                                  [("N", "OFTInteger")])
+        self.backfill(datafile)
+        self.assertEqual(Feature.objects.filter(datafile=datafile).property_sum("N"), 6)
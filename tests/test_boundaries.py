@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_boundaries
+------------
+
+Tests that census boundaries are looked up in bulk, not per row.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from django.contrib.gis.geos import MultiPolygon, Polygon
+from django.test import TestCase
+
+from djangomapfiles.models import Boundary, DataFile
+from djangomapfiles.file_processors import boundaries
+from djangomapfiles.file_processors.acs_processor import ProcessAcs
+
+
+class NoBoundaries(boundaries.BoundaryProvider):
+
+    def fetch(self, geography_type, federal_geo_id):
+        return None
+
+
+def square(x):
+    return MultiPolygon(Polygon(((x, 0), (x, 1), (x + 1, 1),
+                                 (x + 1, 0), (x, 0))), srid=4326)
+
+
+class TestBoundaryLookups(TestCase):
+
+    def setUp(self):
+        boundaries._recent_boundaries.clear()
+        self.geo_ids = ["{:05d}".format(n) for n in range(20)]
+        for n, geo_id in enumerate(self.geo_ids):
+            Boundary.objects.create(geography_type="county",
+                                    federal_geo_id=geo_id,
+                                    geometry=square(n))
+        self.cache = boundaries.BoundaryCache(provider=NoBoundaries())
+
+    def tearDown(self):
+        boundaries._recent_boundaries.clear()
+
+    def test_stored_boundaries_take_one_query(self):
+        with self.assertNumQueries(1):
+            found = self.cache.get_many("county", self.geo_ids)
+        self.assertEqual(set(found), set(self.geo_ids))
+
+    def test_lookups_are_chunked(self):
+        unknown = ["9{:05d}".format(n) for n in range(boundaries.LOOKUP_CHUNK_SIZE + 1)]
+        ## Two chunks of Boundary lookups, two of legacy copies
+        with self.assertNumQueries(4):
+            found = self.cache.get_many("county", self.geo_ids + unknown)
+        self.assertEqual(set(found), set(self.geo_ids))
+
+    def test_second_lookup_uses_memory(self):
+        self.cache.get_many("county", self.geo_ids)
+        with self.assertNumQueries(0):
+            self.cache.get_many("county", self.geo_ids)
+
+    def test_rows_need_no_queries(self):
+        processor = ProcessAcs("county")
+        processor.datafile = DataFile(name="acs", file_type="county")
+        processor.boundaries = self.cache
+        processor.boundary_map = self.cache.get_ids("county", self.geo_ids)
+        with self.assertNumQueries(0):
+            for geo_id in self.geo_ids:
+                self.assertTrue(processor.process_feature(geo_id, {}))
+            self.assertFalse(processor.process_feature("99999", {}))
+
+    def test_stored_rows_are_updated_only_if_changed(self):
+        unchanged = Boundary.objects.get(federal_geo_id=self.geo_ids[0])
+        changed = Boundary.objects.get(federal_geo_id=self.geo_ids[1])
+        ## As if another worker stored these first: the same geometry
+        ## for one, a different one for the other, and a new geo id.
+        self.cache._store("county", {self.geo_ids[0]: square(0),
+                                     self.geo_ids[1]: square(50),
+                                     "99999": square(99)})
+        self.assertEqual(Boundary.objects.get(id=unchanged.id).updated, unchanged.updated)
+        changed_now = Boundary.objects.get(id=changed.id)
+        self.assertTrue(changed_now.geometry.equals(square(50)))
+        self.assertEqual(changed_now.content_hash, changed_now.compute_hash())
+        self.assertNotEqual(changed_now.content_hash, changed.content_hash)
+        self.assertEqual(Boundary.objects.get(federal_geo_id="99999").content_hash,
+                         Boundary(geometry=square(99)).compute_hash())
+
+
+class TestFileBoundaryProvider(TestCase):
+
+    def setUp(self):
+        boundaries._recent_boundaries.clear()
+        self.directory = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.directory, "counties"))
+        ## One file holds the IRE API's payload, the other a bare geometry
+        self.write("00001", {"simple_shape": json.loads(square(1).json)})
+        self.write("00002", json.loads(Polygon(((2, 0), (2, 1), (3, 1),
+                                                 (3, 0), (2, 0))).json))
+        self.provider = boundaries.FileBoundaryProvider(self.directory)
+
+    def tearDown(self):
+        boundaries._recent_boundaries.clear()
+        shutil.rmtree(self.directory)
+
+    def write(self, geo_id, payload):
+        with open(os.path.join(self.directory, "counties", geo_id + ".json"), "w") as f:
+            json.dump(payload, f)
+
+    def test_providers_must_implement_fetch(self):
+        with self.assertRaises(TypeError):
+            boundaries.BoundaryProvider()
+
+    def test_fetch(self):
+        self.assertTrue(self.provider.fetch("counties", "00001").equals(square(1)))
+        geometry = self.provider.fetch("counties", "00002")
+        self.assertEqual(geometry.geom_type, "MultiPolygon")
+        self.assertTrue(geometry.equals(square(2)))
+        self.assertIsNone(self.provider.fetch("counties", "00003"))
+
+    def test_fetched_boundaries_are_stored(self):
+        cache = boundaries.BoundaryCache(provider=self.provider)
+        found = cache.get_many("counties", ["00001", "00002", "00003"])
+        self.assertEqual(set(found), set(["00001", "00002"]))
+        self.assertEqual(cache.fetched, 3)
+        self.assertEqual(Boundary.objects.filter(geography_type="counties").count(), 2)
+
+        ## A new worker finds them in the table.
+        boundaries._recent_boundaries.clear()
+        cache = boundaries.BoundaryCache(provider=self.provider)
+        self.assertEqual(set(cache.get_many("counties", ["00001", "00002"])),
+                         set(["00001", "00002"]))
+        self.assertEqual(cache.fetched, 0)
+
+    def test_provider_setting(self):
+        with self.settings(
+                MAPFILES_BOUNDARY_PROVIDER="djangomapfiles.file_processors.boundaries.FileBoundaryProvider",
+                MAPFILES_BOUNDARY_PROVIDER_OPTIONS={"directory": self.directory}):
+            provider = boundaries.get_boundary_provider()
+        self.assertIsInstance(provider, boundaries.FileBoundaryProvider)
+        self.assertEqual(provider.directory, self.directory)
+
+
+class CensusHandler(BaseHTTPRequestHandler):
+    """Stands in for the IRE API: /<geography type>/<geoid>"""
+
+    ## geoid -> (status, body)
+    responses = {
+        "00001": (200, json.dumps({"simple_shape": json.loads(square(1).json)})),
+        "00002": (200, "<html>not json</html>"),
+        "00003": (200, json.dumps({"name": "no shape"})),
+        "00004": (404, ""),
+        "00005": (500, ""),
+    }
+
+    def do_GET(self):
+        status, body = self.responses.get(self.path.rsplit("/", 1)[-1], (404, ""))
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body.encode("utf-8"))
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class TestIreCensusProvider(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestIreCensusProvider, cls).setUpClass()
+        cls.server = ThreadingServer(("127.0.0.1", 0), CensusHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super(TestIreCensusProvider, cls).tearDownClass()
+
+    def setUp(self):
+        self.provider = boundaries.IreCensusProvider(
+            url="http://127.0.0.1:{0}/{{0}}/{{1}}".format(self.server.server_port),
+            timeout=5, workers=4, retries=0, backoff=0)
+
+    def test_fetch(self):
+        self.assertTrue(self.provider.fetch("counties", "00001").equals(square(1)))
+        self.assertEqual(self.provider.failures, 0)
+
+    def test_malformed_responses_are_failures(self):
+        self.assertIsNone(self.provider.fetch("counties", "00002"))
+        self.assertIsNone(self.provider.fetch("counties", "00003"))
+        self.assertEqual(self.provider.failures, 2)
+
+    def test_missing_boundaries_are_not_failures(self):
+        self.assertIsNone(self.provider.fetch("counties", "00004"))
+        self.assertEqual(self.provider.failures, 0)
+
+    def test_fetch_many(self):
+        geo_ids = ["00001", "00002", "00003", "00004", "00005"] * 4
+        found = self.provider.fetch_many("counties", geo_ids)
+        self.assertEqual(list(found), ["00001"])
+        self.assertTrue(found["00001"].equals(square(1)))
+        ## Malformed and server errors, four times each
+        self.assertEqual(self.provider.failures, 12)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_chunked_upload
+------------
+
+Tests for chunked uploads: chunks are appended in order, bad ones are
+thrown away, and two requests for the same chunk can't both write it.
+"""
+
+import hashlib
+import io
+import os
+import threading
+import time
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+
+from djangomapfiles import chunked_upload
+from djangomapfiles.chunked_upload import ChunkedUploadError
+from djangomapfiles.models import ChunkedUpload
+
+from .utils import requires_postgis
+
+DATA = b"0123456789" * 10
+
+
+def md5(data):
+    return hashlib.md5(data).hexdigest()
+
+def new_upload(data=DATA):
+    return chunked_upload.start_upload(ChunkedUpload(
+        name="test", file_type="shapefile_zip", filename="test.zip",
+        total_size=len(data)))
+
+def send(upload, offset, data, checksum=None):
+    return chunked_upload.write_chunk(upload, io.BytesIO(data), offset, len(data),
+                                      checksum or md5(data))
+
+def part_contents(upload):
+    with open(upload.part_path, 'rb') as part:
+        return part.read()
+
+
+class TestChunkedUpload(TestCase):
+
+    def test_chunks_are_appended_in_order(self):
+        upload = new_upload()
+        send(upload, 0, DATA[:40])
+        send(upload, 40, DATA[40:])
+        self.assertEqual(upload.received, len(DATA))
+        self.assertEqual(part_contents(upload), DATA)
+
+    def test_chunk_at_wrong_offset_is_refused(self):
+        upload = new_upload()
+        send(upload, 0, DATA[:40])
+        with self.assertRaises(ChunkedUploadError):
+            send(upload, 50, DATA[50:])
+        self.assertEqual(ChunkedUpload.objects.get(id=upload.id).received, 40)
+
+    def test_bad_checksum_is_thrown_away(self):
+        upload = new_upload()
+        send(upload, 0, DATA[:40])
+        with self.assertRaises(ChunkedUploadError):
+            send(upload, 40, DATA[40:], checksum=md5(b"other"))
+        self.assertEqual(part_contents(upload), DATA[:40])
+        self.assertEqual(ChunkedUpload.objects.get(id=upload.id).received, 40)
+
+    def test_stale_upload_is_checked_against_the_database(self):
+        upload = new_upload()
+        stale = ChunkedUpload.objects.get(id=upload.id)
+        send(upload, 0, DATA[:40])
+        with self.assertRaises(ChunkedUploadError):
+            send(stale, 0, DATA[:40])
+        self.assertEqual(part_contents(upload), DATA[:40])
+
+    def test_upload_is_finished_once(self):
+        upload = new_upload()
+        send(upload, 0, DATA)
+        stale = ChunkedUpload.objects.get(id=upload.id)
+        datafile, created = chunked_upload.finish_upload(upload)
+        self.assertTrue(created)
+        self.assertFalse(os.path.exists(upload.part_path))
+        again, created = chunked_upload.finish_upload(stale)
+        self.assertFalse(created)
+        self.assertEqual(again.id, datafile.id)
+        datafile.stored_file.delete(save=False)
+
+
+class SlowStream(object):
+    """A request body that stalls on its first read until released."""
+
+    def __init__(self, data):
+        self.stream = io.BytesIO(data)
+        self.reading = threading.Event()
+        self.release = threading.Event()
+
+    def read(self, size):
+        self.reading.set()
+        self.release.wait(5)
+        return self.stream.read(size)
+
+
+@requires_postgis
+class TestConcurrentChunks(TransactionTestCase):
+
+    def test_racing_retry_waits_and_is_refused(self):
+        upload = new_upload()
+        slow = SlowStream(DATA[:40])
+        errors = []
+
+        def write(stream):
+            try:
+                chunked_upload.write_chunk(ChunkedUpload.objects.get(id=upload.id),
+                                           stream, 0, 40, md5(DATA[:40]))
+            except ChunkedUploadError as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        first = threading.Thread(target=write, args=(slow,))
+        first.start()
+        slow.reading.wait(5)
+        retry = threading.Thread(target=write, args=(io.BytesIO(DATA[:40]),))
+        retry.start()
+        ## Give the retry time to reach the lock before the first finishes.
+        time.sleep(0.2)
+        slow.release.set()
+        first.join()
+        retry.join()
+
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(part_contents(upload), DATA[:40])
+        self.assertEqual(ChunkedUpload.objects.get(id=upload.id).received, 40)
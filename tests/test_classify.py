@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_classify
+------------
+
+Tests for splitting a numeric field's values into choropleth classes.
+"""
+
+import itertools
+import unittest
+
+import numpy as np
+from django.contrib.gis.geos import Point
+from django.core.cache import cache
+from django.test import TestCase
+
+from djangomapfiles import classify
+from djangomapfiles.models import DataField, DataFile, Feature
+
+
+def total_deviation(values, breaks):
+    """Sum over classes of squared deviations from the class mean."""
+    indexes = np.searchsorted(breaks[1:-1], values, side='right')
+    return sum(((values[indexes == c] - values[indexes == c].mean()) ** 2).sum()
+               for c in set(indexes.tolist()))
+
+
+class TestBreaks(unittest.TestCase):
+
+    def test_jenks_finds_clusters(self):
+        values = np.array([1, 2, 3, 10, 11, 12, 20, 21, 22], dtype=float)
+        self.assertEqual(classify.jenks_breaks(values, 3).tolist(), [1, 10, 20, 22])
+
+    def test_jenks_is_optimal(self):
+        values = np.sort(np.random.RandomState(3).uniform(0, 100, 12))
+        best = min(total_deviation(values, np.array([values[0], values[a], values[b], values[-1]]))
+                   for a, b in itertools.combinations(range(1, len(values)), 2))
+        breaks = classify.jenks_breaks(values, 3)
+        self.assertAlmostEqual(total_deviation(values, breaks), best)
+
+    def test_jenks_samples_big_columns(self):
+        values = np.random.RandomState(5).lognormal(size=20000)
+        breaks = classify.jenks_breaks(values, 5, sample_size=200)
+        self.assertEqual(len(breaks), 6)
+        self.assertEqual(breaks[0], values.min())
+        self.assertEqual(breaks[-1], values.max())
+        self.assertTrue((np.diff(breaks) >= 0).all())
+
+    def test_jenks_with_fewer_values_than_classes(self):
+        breaks = classify.jenks_breaks(np.array([4.0, 7.0]), 5)
+        self.assertEqual(breaks.tolist(), [4.0, 7.0, 7.0])
+
+    def test_equal_interval(self):
+        breaks, indexes = classify.classify_values(np.array([0.0, 2.0, 5.0, 10.0]),
+                                                   "equal_interval", 2)
+        self.assertEqual(breaks.tolist(), [0, 5, 10])
+        ## A value on an inner break goes in the class above it
+        self.assertEqual(indexes.tolist(), [0, 0, 1, 1])
+
+    def test_quantile(self):
+        values = np.arange(1, 101, dtype=float)
+        breaks, indexes = classify.classify_values(values, "quantile", 4)
+        self.assertEqual(np.bincount(indexes).tolist(), [25, 25, 25, 25])
+
+
+class TestClassify(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.datafile = DataFile.objects.create(name="towns", file_type="geojson",
+                                                stored_file="towns.geojson")
+        DataField.objects.create(datafile=self.datafile, field_name="POP",
+                                 attr_type="int", position=0)
+        DataField.objects.create(datafile=self.datafile, field_name="NAME",
+                                 attr_type="str", position=1)
+        self.features = [
+            Feature.objects.create(datafile=self.datafile,
+                                   geom_point=Point(n, n, srid=4326),
+                                   properties={"POP": pop, "NAME": str(n)})
+            for n, pop in enumerate([10, None, 30, 40])]
+
+    def test_features_without_a_number_are_left_out(self):
+        result = classify.classify(self.datafile, "POP", "equal_interval", 3)
+        self.assertEqual(result["ids"], [self.features[n].id for n in (0, 2, 3)])
+        self.assertEqual(result["breaks"], [10, 20, 30, 40])
+        self.assertEqual(result["classes"], [0, 2, 2])
+
+    def test_non_numeric_field(self):
+        with self.assertRaises(classify.ClassificationError):
+            classify.classify(self.datafile, "NAME")
+        with self.assertRaises(classify.ClassificationError):
+            classify.classify(self.datafile, "MISSING")
+
+    def test_unknown_method(self):
+        with self.assertRaises(classify.ClassificationError):
+            classify.classify(self.datafile, "POP", "random")
+
+    def test_results_are_cached_per_version(self):
+        first = classify.classify(self.datafile, "POP")
+        Feature.objects.filter(id=self.features[1].id).update(properties={"POP": 50})
+        self.assertEqual(classify.classify(self.datafile, "POP"), first)
+        self.datafile.version += 1
+        self.assertEqual(len(classify.classify(self.datafile, "POP")["ids"]), 4)
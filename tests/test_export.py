@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_export
+------------
+
+Tests for writing a DataFile's features out as GeoJSON.
+"""
+
+import json
+import math
+import unittest
+
+from django.contrib.gis.geos import LineString, MultiLineString, MultiPolygon, Point
+from django.test import TestCase
+
+from djangomapfiles import export
+from djangomapfiles.file_processors.simplify import tolerance_for_zoom
+from djangomapfiles.models import Boundary, DataFile, Feature, SimplifiedBoundary
+
+from .utils import requires_postgis
+
+
+def wave(points=500):
+    return MultiLineString(LineString([(n * 0.01, 0.02 * math.sin(n * 0.1))
+                                       for n in range(points)]), srid=4326)
+
+def circle(x=0, y=0, radius=1):
+    return MultiPolygon(Point(x, y).buffer(radius, quadsegs=64), srid=4326)
+
+def collection(features, **kwargs):
+    return json.loads("".join(export.feature_collection(features, **kwargs)))
+
+
+class TestBboxPolygon(unittest.TestCase):
+
+    def test_bbox(self):
+        self.assertEqual(export.bbox_polygon("0,1,2,3").extent, (0, 1, 2, 3))
+
+    def test_bad_bbox(self):
+        for bbox in ("0,1,2", "0,1,2,x"):
+            with self.assertRaises(ValueError):
+                export.bbox_polygon(bbox)
+
+
+class TestFeatureCollection(TestCase):
+
+    def setUp(self):
+        self.datafile = DataFile.objects.create(name="points", file_type="geojson",
+                                                stored_file="points.geojson")
+        self.features = [Feature.objects.create(datafile=self.datafile,
+                                                geom_point=Point(n, n, srid=4326),
+                                                properties={"n": n, "name": str(n)})
+                         for n in range(5)]
+        self.queryset = Feature.objects.filter(datafile=self.datafile)
+
+    def test_chunks_are_joined_in_id_order(self):
+        result = collection(self.queryset, chunk_size=2, render=export.render_geos)
+        self.assertEqual([feat["id"] for feat in result["features"]],
+                         [feat.id for feat in self.features])
+        self.assertNotIn("next_cursor", result)
+
+    def test_limit_gives_a_cursor(self):
+        result = collection(self.queryset, limit=3, chunk_size=2, render=export.render_geos)
+        self.assertEqual(len(result["features"]), 3)
+        self.assertEqual(result["next_cursor"], self.features[2].id)
+        rest = collection(self.queryset.filter(id__gt=result["next_cursor"]), limit=3,
+                          render=export.render_geos)
+        self.assertEqual(len(rest["features"]), 2)
+        self.assertIsNone(rest["next_cursor"])
+
+    def test_fields(self):
+        result = collection(self.queryset, fields=["name"], render=export.render_geos)
+        self.assertEqual(result["features"][1]["properties"], {"name": "1"})
+
+
+@requires_postgis
+class TestRenderPostgis(TestCase):
+
+    def setUp(self):
+        self.datafile = DataFile.objects.create(name="mixed", file_type="geojson",
+                                                stored_file="mixed.geojson")
+        self.point = Feature.objects.create(datafile=self.datafile,
+                                            geom_point=Point(1.23456789, 9.87654321,
+                                                             srid=4326),
+                                            properties={"n": 1, "name": "a"})
+        self.line = Feature.objects.create(datafile=self.datafile,
+                                           geom_multilinestring=wave(),
+                                           properties={"n": 2, "name": "b"})
+        self.queryset = Feature.objects.filter(datafile=self.datafile).order_by('id')
+
+    def geometries(self, queryset, **kwargs):
+        return [json.loads(text)["geometry"]
+                for feat_id, text in export.render_postgis(queryset, 10, **kwargs)]
+
+    def test_same_features_as_geos(self):
+        postgis = collection(self.queryset, render=export.render_postgis)
+        geos = collection(self.queryset, render=export.render_geos)
+        self.assertEqual([(feat["id"], feat["properties"]) for feat in postgis["features"]],
+                         [(feat["id"], feat["properties"]) for feat in geos["features"]])
+
+    def test_precision_rounds_coordinates(self):
+        point = self.geometries(self.queryset, precision=2)[0]
+        self.assertEqual(point["coordinates"], [1.23, 9.88])
+        point = self.geometries(self.queryset)[0]
+        self.assertEqual(point["coordinates"], [1.23456789, 9.87654321])
+
+    def test_simplify_drops_vertices(self):
+        full = self.geometries(self.queryset)[1]["coordinates"][0]
+        simplified = self.geometries(self.queryset, simplify=0.01)[1]["coordinates"][0]
+        self.assertEqual(len(full), 500)
+        self.assertLess(len(simplified), len(full) / 4)
+        self.assertEqual(simplified[0], full[0])
+        self.assertEqual(simplified[-1], full[-1])
+
+    def test_fields(self):
+        rendered = export.render_postgis(self.queryset, 10, fields=["name", "missing"])
+        self.assertEqual(json.loads(rendered[0][1])["properties"],
+                         {"name": "a", "missing": None})
+
+    def test_census_boundaries_start_from_their_band(self):
+        census = DataFile.objects.create(name="counties", file_type="counties",
+                                         stored_file="counties.csv")
+        boundary = Boundary.objects.create(geography_type="counties",
+                                           federal_geo_id="1", geometry=circle())
+        Feature.objects.create(datafile=census, boundary=boundary)
+        diamond = MultiPolygon(Point(0, 0).buffer(1, quadsegs=1), srid=4326)
+        simplified = SimplifiedBoundary.objects.create(
+            boundary=boundary, zoom=4, content_hash=boundary.content_hash,
+            geometry=diamond)
+        features = Feature.objects.filter(datafile=census)
+        tolerance = tolerance_for_zoom(4)
+        with self.settings(MAPFILES_SIMPLIFY_ZOOMS=(4,)):
+            ring = self.geometries(features, simplify=tolerance)[0]["coordinates"][0][0]
+            self.assertEqual(len(ring), 5)
+            ## A band made from an older boundary isn't used
+            simplified.content_hash = "stale"
+            simplified.save()
+            ring = self.geometries(features, simplify=tolerance)[0]["coordinates"][0][0]
+            self.assertGreater(len(ring), 5)
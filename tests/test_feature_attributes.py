@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_feature_attributes
+------------
+
+Tests for fetching many features' field values at once.
+"""
+
+import json
+
+from django.contrib.gis.geos import Point
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from djangomapfiles import views
+from djangomapfiles.models import DataField, DataFile, Feature
+
+
+class TestFeatureAttributes(TestCase):
+
+    def setUp(self):
+        self.datafile = DataFile.objects.create(name="towns", file_type="geojson",
+                                                stored_file="towns.geojson")
+        ## Created out of order: columns follow the fields' positions.
+        DataField.objects.create(datafile=self.datafile, field_name="POP",
+                                 attr_type="int", position=1)
+        DataField.objects.create(datafile=self.datafile, field_name="NAME",
+                                 attr_type="str", position=0)
+        self.features = [
+            Feature.objects.create(datafile=self.datafile,
+                                   geom_point=Point(n, n, srid=4326),
+                                   properties={"NAME": name, "POP": pop})
+            for n, (name, pop) in enumerate([("A", 120), ("B", None), ("C", 85)])]
+        self.url = reverse('feature_attributes', kwargs={'file_id': self.datafile.id})
+
+    def get(self, ids):
+        return self.client.get(self.url, {'ids': ",".join(str(feat_id) for feat_id in ids)})
+
+    def test_values_are_columns_in_field_order(self):
+        ids = [feat.id for feat in self.features]
+        response = self.get(reversed(ids))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content.decode('utf-8')),
+                         {"fields": ["NAME", "POP"],
+                          "ids": ids,
+                          "values": [["A", "B", "C"], [120, None, 85]]})
+
+    def test_other_datafiles_features_are_left_out(self):
+        other = DataFile.objects.create(name="other", file_type="geojson",
+                                        stored_file="other.geojson")
+        stranger = Feature.objects.create(datafile=other, geom_point=Point(0, 0, srid=4326),
+                                          properties={"NAME": "X", "POP": 1})
+        response = self.get([self.features[0].id, stranger.id, 999999])
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data["ids"], [self.features[0].id])
+        self.assertEqual(data["values"], [["A"], [120]])
+
+    def test_no_ids(self):
+        response = self.client.get(self.url)
+        self.assertEqual(json.loads(response.content.decode('utf-8')),
+                         {"fields": ["NAME", "POP"], "ids": [], "values": [[], []]})
+
+    def test_too_many_ids(self):
+        ids = range(1, views.MAX_ATTRIBUTE_IDS + 1)
+        self.assertEqual(self.get(ids).status_code, 200)
+        ids = range(1, views.MAX_ATTRIBUTE_IDS + 2)
+        self.assertEqual(self.get(ids).status_code, 400)
+
+    def test_bad_ids(self):
+        for ids in ("1,x", "1.5", "a"):
+            response = self.client.get(self.url, {'ids': ids})
+            self.assertEqual(response.status_code, 400)
+
+    def test_unknown_datafile(self):
+        url = reverse('feature_attributes', kwargs={'file_id': self.datafile.id + 1})
+        self.assertEqual(self.client.get(url).status_code, 404)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_field_types
+------------
+
+Tests for typing field values, one csv column at a time, and for
+filtering and summing them in the database.
+"""
+
+import datetime
+import os
+import shutil
+import tempfile
+
+from django.contrib.gis.geos import Point
+from django.test import TestCase
+
+from djangomapfiles.models import DataFile, Feature
+from djangomapfiles.file_processors import field_types
+from djangomapfiles.file_processors.acs_processor import ProcessAcs
+from djangomapfiles.file_processors.boundaries import NullBoundaryProvider
+
+from .utils import requires_postgis
+
+
+class TestInferType(TestCase):
+
+    def test_numbers(self):
+        self.assertEqual(field_types.infer_type("12"), field_types.INTEGER)
+        self.assertEqual(field_types.infer_type(" 1.5 "), field_types.REAL)
+        self.assertEqual(field_types.infer_type("0.5"), field_types.REAL)
+
+    def test_leading_zeros_are_strings(self):
+        self.assertEqual(field_types.infer_type("06073"), field_types.STRING)
+
+    def test_non_finite_numbers_are_strings(self):
+        for text in ("nan", "NaN", "inf", "-Infinity"):
+            self.assertEqual(field_types.infer_type(text), field_types.STRING)
+
+    def test_empty(self):
+        self.assertIsNone(field_types.infer_type("  "))
+
+    def test_convert(self):
+        self.assertEqual(field_types.convert("5", field_types.REAL), 5.0)
+        self.assertEqual(field_types.convert("5", field_types.STRING), "5")
+        self.assertIsNone(field_types.convert("", field_types.INTEGER))
+
+    def test_json_value_drops_non_finite_floats(self):
+        self.assertIsNone(field_types.json_value(float("nan")))
+        self.assertIsNone(field_types.json_value(float("inf")))
+        self.assertEqual(field_types.json_value(1.5), 1.5)
+
+
+class TestAcsColumnTypes(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "acs.csv")
+        with open(self.path, "w") as f:
+            f.write("GEO.id,GEO.id2,HC01\n")
+            f.write("Id,Id2,ZIP,Count,Share\n")
+            f.write("1400000US1,06001,90210,12,3\n")
+            f.write("1400000US2,06002,02139,(X),4.5\n")
+            f.write("1400000US3,06003,10001,7,nan\n")
+        self.processor = ProcessAcs("tracts")
+        self.processor.boundaries.provider = NullBoundaryProvider()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_types_come_from_the_whole_column(self):
+        fieldnames, column_types = self.processor.column_types(self.path)
+        self.assertEqual(fieldnames, ["Id", "Id2", "ZIP", "Count", "Share"])
+        self.assertEqual(column_types["ZIP"], field_types.STRING)
+        self.assertEqual(column_types["Count"], field_types.INTEGER)
+        self.assertEqual(column_types["Share"], field_types.STRING)
+
+    def test_values_take_their_columns_type(self):
+        _, column_types = self.processor.column_types(self.path)
+        column_types["Share"] = field_types.REAL
+        row = {"Id": "1400000US1", "Id2": "06001", "ZIP": "90210",
+               "Count": "(X)", "Share": "3"}
+        properties = self.processor.process_values(row, column_types)
+        self.assertEqual(properties["ZIP"], "90210")
+        self.assertIsNone(properties["Count"])
+        self.assertEqual(properties["Share"], 3.0)
+
+
+@requires_postgis
+class TestPropertyQueries(TestCase):
+
+    def setUp(self):
+        datafile = DataFile.objects.create(name="values", file_type="geojson",
+                                           stored_file="values.geojson")
+        values = [5, 15, 25.5, "thirty", None, "2019-06-01", "2021-01-02T10:00:00"]
+        for value in values:
+            Feature.objects.create(datafile=datafile,
+                                   geom_point=Point(0, 0, srid=4326),
+                                   properties={"value": value})
+        self.features = Feature.objects.filter(datafile=datafile)
+
+    def values(self, features):
+        return sorted(str(feat.properties["value"]) for feat in features)
+
+    def test_range_skips_other_types(self):
+        self.assertEqual(self.values(self.features.property_range("value", 10, 30)),
+                         ["15", "25.5"])
+        self.assertEqual(len(self.features.property_range("value")), 3)
+
+    def test_date_range_skips_other_types(self):
+        found = self.features.property_range("value", minimum=datetime.date(2020, 1, 1))
+        self.assertEqual(self.values(found), ["2021-01-02T10:00:00"])
+
+    def test_sum(self):
+        self.assertEqual(self.features.property_sum("value"), 45.5)
+
+    def test_values(self):
+        self.assertEqual([value for _, value in self.features.property_values("value")],
+                         [5.0, 15.0, 25.5])
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_geojson
+------------
+
+Tests for reading GeoJSON FeatureCollections a feature at a time.
+"""
+
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from django.test import TestCase
+
+from djangomapfiles.models import DataFile, Feature, IngestCheckpoint
+from djangomapfiles.file_processors.exceptions import GeoJsonException
+from djangomapfiles.file_processors.geojson_processor import (
+    FeatureCollectionReader, ProcessGeoJson, two_dimensional)
+
+from .utils import make_datafile, requires_postgis
+
+
+def point_feature(n, *coordinates):
+    return {"type": "Feature",
+            "geometry": {"type": "Point", "coordinates": list(coordinates or (n, n))},
+            "properties": {"n": n}}
+
+def collection(features):
+    return json.dumps({"type": "FeatureCollection", "features": features})
+
+
+class CountingStream(io.StringIO):
+    """Remembers how many characters have been read from it."""
+
+    def __init__(self, text):
+        super(CountingStream, self).__init__(text)
+        self.consumed = 0
+
+    def read(self, size=-1):
+        block = super(CountingStream, self).read(size)
+        self.consumed += len(block)
+        return block
+
+
+class TestFeatureCollectionReader(unittest.TestCase):
+
+    def test_features_are_read_across_blocks(self):
+        features = [point_feature(n) for n in range(50)]
+        reader = FeatureCollectionReader(io.StringIO(collection(features)), block_size=16)
+        self.assertEqual(list(reader.features()), features)
+
+    def test_oversized_feature_is_refused(self):
+        big = point_feature(0)
+        big["properties"]["text"] = "x" * 5000
+        stream = CountingStream(collection([big] + [point_feature(n) for n in range(1000)]))
+        reader = FeatureCollectionReader(stream, block_size=64, max_size=1000)
+        with self.assertRaises(GeoJsonException):
+            list(reader.features())
+        self.assertLess(stream.consumed, 3000)
+
+    def test_malformed_json_fails_without_reading_on(self):
+        text = '{"type": "FeatureCollection", "features": [{"type" "Feature"}, '
+        text += ", ".join(json.dumps(point_feature(n)) for n in range(1000)) + "]}"
+        stream = CountingStream(text)
+        reader = FeatureCollectionReader(stream, block_size=128)
+        with self.assertRaises(GeoJsonException):
+            list(reader.features())
+        self.assertLess(stream.consumed, 1000)
+
+    def test_nan_and_infinity_become_null(self):
+        text = ('{"type": "FeatureCollection", "features": [{"type": "Feature", '
+                '"geometry": null, "properties": {"a": NaN, "b": -Infinity, "c": 1}}]}')
+        reader = FeatureCollectionReader(io.StringIO(text))
+        self.assertEqual(list(reader.features())[0]["properties"],
+                         {"a": None, "b": None, "c": 1})
+
+    def test_truncated_file_fails(self):
+        text = collection([point_feature(n) for n in range(3)])[:-20]
+        reader = FeatureCollectionReader(io.StringIO(text), block_size=16)
+        with self.assertRaises(GeoJsonException):
+            list(reader.features())
+
+
+class TestTwoDimensional(unittest.TestCase):
+
+    def test_altitudes_are_dropped(self):
+        self.assertEqual(two_dimensional({"type": "Point", "coordinates": [1, 2, 3]}),
+                         {"type": "Point", "coordinates": [1, 2]})
+        ring = [[0, 0, 5], [0, 1, 5], [1, 1, 5], [0, 0, 5]]
+        self.assertEqual(two_dimensional({"type": "Polygon", "coordinates": [ring]}),
+                         {"type": "Polygon",
+                          "coordinates": [[[0, 0], [0, 1], [1, 1], [0, 0]]]})
+
+    def test_collections_are_flattened_member_by_member(self):
+        geometry = {"type": "GeometryCollection", "geometries": [
+            {"type": "Point", "coordinates": [1, 2, 3]},
+            {"type": "LineString", "coordinates": [[0, 0, 1], [1, 1, 1]]}]}
+        self.assertEqual(two_dimensional(geometry)["geometries"],
+                         [{"type": "Point", "coordinates": [1, 2]},
+                          {"type": "LineString", "coordinates": [[0, 0], [1, 1]]}])
+
+
+@requires_postgis
+class TestProcessGeoJson(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_3d_features_are_loaded_in_2d(self):
+        path = os.path.join(self.directory, "points.geojson")
+        with open(path, "w") as f:
+            f.write(collection([point_feature(n, n, n + 1, 100) for n in range(3)]))
+        datafile = make_datafile(path, "geojson")
+        processor = ProcessGeoJson("geojson")
+        processor.parse_geojson(processor.get_path(datafile.id))
+        points = [feat.geom_point for feat in
+                  Feature.objects.filter(datafile=datafile).order_by('id')]
+        self.assertEqual([(point.x, point.y) for point in points],
+                         [(0, 1), (1, 2), (2, 3)])
+        self.assertFalse(any(point.hasz for point in points))
+
+    def load_sequence(self, lines):
+        path = os.path.join(self.directory, "points.geojsonl")
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        datafile = make_datafile(path, "geojsonseq")
+        processor = ProcessGeoJson("geojsonseq")
+        processor.parse_geojson(processor.get_path(datafile.id))
+        return datafile
+
+    def test_malformed_sequence_line_is_reported(self):
+        lines = [json.dumps(point_feature(0)), '{"type": "Feature", ']
+        with self.assertRaises(GeoJsonException):
+            self.load_sequence(lines)
+        datafile = DataFile.objects.get(file_type="geojsonseq")
+        self.assertIn("line 2", datafile.process_note)
+
+    def test_non_finite_sequence_values_are_stored_as_null(self):
+        datafile = self.load_sequence([
+            '{"type": "Feature", "geometry": {"type": "Point", "coordinates": [1, 2]}, '
+            '"properties": {"n": NaN, "m": Infinity, "k": 3}}'])
+        feat = Feature.objects.get(datafile=datafile)
+        self.assertEqual(feat.properties, {"n": None, "m": None, "k": 3})
+
+    def test_resumed_load_keeps_earlier_geometry_types(self):
+        line = {"type": "Feature", "properties": {},
+                "geometry": {"type": "LineString", "coordinates": [[0, 0], [1, 1]]}}
+        path = os.path.join(self.directory, "mixed.geojson")
+        with open(path, "w") as f:
+            f.write(collection([point_feature(0), line]))
+        datafile = make_datafile(path, "geojson")
+        ## As if an earlier run had committed the first feature
+        IngestCheckpoint.objects.create(datafile=datafile, start=0, position=1)
+        processor = ProcessGeoJson("geojson")
+        processor.parse_geojson(processor.get_path(datafile.id))
+        self.assertEqual(Feature.objects.filter(datafile=datafile).count(), 1)
+        self.assertEqual(DataFile.objects.get(id=datafile.id).geom_type,
+                         "GeometryCollection")
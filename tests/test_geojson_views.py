@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_geojson_views
+------------
+
+Tests for serving GeoJSON downloads from the precompressed artifacts.
+"""
+
+from django.contrib.auth.models import User
+from django.contrib.gis.geos import Point
+from django.core.files.storage import default_storage
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from djangomapfiles import artifacts
+from djangomapfiles.models import DataFile, Feature
+
+
+class TestGeoJsonDownloads(TestCase):
+
+    def setUp(self):
+        self.datafile = DataFile.objects.create(name="points", file_type="geojson",
+                                                stored_file="points.geojson",
+                                                version=1)
+        for x in range(3):
+            Feature.objects.create(datafile=self.datafile,
+                                   geom_point=Point(x, x, srid=4326),
+                                   properties={"n": x})
+        self.paths = artifacts.build_artifacts(self.datafile)
+        self.url = reverse('datafile_geojson', kwargs={'file_id': self.datafile.id})
+
+    def tearDown(self):
+        artifacts.remove_artifacts(self.datafile)
+
+    def test_artifact_is_served(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response['Content-Encoding'], "gzip")
+        self.assertIn("Accept-Encoding", response['Vary'])
+
+    def test_etag_depends_on_encoding_and_query(self):
+        gzipped = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")
+        plain = self.client.get(self.url)
+        limited = self.client.get(self.url, {'limit': 1})
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertIn("Accept-Encoding", plain['Vary'])
+        etags = set([gzipped['ETag'], plain['ETag'], limited['ETag']])
+        self.assertEqual(len(etags), 3)
+
+    def test_not_modified_keeps_vary(self):
+        etag = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")['ETag']
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip",
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertIn("Accept-Encoding", response['Vary'])
+        ## The same ETag doesn't match a different encoding.
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_delete_removes_artifacts(self):
+        User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.login(username="admin", password="password")
+        response = self.client.post(reverse('delete_datafile',
+                                            kwargs={'file_id': self.datafile.id}))
+        self.assertEqual(response.status_code, 302)
+        for path in self.paths:
+            self.assertFalse(default_storage.exists(path))
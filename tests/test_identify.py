@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_identify
+------------
+
+Tests for finding a data file's features at a point, from the database
+and from the in-memory STRtree.
+"""
+
+import time
+import unittest
+
+from django.contrib.gis.geos import MultiPolygon, Point, Polygon
+from django.test import TestCase
+
+from djangomapfiles import identify
+from djangomapfiles.models import DataFile, Feature
+
+
+def square(x, y=0):
+    return MultiPolygon(Polygon(((x, y), (x, y + 1), (x + 1, y + 1),
+                                 (x + 1, y), (x, y))), srid=4326)
+
+
+class IdentifyTestCase(TestCase):
+
+    def setUp(self):
+        identify._trees.clear()
+        self.datafile = DataFile.objects.create(name="squares", file_type="geojson",
+                                                stored_file="squares.geojson")
+        self.squares = [Feature.objects.create(datafile=self.datafile,
+                                               geom_multipolygon=square(x))
+                        for x in range(10)]
+        self.point = Feature.objects.create(datafile=self.datafile,
+                                            geom_point=Point(20, 0.5, srid=4326))
+
+    def tearDown(self):
+        identify._trees.clear()
+
+
+class TestFeaturesAt(IdentifyTestCase):
+
+    def test_polygon(self):
+        self.assertEqual(identify.feature_ids_at(self.datafile, 3.5, 0.5),
+                         [self.squares[3].id])
+
+    def test_point_within_tolerance(self):
+        self.assertEqual(identify.feature_ids_at(self.datafile, 20.00005, 0.5),
+                         [self.point.id])
+        self.assertEqual(identify.feature_ids_at(self.datafile, 20.01, 0.5), [])
+
+    def test_other_datafiles_are_ignored(self):
+        other = DataFile.objects.create(name="other", file_type="geojson",
+                                        stored_file="other.geojson")
+        Feature.objects.create(datafile=other, geom_multipolygon=square(3))
+        self.assertEqual(identify.feature_ids_at(self.datafile, 3.5, 0.5),
+                         [self.squares[3].id])
+
+
+@unittest.skipIf(identify.shapely is None, "needs Shapely 2")
+class TestFeatureTree(IdentifyTestCase):
+
+    def test_matches_the_database(self):
+        tree = identify.FeatureTree(self.datafile)
+        for lon, lat in [(3.5, 0.5), (1.0, 0.5), (20.00005, 0.5), (50, 50)]:
+            self.assertEqual(tree.ids_at(lon, lat),
+                             identify.feature_ids_at(self.datafile, lon, lat))
+
+    def test_tree_is_reused(self):
+        tree = identify.tree_for(self.datafile)
+        with self.assertNumQueries(0):
+            self.assertIs(identify.tree_for(self.datafile), tree)
+
+    def test_new_version_rebuilds_tree(self):
+        tree = identify.tree_for(self.datafile)
+        added = Feature.objects.create(datafile=self.datafile,
+                                       geom_multipolygon=square(0, 5))
+        self.assertEqual(identify.tree_for(self.datafile).ids_at(0.5, 5.5), [])
+        self.datafile.version += 1
+        rebuilt = identify.tree_for(self.datafile)
+        self.assertIsNot(rebuilt, tree)
+        self.assertEqual(rebuilt.ids_at(0.5, 5.5), [added.id])
+
+    def test_least_recently_used_trees_are_dropped(self):
+        others = [DataFile.objects.create(name="other", file_type="geojson",
+                                          stored_file="other.geojson")
+                  for n in range(2)]
+        with self.settings(MAPFILES_IDENTIFY_STRTREE_CACHE_SIZE=2):
+            identify.tree_for(self.datafile)
+            identify.tree_for(others[0])
+            identify.tree_for(self.datafile)
+            identify.tree_for(others[1])
+        self.assertEqual(list(identify._trees), [self.datafile.id, others[1].id])
+
+    def test_big_files_use_the_database(self):
+        with self.settings(MAPFILES_IDENTIFY_STRTREE_MAX_FEATURES=5):
+            self.assertIsNone(identify.tree_for(self.datafile))
+
+    def test_lookups_take_under_a_millisecond(self):
+        Feature.objects.bulk_create([
+            Feature(datafile=self.datafile, geom_multipolygon=square(x, y))
+            for x in range(50) for y in range(2, 42)])
+        tree = identify.FeatureTree(self.datafile)
+        timings = []
+        for n in range(1000):
+            began = time.time()
+            tree.ids_at((n % 50) + 0.5, (n % 40) + 2.5)
+            timings.append(time.time() - began)
+        timings.sort()
+        self.assertLess(timings[len(timings) // 2], 0.001)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_kml
+------------
+
+Tests for reading KML placemarks, including ones with missing pieces.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from xml.etree import ElementTree
+
+from django.test import TestCase
+
+from djangomapfiles.models import DataFile, Feature, IngestCheckpoint
+from djangomapfiles.file_processors.exceptions import KmlException
+from djangomapfiles.file_processors.kml_processor import ProcessKml
+
+from .utils import make_datafile, requires_postgis
+
+KML = """<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2"><Document>{}</Document></kml>"""
+
+
+def placemark(text):
+    return ElementTree.fromstring(
+        '<Placemark xmlns="http://www.opengis.net/kml/2.2">{}</Placemark>'.format(text))
+
+
+class TestPlacemarks(unittest.TestCase):
+
+    def setUp(self):
+        self.processor = ProcessKml("kml")
+
+    def test_point(self):
+        field, geometry = self.processor.feature_geometry(placemark(
+            "<Point><coordinates>1,2,30</coordinates></Point>"))
+        self.assertEqual(field, "geom_point")
+        self.assertEqual(geometry.coords, (1, 2))
+
+    def test_missing_coordinates_are_reported(self):
+        for geometry in ("<Point/>",
+                         "<Point><coordinates> </coordinates></Point>",
+                         "<LineString><coordinates>1,2</coordinates></LineString>",
+                         "<Polygon><innerBoundaryIs/></Polygon>",
+                         "<MultiGeometry><Point/></MultiGeometry>"):
+            with self.assertRaises(KmlException):
+                self.processor.feature_geometry(placemark(geometry))
+
+    def test_malformed_coordinates_are_reported(self):
+        with self.assertRaises(KmlException):
+            self.processor.feature_geometry(placemark(
+                "<Point><coordinates>1;2</coordinates></Point>"))
+
+    def test_empty_parts_of_a_multigeometry_are_dropped(self):
+        field, geometry = self.processor.feature_geometry(placemark(
+            "<MultiGeometry><Point/>"
+            "<Point><coordinates>1,2</coordinates></Point>"
+            "<Point><coordinates>3,4</coordinates></Point></MultiGeometry>"))
+        self.assertEqual(field, "geom_multipoint")
+        self.assertEqual(len(geometry), 2)
+
+    def test_placemark_without_geometry(self):
+        self.assertEqual(self.processor.feature_geometry(placemark("<name>a</name>")),
+                         (None, None))
+
+    def test_data_without_a_name_is_ignored(self):
+        properties = self.processor.placemark_properties(placemark(
+            "<name>a</name><ExtendedData>"
+            "<Data name='pop'><value>12</value></Data>"
+            "<Data><value>lost</value></Data>"
+            "<SchemaData><SimpleData>lost</SimpleData>"
+            "<SimpleData name='kind'>town</SimpleData></SchemaData>"
+            "</ExtendedData>"))
+        self.assertEqual(properties, {"name": "a", "pop": "12", "kind": "town"})
+
+
+@requires_postgis
+class TestProcessKml(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_placemarks_without_coordinates_are_skipped(self):
+        path = os.path.join(self.directory, "places.kml")
+        with open(path, "w") as f:
+            f.write(KML.format(
+                "<Placemark><name>a</name><Point><coordinates>1,2</coordinates></Point></Placemark>"
+                "<Placemark><name>b</name><Point/></Placemark>"
+                "<Placemark><name>c</name><ExtendedData><Data><value>x</value></Data>"
+                "</ExtendedData><Point><coordinates>3,4</coordinates></Point></Placemark>"))
+        datafile = make_datafile(path, "kml")
+        processor = ProcessKml("kml")
+        processor.parse_kml(processor.get_path(datafile.id))
+
+        names = sorted(feat.properties["name"] for feat in
+                       Feature.objects.filter(datafile=datafile))
+        self.assertEqual(names, ["a", "c"])
+        self.assertEqual(list(datafile.fieldnames), ["name"])
+        self.assertIn("Placemarks skipped for lack of coordinates: 1.",
+                      DataFile.objects.get(id=datafile.id).process_note)
+
+    def test_resumed_load_keeps_earlier_geometry_types(self):
+        path = os.path.join(self.directory, "mixed.kml")
+        with open(path, "w") as f:
+            f.write(KML.format(
+                "<Placemark><name>a</name><Point><coordinates>1,2</coordinates></Point></Placemark>"
+                "<Placemark><name>b</name><LineString>"
+                "<coordinates>0,0 1,1</coordinates></LineString></Placemark>"))
+        datafile = make_datafile(path, "kml")
+        ## As if an earlier run had committed the first placemark
+        IngestCheckpoint.objects.create(datafile=datafile, start=0, position=1)
+        processor = ProcessKml("kml")
+        processor.parse_kml(processor.get_path(datafile.id))
+        self.assertEqual(Feature.objects.filter(datafile=datafile).count(), 1)
+        self.assertEqual(DataFile.objects.get(id=datafile.id).geom_type,
+                         "GeometryCollection")
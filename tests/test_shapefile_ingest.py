@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_shapefile_ingest
+------------
+
+Tests that a shapefile loaded in parallel chunks ends up the same as
+one loaded in a single pass, and that interrupted loads resume without
+losing or repeating features.
+"""
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+import mock
+from django.test import TestCase
+
+from djangomapfiles import tasks
+from djangomapfiles.models import DataFile, Feature, IngestCheckpoint, ProcessingStats
+from djangomapfiles.file_processors.exceptions import ProcessingException
+from djangomapfiles.file_processors.feature_writer import FeatureWriter
+from djangomapfiles.file_processors.shapefile_processor import ProcessShapefile, shp_member
+
+from .utils import POINT, make_datafile, requires_postgis
+from .utils import write_shapefile, zip_shapefile
+
+
+def eager_chord(header):
+    """Run a chord's tasks in this process, one after another."""
+    def apply(body):
+        return body([signature() for signature in header])
+    return apply
+
+
+class TestShpMember(unittest.TestCase):
+
+    def archive(self, names):
+        zipf = zipfile.ZipFile(io.BytesIO(), "w")
+        for name in names:
+            zipf.writestr(name, b"")
+        return zipf
+
+    def test_macos_resource_forks_are_passed_over(self):
+        zipf = self.archive(["__MACOSX/._roads.shp", "roads/._roads.shp",
+                             "roads/roads.shp", "roads/roads.dbf"])
+        self.assertEqual(shp_member(zipf), "roads/roads.shp")
+
+    def test_no_shapefile(self):
+        self.assertIsNone(shp_member(self.archive(["__MACOSX/._roads.shp", "a.txt"])))
+
+
+@requires_postgis
+class TestChunkedShapefile(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        points = [(n * 0.01, 32 + n * 0.02) for n in range(25)]
+        shp = write_shapefile(os.path.join(self.directory, "points"), POINT, points,
+                              [("NAME", "C", 10), ("COUNT", "N", 5)],
+                              [["p{}".format(n), n] for n in range(25)])
+        self.zip_path = zip_shapefile(shp, os.path.join(self.directory, "points.zip"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def load(self, chunk_size, datafile=None):
+        if datafile is None:
+            datafile = make_datafile(self.zip_path, "shapefile_zip")
+        with self.settings(MAPFILES_SHAPEFILE_CHUNK_SIZE=chunk_size,
+                           MAPFILES_INGEST_BATCH_SIZE=4):
+            with mock.patch.object(tasks, "chord", eager_chord):
+                tasks.process_files(datafile.id, "shapefile_zip")
+        return DataFile.objects.get(id=datafile.id)
+
+    def features(self, datafile):
+        return sorted((feat.properties["NAME"], feat.properties["COUNT"],
+                       feat.geom_point.wkt)
+                      for feat in Feature.objects.filter(datafile=datafile))
+
+    def test_chunked_matches_serial(self):
+        serial = self.load(None)
+        chunked = self.load(10)
+        self.assertEqual(len(self.features(serial)), 25)
+        self.assertEqual(self.features(chunked), self.features(serial))
+        self.assertTrue(chunked.processed)
+        self.assertEqual(chunked.geom_type, serial.geom_type)
+
+    def test_each_chunk_keeps_its_own_checkpoint(self):
+        chunked = self.load(10)
+        self.assertEqual(
+            sorted(IngestCheckpoint.objects.filter(datafile=chunked)
+                   .values_list('start', 'position')),
+            [(0, 10), (10, 20), (20, 25)])
+
+    def test_stop_past_the_end_loads_everything(self):
+        datafile = make_datafile(self.zip_path, "shapefile_zip")
+        processor = ProcessShapefile("shapefile_zip")
+        shapefile = processor.get_path(datafile.id)
+        self.assertEqual(processor.process_shapefile(shapefile, 0, 1000), 25)
+
+    def test_layer_info_leaves_other_columns_alone(self):
+        datafile = make_datafile(self.zip_path, "shapefile_zip")
+        processor = ProcessShapefile("shapefile_zip")
+        shapefile = processor.get_path(datafile.id)
+        ## Changed by someone else while this processor holds a copy
+        DataFile.objects.filter(id=datafile.id).update(version=7)
+        processor.process_shapefile(shapefile)
+        datafile = DataFile.objects.get(id=datafile.id)
+        self.assertEqual(datafile.version, 7)
+        self.assertEqual(datafile.geom_type, "Point")
+        self.assertTrue(datafile.srs_wkt)
+
+    def test_finalize_times_the_whole_load(self):
+        chunked = self.load(10)
+        stats = ProcessingStats.objects.filter(datafile=chunked)
+        chunks = stats.filter(label__contains="[")
+        finalize = stats.get(label__endswith="finalize")
+        self.assertEqual(chunks.count(), 3)
+        self.assertEqual(finalize.features, 25)
+        ## The chunks ran one after another here, inside the load.
+        self.assertGreaterEqual(finalize.elapsed,
+                                sum(chunk.elapsed for chunk in chunks))
+
+    def test_only_the_parent_finds_the_path(self):
+        get_path = ProcessShapefile.get_path
+        with mock.patch.object(ProcessShapefile, "get_path", autospec=True,
+                               side_effect=get_path) as patched:
+            self.load(10)
+        self.assertEqual(patched.call_count, 1)
+
+    def interrupt(self, datafile, start, position):
+        """Pretend the load of the range at `start` died after committing
+        up to `position`: drop its later features and wind it back."""
+        stop = IngestCheckpoint.objects.get(datafile=datafile, start=start).position
+        Feature.objects.filter(id__in=[
+            feat.id for feat in Feature.objects.filter(datafile=datafile)
+            if position <= feat.properties["COUNT"] < stop]).delete()
+        IngestCheckpoint.objects.filter(datafile=datafile, start=start).update(
+            position=position)
+        DataFile.objects.filter(id=datafile.id).update(processed=False)
+
+    def test_interrupted_chunk_resumes(self):
+        serial = self.load(None)
+        chunked = self.load(10)
+        self.interrupt(chunked, 10, 14)
+        self.assertEqual(Feature.objects.filter(datafile=chunked).count(), 19)
+        chunked = self.load(10, chunked)
+        self.assertEqual(self.features(chunked), self.features(serial))
+        self.assertTrue(chunked.processed)
+
+    def test_interrupted_serial_load_resumes(self):
+        serial = self.load(None)
+        datafile = self.load(None)
+        self.interrupt(datafile, 0, 12)
+        datafile = self.load(None, datafile)
+        self.assertEqual(self.features(datafile), self.features(serial))
+
+    def test_rechunked_load_starts_over(self):
+        serial = self.load(None)
+        chunked = self.load(10)
+        self.interrupt(chunked, 10, 14)
+        version = chunked.version
+        chunked = self.load(5, chunked)
+        self.assertEqual(self.features(chunked), self.features(serial))
+        self.assertEqual(
+            sorted(IngestCheckpoint.objects.filter(datafile=chunked)
+                   .values_list('start', 'position', 'chunk_size')),
+            [(0, 5, 5), (5, 10, 5), (10, 15, 5), (15, 20, 5), (20, 25, 5)])
+        self.assertGreater(chunked.version, version)
+
+    def test_chunked_load_after_serial_starts_over(self):
+        serial = self.load(None)
+        datafile = self.load(None)
+        self.interrupt(datafile, 0, 12)
+        datafile = self.load(10, datafile)
+        self.assertEqual(self.features(datafile), self.features(serial))
+
+    def test_writer_refuses_checkpoint_of_another_chunk_size(self):
+        datafile = make_datafile(self.zip_path, "shapefile_zip")
+        IngestCheckpoint.objects.create(datafile=datafile, start=0,
+                                        position=4, chunk_size=10)
+        with self.assertRaises(ProcessingException):
+            FeatureWriter(datafile, start=0, chunk_size=5)
+        self.assertEqual(FeatureWriter(datafile, start=0, chunk_size=10)
+                         .resume_position, 4)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_simplify
+------------
+
+Tests for building the simplified geometries vector tiles are drawn
+from, including the shared ones for census boundaries.
+"""
+
+import math
+import unittest
+
+from django.contrib.gis.geos import LineString, MultiLineString, MultiPolygon, Point
+from django.test import TestCase
+
+from djangomapfiles.models import Boundary, DataFile, Feature
+from djangomapfiles.models import SimplifiedBoundary, SimplifiedGeometry
+from djangomapfiles.file_processors import simplify
+from djangomapfiles.file_processors.simplify import build_simplified_geometries
+
+from .utils import requires_postgis
+
+ZOOMS = (4, 8)
+
+
+def circle(x, y=0, radius=1):
+    """A polygon with plenty of vertices to simplify away."""
+    return MultiPolygon(Point(x, y).buffer(radius, quadsegs=64), srid=4326)
+
+def wave(y=0, points=500):
+    """A gentle wave: a straight line at low zooms, a few segments at
+    higher ones."""
+    return MultiLineString(LineString([(n * 0.01, y + 0.02 * math.sin(n * 0.1))
+                                       for n in range(points)]), srid=4326)
+
+
+class TestBands(unittest.TestCase):
+
+    def test_tolerance_is_a_pixel(self):
+        self.assertAlmostEqual(simplify.tolerance_for_zoom(0), 360.0 / 256)
+        self.assertAlmostEqual(simplify.tolerance_for_zoom(1), 180.0 / 256)
+
+    def test_band_for_zoom(self):
+        zooms = (6, 10, 14)
+        self.assertEqual(simplify.band_for_zoom(2, zooms), 6)
+        self.assertEqual(simplify.band_for_zoom(6, zooms), 6)
+        self.assertEqual(simplify.band_for_zoom(7, zooms), 10)
+        self.assertIsNone(simplify.band_for_zoom(15, zooms))
+
+    def test_band_for_tolerance(self):
+        zooms = (6, 10, 14)
+        self.assertEqual(simplify.band_for_tolerance(1.0, zooms), 6)
+        self.assertEqual(simplify.band_for_tolerance(simplify.tolerance_for_zoom(10), zooms), 10)
+        self.assertIsNone(simplify.band_for_tolerance(1e-9, zooms))
+
+
+@requires_postgis
+class TestSimplifiedGeometries(TestCase):
+
+    def setUp(self):
+        self.datafile = DataFile.objects.create(name="roads", file_type="geojson",
+                                                stored_file="roads.geojson")
+        self.lines = [Feature.objects.create(datafile=self.datafile,
+                                             geom_multilinestring=wave(n))
+                      for n in range(3)]
+        self.point = Feature.objects.create(datafile=self.datafile,
+                                            geom_point=Point(0, 0, srid=4326))
+
+    def test_lines_get_a_copy_per_band_and_points_none(self):
+        self.assertEqual(build_simplified_geometries(self.datafile.id, ZOOMS), 6)
+        self.assertEqual(
+            sorted(SimplifiedGeometry.objects.values_list('feature_id', 'zoom')),
+            sorted((feat.id, zoom) for feat in self.lines for zoom in ZOOMS))
+
+    def test_copies_have_fewer_vertices_at_lower_zooms(self):
+        build_simplified_geometries(self.datafile.id, ZOOMS)
+        line = self.lines[0]
+        coarse = SimplifiedGeometry.objects.get(feature=line, zoom=4).geometry
+        fine = SimplifiedGeometry.objects.get(feature=line, zoom=8).geometry
+        self.assertLess(coarse.num_points, fine.num_points)
+        self.assertLess(fine.num_points, line.geom_multilinestring.num_points)
+        ## Simplification stays within a pixel of the original
+        self.assertTrue(coarse.buffer(simplify.tolerance_for_zoom(4))
+                        .contains(line.geom_multilinestring))
+
+    def test_rebuilding_replaces_the_copies(self):
+        build_simplified_geometries(self.datafile.id, ZOOMS)
+        self.assertEqual(build_simplified_geometries(self.datafile.id, (4,)), 3)
+        self.assertEqual(set(SimplifiedGeometry.objects.values_list('zoom', flat=True)),
+                         set([4]))
+
+
+@requires_postgis
+class TestSimplifiedBoundaries(TestCase):
+
+    def setUp(self):
+        self.boundaries = [Boundary.objects.create(geography_type="counties",
+                                                   federal_geo_id=str(n),
+                                                   geometry=circle(n * 3))
+                           for n in range(3)]
+
+    def census_file(self, name):
+        datafile = DataFile.objects.create(name=name, file_type="counties",
+                                           stored_file=name)
+        for boundary in self.boundaries:
+            Feature.objects.create(datafile=datafile, boundary=boundary,
+                                   federal_geo_id=boundary.federal_geo_id)
+        return datafile
+
+    def test_boundaries_are_simplified_once(self):
+        first = self.census_file("first.csv")
+        second = self.census_file("second.csv")
+        self.assertEqual(build_simplified_geometries(first.id, ZOOMS), 6)
+        self.assertEqual(build_simplified_geometries(second.id, ZOOMS), 0)
+        self.assertEqual(SimplifiedBoundary.objects.count(), 6)
+        self.assertFalse(SimplifiedGeometry.objects.exists())
+
+    def test_changed_boundaries_are_simplified_again(self):
+        datafile = self.census_file("counties.csv")
+        build_simplified_geometries(datafile.id, ZOOMS)
+        changed = self.boundaries[0]
+        changed.geometry = circle(0, radius=2)
+        changed.save()
+        self.assertEqual(build_simplified_geometries(datafile.id, ZOOMS), 2)
+        for simplified in SimplifiedBoundary.objects.filter(boundary=changed):
+            self.assertEqual(simplified.content_hash, changed.content_hash)
+            self.assertGreater(simplified.geometry.area, 10)
+
+    def test_simplified_boundaries_have_fewer_vertices(self):
+        datafile = self.census_file("counties.csv")
+        build_simplified_geometries(datafile.id, ZOOMS)
+        coarse = SimplifiedBoundary.objects.get(boundary=self.boundaries[0], zoom=4)
+        fine = SimplifiedBoundary.objects.get(boundary=self.boundaries[0], zoom=8)
+        self.assertLess(coarse.geometry.num_points, fine.geometry.num_points)
+        self.assertLessEqual(fine.geometry.num_points,
+                             self.boundaries[0].geometry.num_points)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_tiger
+------------
+
+Tests for loading TIGER/Line shapefiles into the Boundary table.
+"""
+
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from djangomapfiles.models import Boundary
+from djangomapfiles.file_processors.exceptions import ShapefileException
+from djangomapfiles.file_processors.tiger import TigerLoader, shapefile_path
+
+from .utils import POLYGON, square, write_shapefile, zip_shapefile
+
+
+class TestTigerLoader(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.geo_ids = ["060{:02d}".format(n) for n in range(5)]
+        self.archive = self.write("tl_2020_06_county", self.geo_ids, size=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, geo_ids, size, field="GEOID"):
+        path = os.path.join(self.directory, name)
+        shp = write_shapefile(path, POLYGON,
+                              [square(n, size=size) for n in range(len(geo_ids))],
+                              [(field, "C", 5), ("NAME", "C", 20)],
+                              [[geo_id, "County {}".format(geo_id)] for geo_id in geo_ids])
+        return zip_shapefile(shp, path + ".zip")
+
+    def test_archives_are_read_in_place(self):
+        self.assertTrue(shapefile_path(self.archive).startswith("/vsizip/"))
+
+    def test_load(self):
+        loader = TigerLoader("counties", batch_size=2)
+        self.assertEqual(loader.load(self.archive), 5)
+        self.assertEqual(loader.created, 5)
+        boundaries = Boundary.objects.filter(geography_type="counties")
+        self.assertEqual(sorted(boundaries.values_list('federal_geo_id', flat=True)),
+                         self.geo_ids)
+        boundary = boundaries.get(federal_geo_id="06002")
+        self.assertEqual(boundary.geometry.geom_type, "MultiPolygon")
+        self.assertEqual(boundary.geometry.extent, (2.0, 0.0, 3.0, 1.0))
+        self.assertEqual(boundary.content_hash, boundary.compute_hash())
+
+    def test_loaded_boundaries_are_kept(self):
+        TigerLoader("counties").load(self.archive)
+        loader = TigerLoader("counties")
+        loader.load(self.write("bigger", self.geo_ids, size=2))
+        self.assertEqual((loader.created, loader.updated), (0, 0))
+        self.assertEqual(Boundary.objects.get(federal_geo_id="06000").geometry.extent,
+                         (0.0, 0.0, 1.0, 1.0))
+
+    def test_replace_updates_changed_boundaries(self):
+        TigerLoader("counties").load(self.archive)
+        loader = TigerLoader("counties", replace=True)
+        loader.load(self.archive)
+        self.assertEqual(loader.updated, 0)
+        loader.load(self.write("bigger", self.geo_ids, size=2))
+        self.assertEqual(loader.updated, 5)
+        self.assertEqual(Boundary.objects.get(federal_geo_id="06000").geometry.extent,
+                         (0.0, 0.0, 2.0, 2.0))
+
+    def test_geoid_field(self):
+        archive = self.write("renamed", self.geo_ids, size=1, field="CODE")
+        with self.assertRaises(ShapefileException):
+            TigerLoader("counties").load(archive)
+        self.assertEqual(TigerLoader("counties", geoid_field="CODE").load(archive), 5)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_tiles
+------------
+
+Tests for serving a data file as Mapbox Vector Tiles.
+"""
+
+import unittest
+
+from django.contrib.gis.geos import MultiPolygon, Polygon
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from djangomapfiles import tiles
+from djangomapfiles.models import Boundary, DataFile, Feature, SimplifiedGeometry
+
+from .utils import requires_postgis, square
+
+## 10..11 degrees east and north falls in tile 2/2/1
+TILE = (2, 2, 1)
+EMPTY_TILE = (2, 0, 0)
+
+
+def cell(x, y):
+    return MultiPolygon(Polygon(*square(x, y)), srid=4326)
+
+
+class TestTileEnvelope(unittest.TestCase):
+
+    def test_zoom_zero_is_the_world(self):
+        extent = tiles.MERCATOR_EXTENT
+        self.assertEqual(tiles.tile_envelope(0, 0, 0), (-extent, -extent, extent, extent))
+
+    def test_tiles_split_in_quarters(self):
+        xmin, ymin, xmax, ymax = tiles.tile_envelope(1, 1, 0)
+        self.assertEqual((xmin, ymax), (0, tiles.MERCATOR_EXTENT))
+        self.assertAlmostEqual(xmax - xmin, tiles.MERCATOR_EXTENT)
+        self.assertAlmostEqual(ymin, 0)
+
+
+@requires_postgis
+class TestRenderTile(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.datafile = DataFile.objects.create(name="squares", file_type="geojson",
+                                                stored_file="squares.geojson")
+        self.feature = Feature.objects.create(datafile=self.datafile,
+                                              geom_multipolygon=cell(10, 10))
+
+    def test_tile_with_features(self):
+        tile = tiles.render_tile(self.datafile.id, *TILE)
+        self.assertTrue(tile)
+        self.assertIn(tiles.LAYER_NAME.encode('ascii'), tile)
+
+    def test_tile_without_features_is_empty(self):
+        self.assertEqual(tiles.render_tile(self.datafile.id, *EMPTY_TILE), b"")
+
+    def test_other_files_are_left_out(self):
+        other = DataFile.objects.create(name="other", file_type="geojson",
+                                        stored_file="other.geojson")
+        self.assertEqual(tiles.render_tile(other.id, *TILE), b"")
+
+    def test_census_features_draw_their_boundary(self):
+        census = DataFile.objects.create(name="counties", file_type="counties",
+                                         stored_file="counties.csv")
+        boundary = Boundary.objects.create(geography_type="counties",
+                                           federal_geo_id="1",
+                                           geometry=cell(10, 10))
+        Feature.objects.create(datafile=census, boundary=boundary)
+        self.assertTrue(tiles.render_tile(census.id, *TILE))
+        self.assertEqual(tiles.render_tile(census.id, *EMPTY_TILE), b"")
+
+    def test_band_for_the_zoom_is_drawn(self):
+        with self.settings(MAPFILES_SIMPLIFY_ZOOMS=(4,)):
+            full = tiles.render_tile(self.datafile.id, *TILE)
+            SimplifiedGeometry.objects.create(
+                datafile=self.datafile, feature=self.feature, zoom=4,
+                geometry=MultiPolygon(Polygon(((10, 10), (10, 11), (11, 10), (10, 10))),
+                                      srid=4326))
+            banded = tiles.render_tile(self.datafile.id, *TILE)
+        with self.settings(MAPFILES_SIMPLIFY_ZOOMS=()):
+            unbanded = tiles.render_tile(self.datafile.id, *TILE)
+        self.assertNotEqual(banded, full)
+        self.assertEqual(unbanded, full)
+
+    def test_tiles_are_cached(self):
+        tile = tiles.get_tile(self.datafile, *TILE)
+        with self.assertNumQueries(0):
+            self.assertEqual(tiles.get_tile(self.datafile, *TILE), tile)
+
+    def test_tiles_outside_the_zoom_are_refused(self):
+        with self.assertRaises(tiles.TileError):
+            tiles.get_tile(self.datafile, 2, 4, 0)
+
+    def test_view(self):
+        url = reverse('datafile_tile', kwargs={'file_id': self.datafile.id,
+                                               'z': 2, 'x': 2, 'y': 1})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], "application/vnd.mapbox-vector-tile")
+        url = reverse('datafile_tile', kwargs={'file_id': self.datafile.id,
+                                               'z': 2, 'x': 9, 'y': 1})
+        self.assertEqual(self.client.get(url).status_code, 404)
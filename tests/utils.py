@@ -0,0 +1,126 @@
+"""
+utils
+------------
+
+Helpers shared by the tests: a skip for tests that need PostgreSQL,
+and a tiny shapefile writer so fixtures can be made on the fly instead
+of being checked in.
+"""
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zipfile
+
+from django.conf import settings
+from django.db import connection
+
+from djangomapfiles.models import DataFile
+
+requires_postgis = unittest.skipUnless(connection.vendor == 'postgresql',
+                                       "needs PostGIS")
+
+WGS84_PRJ = ('GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",'
+             'SPHEROID["WGS_1984",6378137,298.257223563]],'
+             'PRIMEM["Greenwich",0],UNIT["Degree",0.017453292519943295]]')
+
+POINT = 1
+POLYGON = 5
+
+
+def _shape_content(shape_type, shape):
+    if shape_type == POINT:
+        x, y = shape
+        return struct.pack("<idd", POINT, x, y)
+    ## A polygon is a list of rings, each a closed list of (x, y)
+    points = [point for ring in shape for point in ring]
+    xs = [x for x, y in points]
+    ys = [y for x, y in points]
+    parts = []
+    start = 0
+    for ring in shape:
+        parts.append(start)
+        start += len(ring)
+    content = struct.pack("<i4d2i", POLYGON, min(xs), min(ys), max(xs), max(ys),
+                          len(shape), len(points))
+    content += struct.pack("<{}i".format(len(parts)), *parts)
+    for x, y in points:
+        content += struct.pack("<2d", x, y)
+    return content
+
+def _header(shape_type, file_length, points):
+    xs = [x for x, y in points] or [0]
+    ys = [y for x, y in points] or [0]
+    return (struct.pack(">7i", 9994, 0, 0, 0, 0, 0, file_length // 2) +
+            struct.pack("<2i4d4d", 1000, shape_type,
+                        min(xs), min(ys), max(xs), max(ys), 0, 0, 0, 0))
+
+def _dbf(fields, records):
+    """fields: [(name, 'C' or 'N', width)]; records: [[value, ...]]"""
+    record_length = 1 + sum(width for _, _, width in fields)
+    header_length = 32 + 32 * len(fields) + 1
+    data = struct.pack("<B3BIHH20x", 3, 114, 1, 1, len(records),
+                       header_length, record_length)
+    for name, field_type, width in fields:
+        data += struct.pack("<11sc4xBB14x", name.encode('ascii'),
+                            field_type.encode('ascii'), width, 0)
+    data += b"\r"
+    for record in records:
+        data += b" "
+        for (_, field_type, width), value in zip(fields, record):
+            text = str(value)
+            text = text.rjust(width) if field_type == 'N' else text.ljust(width)
+            data += text[:width].encode('ascii')
+    return data + b"\x1a"
+
+def write_shapefile(path, shape_type, shapes, fields, records):
+    """Write <path>.shp/.shx/.dbf/.prj in WGS84 and return the .shp
+    path. `shapes` are (x, y) points or lists of rings."""
+    contents = [_shape_content(shape_type, shape) for shape in shapes]
+    if shape_type == POINT:
+        points = list(shapes)
+    else:
+        points = [point for shape in shapes for ring in shape for point in ring]
+
+    records_data = b""
+    index_data = b""
+    offset = 100
+    for number, content in enumerate(contents, 1):
+        index_data += struct.pack(">2i", offset // 2, len(content) // 2)
+        records_data += struct.pack(">2i", number, len(content) // 2) + content
+        offset += 8 + len(content)
+
+    with open(path + ".shp", "wb") as f:
+        f.write(_header(shape_type, 100 + len(records_data), points) + records_data)
+    with open(path + ".shx", "wb") as f:
+        f.write(_header(shape_type, 100 + len(index_data), points) + index_data)
+    with open(path + ".dbf", "wb") as f:
+        f.write(_dbf(fields, records))
+    with open(path + ".prj", "w") as f:
+        f.write(WGS84_PRJ)
+    return path + ".shp"
+
+def zip_shapefile(shp_path, zip_path):
+    """Put a shapefile's members in a ZIP archive and return its path."""
+    base = os.path.splitext(shp_path)[0]
+    with zipfile.ZipFile(zip_path, "w") as zipf:
+        for extension in (".shp", ".shx", ".dbf", ".prj"):
+            zipf.write(base + extension, os.path.basename(base) + extension)
+    return zip_path
+
+def square(x, y=0, size=1):
+    """One ring, clockwise as shapefiles want outer rings."""
+    return [[(x, y), (x, y + size), (x + size, y + size), (x + size, y), (x, y)]]
+
+def make_datafile(path, file_type, name="test"):
+    """A DataFile whose stored_file is a copy of `path`."""
+    uploads = os.path.join(settings.MEDIA_ROOT, "uploads")
+    if not os.path.exists(uploads):
+        os.makedirs(uploads)
+    directory = tempfile.mkdtemp(dir=uploads)
+    stored = os.path.join(directory, os.path.basename(path))
+    shutil.copy(path, stored)
+    return DataFile.objects.create(name=name, file_type=file_type,
+                                   stored_file=os.path.relpath(stored, settings.MEDIA_ROOT))